@@ -1,16 +1,76 @@
 # Author: Mathieu Blondel
 # License: BSD
 
+import os
+from multiprocessing.pool import ThreadPool
+
 import numpy as np
+import scipy.sparse as sp
 
 from sklearn.base import BaseEstimator
 from sklearn.utils import safe_mask
+from sklearn.utils.extmath import safe_sparse_dot
 
 from .predict_fast import predict_alpha, decision_function_alpha
-from .kernel_fast import get_kernel
+from .predict_fast import additive_tables, decision_function_tables
+from .kernel_fast import get_kernel, get_n_threads, KernelCache
 from .random import RandomState
 
 
+ADDITIVE_KERNELS = ("intersection", "additive_chi2")
+
+# Number of rows decision_function and predict process at a time.
+CHUNK_SIZE = 10000
+
+
+def check_kernel_input(X):
+    # Kernels work on C-contiguous arrays or CSR matrices with sorted
+    # indices.
+    if getattr(X, "dtype", None) == np.uint64:
+        # Binary data packed with pack_binary.
+        return np.ascontiguousarray(X)
+
+    if sp.issparse(X):
+        X = sp.csr_matrix(X, dtype=np.float64)
+        if X.indices.dtype != np.int32 or X.indptr.dtype != np.int32:
+            # The kernels index CSR matrices with 32-bit integers.
+            if max(X.nnz, X.shape[1]) > np.iinfo(np.int32).max:
+                raise ValueError("Sparse input with %d non-zero entries "
+                                 "and %d features does not fit in 32-bit "
+                                 "indices." % (X.nnz, X.shape[1]))
+            X = sp.csr_matrix((X.data,
+                               X.indices.astype(np.int32),
+                               X.indptr.astype(np.int32)), shape=X.shape)
+        if not X.has_sorted_indices:
+            X = X.sorted_indices()
+        return X
+
+    return np.ascontiguousarray(X, dtype=np.float64)
+
+
+def available_memory():
+    """Physical memory available to new allocations, in bytes (None if
+    unknown)."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _nbytes(X):
+    if sp.issparse(X):
+        return X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+    return X.nbytes
+
+
 class BaseClassifier(BaseEstimator):
 
     def predict_proba(self, X):
@@ -40,14 +100,70 @@ class BaseClassifier(BaseEstimator):
     def _get_random_state(self):
         return RandomState(seed=self.random_state)
 
+    def _map_chunks(self, func, X, chunk_size):
+        # Yield func of successive chunks of rows of X. With n_jobs != 1,
+        # chunks are processed n_jobs at a time by a thread pool, so that
+        # at most n_jobs results are held at once.
+        X = X.tocsr() if sp.issparse(X) else np.asarray(X)
+        starts = range(0, X.shape[0], chunk_size)
+        n_threads = min(get_n_threads(getattr(self, "n_jobs", 1)),
+                        len(starts))
 
-class BaseLinearClassifier(BaseClassifier):
+        if n_threads <= 1:
+            for start in starts:
+                yield func(X[start:start + chunk_size])
+            return
+
+        pool = ThreadPool(n_threads)
+        try:
+            for k in xrange(0, len(starts), n_threads):
+                chunks = [X[start:start + chunk_size]
+                          for start in starts[k:k + n_threads]]
+                for result in pool.map(func, chunks):
+                    yield result
+        finally:
+            pool.close()
+            pool.join()
+
+    def _apply_chunks(self, func, X):
+        # func of X, computed by chunks of CHUNK_SIZE rows into a single
+        # output array.
+        X = X.tocsr() if sp.issparse(X) else np.asarray(X)
+        if X.shape[0] <= CHUNK_SIZE:
+            return func(X)
+
+        out = None
+        start = 0
+        for result in self._map_chunks(func, X, CHUNK_SIZE):
+            if out is None:
+                out = np.empty((X.shape[0],) + result.shape[1:],
+                               dtype=result.dtype)
+            out[start:start + result.shape[0]] = result
+            start += result.shape[0]
+
+        return out
 
     def decision_function(self, X):
-        return np.dot(X, self.coef_.T) + self.intercept_
+        return self._apply_chunks(self._decision_function, X)
+
+    def iter_decision_function(self, X, chunk_size=CHUNK_SIZE):
+        """Yield the decision function of X by chunks of chunk_size rows.
+
+        Chunks are computed n_jobs at a time, so that scores can be written
+        out as they come without holding those of all of X in memory."""
+        return self._map_chunks(self._decision_function, X, chunk_size)
 
     def predict(self, X):
-        pred = self.decision_function(X)
+        return self._apply_chunks(self._predict, X)
+
+
+class BaseLinearClassifier(BaseClassifier):
+
+    def _decision_function(self, X):
+        return safe_sparse_dot(X, self.coef_.T) + self.intercept_
+
+    def _predict(self, X):
+        pred = self._decision_function(X)
         return self.label_binarizer_.inverse_transform(pred, threshold=0)
 
 
@@ -59,22 +175,56 @@ class BaseKernelClassifier(BaseClassifier):
         else:
             return np.sum(np.sum(self.coef_ != 0, axis=0, dtype=bool))
 
-    def decision_function(self, X):
-        X = np.ascontiguousarray(X, dtype=np.float64)
+    def build_tables(self, n_bins=500):
+        """Evaluate the additive kernel from per-dimension lookup tables in
+        decision_function and predict.
+
+        The tables of the intersection kernel are exact and built by fit.
+        Those of the chi2 kernel interpolate each feature linearly between
+        n_bins points up to its largest support vector value: the error
+        decreases quadratically with n_bins, and values beyond the last
+        point are extrapolated. Set tables_ to None to go back to the exact
+        kernel."""
+        if self.kernel not in ADDITIVE_KERNELS:
+            raise ValueError("Lookup tables require an additive kernel.")
+
+        self.tables_ = additive_tables(self._get_kernel(),
+                                       self.support_vectors_, self.coef_,
+                                       n_bins)
+        return self
+
+    def _decision_function(self, X):
+        X = self._check_input(X)
         out = np.zeros((X.shape[0], self.coef_.shape[0]), dtype=np.float64)
 
-        if self.support_indices_.shape[0] != 0:
+        if self.support_indices_.shape[0] == 0:
+            return out
+
+        tables = getattr(self, "tables_", None)
+        if tables is not None:
+            grid, values, left, right = tables
+            decision_function_tables(X, grid, values, left, right,
+                                     self.intercept_, out)
+        else:
             sv = self.support_vectors_ if self.kernel != "precomputed" else X
             decision_function_alpha(X, sv, self.coef_, self.intercept_,
                                     self._get_kernel(), out)
 
         return out
 
-    def predict(self, X):
-        X = np.ascontiguousarray(X, dtype=np.float64)
+    def _predict(self, X):
+        X = self._check_input(X)
         out = np.zeros(X.shape[0], dtype=np.float64)
 
-        if self.support_indices_.shape[0] != 0:
+        if self.support_indices_.shape[0] != 0 and \
+           getattr(self, "tables_", None) is not None:
+            pred = self._decision_function(X)
+            if pred.shape[1] == 1:
+                out[pred[:, 0] > 0] = self.classes_[1]
+                out[pred[:, 0] < 0] = self.classes_[0]
+            else:
+                out[:] = self.classes_[pred.argmax(axis=1)]
+        elif self.support_indices_.shape[0] != 0:
             sv = self.support_vectors_ if self.kernel != "precomputed" else X
             predict_alpha(X, sv, self.coef_, self.intercept_,
                           self.classes_, self._get_kernel(), out)
@@ -84,6 +234,9 @@ class BaseKernelClassifier(BaseClassifier):
 
         return out
 
+    def _check_input(self, X):
+        return check_kernel_input(X)
+
     def _kernel_params(self):
         return {"gamma" : self.gamma,
                 "degree" : self.degree,
@@ -92,14 +245,89 @@ class BaseKernelClassifier(BaseClassifier):
     def _get_kernel(self):
         return get_kernel(self.kernel, **self._kernel_params())
 
+    def _get_cache_mb(self, n_samples, arrays=()):
+        # arrays are the ones fit has allocated, which count towards
+        # memory_limit.
+        mb = float(1 << 20)
+        itemsize = 4 if self.cache_dtype in ("float32", np.float32) else 8
+        gram_mb = n_samples * (n_samples * itemsize +
+                               (n_samples + 63) / 64 * 8) / mb
+        # The same array may be passed twice (e.g. X as the components).
+        arrays = dict((id(a), a) for a in arrays).values()
+        used_mb = sum(_nbytes(a) for a in arrays) / mb
+
+        if self.cache_mb == "auto":
+            # Half of the available memory, but no more than the Gram
+            # matrix.
+            available = available_memory()
+            if available is None:
+                cache_mb = 500
+            else:
+                cache_mb = max(available / mb / 2 - used_mb, 0)
+            cache_mb = min(cache_mb, gram_mb)
+        else:
+            cache_mb = self.cache_mb
+
+        memory_limit = getattr(self, "memory_limit", None)
+        if memory_limit is not None:
+            if used_mb > memory_limit:
+                raise ValueError("memory_limit is too small: fit already "
+                                 "uses %.1f MB without the kernel cache." %
+                                 used_mb)
+            cache_mb = min(cache_mb, memory_limit - used_mb)
+
+        return cache_mb
+
+    def _get_kernel_cache(self, n_samples, arrays=(), **kw):
+        self.cache_mb_ = self._get_cache_mb(n_samples, arrays)
+        return KernelCache(self._get_kernel(), n_samples, self.cache_mb_, 1,
+                           self.verbose, policy=self.cache_policy,
+                           dtype=self.cache_dtype, n_jobs=self.n_jobs, **kw)
+
+    def _fit_binary(self, fit, n_vectors, kcache, rs):
+        # Call fit(i, kcache, rs) for each binary subproblem. With
+        # ovr_jobs != 1, subproblems run in threads, each with a fork of
+        # kcache (the columns are shared) and its own random state.
+        n_threads = min(get_n_threads(self.ovr_jobs), n_vectors)
+
+        if n_threads <= 1:
+            return [fit(i, kcache, rs) for i in xrange(n_vectors)]
+
+        max_seed = np.iinfo(np.int32).max
+        seeds = [rs.randint(max_seed) for i in xrange(n_vectors)]
+
+        def _fit(i):
+            # The fork prefetches if kcache does.
+            view = kcache.fork()
+            try:
+                return fit(i, view, rs.__class__(seeds[i]))
+            finally:
+                view.stop_prefetch()
+
+        pool = ThreadPool(n_threads)
+        try:
+            return pool.map(_fit, xrange(n_vectors))
+        finally:
+            pool.close()
+            pool.join()
+
     def _post_process(self, X):
         # We can't know the support vectors when using precomputed kernels.
         if self.kernel != "precomputed":
             sv = np.sum(self.coef_ != 0, axis=0, dtype=bool)
             self.coef_ = np.ascontiguousarray(self.coef_[:, sv])
             mask = safe_mask(X, sv)
-            self.support_vectors_ = np.ascontiguousarray(X[mask])
+            self.support_vectors_ = X[mask]
+            if not sp.issparse(X):
+                self.support_vectors_ = np.ascontiguousarray(
+                    self.support_vectors_)
             self.support_indices_ = np.arange(X.shape[0], dtype=np.int32)[sv]
 
+        # The intersection kernel is evaluated exactly from per-dimension
+        # lookup tables. Other kernels use them only after build_tables.
+        self.tables_ = None
+        if self.kernel == "intersection":
+            self.build_tables()
+
         if self.verbose >= 1:
             print "Number of support vectors:", np.sum(sv)
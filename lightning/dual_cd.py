@@ -62,14 +62,22 @@ class DualLinearSVC(BaseLinearClassifier, ClassifierMixin):
 
 
 class DualSVC(BaseKernelClassifier, ClassifierMixin):
+    """Kernel SVM solved by coordinate descent in the dual.
+
+    With prefetch > 0, a worker thread computes the next kernel columns the
+    solver needs. With ovr_jobs != 1, the binary subproblems run in threads
+    sharing the kernel cache, each with its own prefetch worker."""
 
     def __init__(self, C=1.0, loss="l1", max_iter=10, tol=1e-3,
                  shrinking=True, kernel="linear", gamma=0.1, coef0=1, degree=4,
                  selection="permute", search_size=60,
                  termination="convergence", n_components=1000,
                  warm_start=False, random_state=None, cache_mb=500,
-                 callback=None,
-                 verbose=0, n_jobs=1):
+                 memory_limit=None, cache_policy="lru",
+                 cache_dtype="float64", compact_sv=False,
+                 cache_arena=False, huge_pages=False, cache_symmetric=False,
+                 prefetch=0, spill_mb=0, spill_dir=None, callback=None,
+                 verbose=0, n_jobs=1, ovr_jobs=1):
         self.C = C
         self.loss = loss
         self.max_iter = max_iter
@@ -86,15 +94,27 @@ class DualSVC(BaseKernelClassifier, ClassifierMixin):
         self.warm_start = warm_start
         self.random_state = random_state
         self.cache_mb = cache_mb
+        self.memory_limit = memory_limit
+        self.cache_policy = cache_policy
+        self.cache_dtype = cache_dtype
+        self.compact_sv = compact_sv
+        self.cache_arena = cache_arena
+        self.huge_pages = huge_pages
+        self.cache_symmetric = cache_symmetric
+        self.prefetch = prefetch
+        self.spill_mb = spill_mb
+        self.spill_dir = spill_dir
         self.callback = callback
         self.verbose = verbose
         self.n_jobs = n_jobs
+        self.ovr_jobs = ovr_jobs
         self.support_vectors_ = None
         self.coef_ = None
 
-    def fit(self, X, y):
+    def fit(self, X, y, kcache=None):
         n_samples = X.shape[0]
         rs = self._get_random_state()
+        X = self._check_input(X)
 
         self.label_binarizer_ = LabelBinarizer(neg_label=-1, pos_label=1)
         Y = self.label_binarizer_.fit_transform(y).astype(np.float64)
@@ -110,13 +130,24 @@ class DualSVC(BaseKernelClassifier, ClassifierMixin):
 
         coef = np.empty(0, dtype=np.float64)
 
-        kernel = self._get_kernel()
-        kcache = KernelCache(kernel, n_samples, self.cache_mb, 1, self.verbose)
+        if kcache is None:
+            kcache = self._get_kernel_cache(n_samples, (X, Y, self.coef_),
+                                            spill_capacity=self.spill_mb,
+                                            spill_dir=self.spill_dir,
+                                            compact_sv=self.compact_sv,
+                                            arena=self.cache_arena,
+                                            huge_pages=self.huge_pages,
+                                            symmetric=self.cache_symmetric)
+        else:
+            # Keep the cached values, but solvers rebuild the support set
+            # from coef_.
+            kcache.set_kernel(self._get_kernel())
+            kcache.clear_sv()
 
         self.support_vectors_ = X
         self.intercept_ = np.zeros(n_vectors, dtype=np.float64)
 
-        for i in xrange(n_vectors):
+        def _fit(i, kcache, rs):
             _dual_cd(self, coef, self.coef_[i],
                      X, Y[:, i], kcache, False,
                      self.selection, self.search_size,
@@ -124,8 +155,15 @@ class DualSVC(BaseKernelClassifier, ClassifierMixin):
                      self.C, self.loss, self.max_iter, rs, self.tol,
                      self.shrinking, self.callback, verbose=self.verbose)
 
+        kcache.start_prefetch(X, X, self.prefetch)
+        try:
+            self._fit_binary(_fit, n_vectors, kcache, rs)
+        finally:
+            kcache.stop_prefetch()
+
         sv = np.sum(self.coef_ != 0, axis=0, dtype=bool)
         self.support_indices_ = np.arange(n_samples)[sv]
+        self.cache_stats_ = kcache.get_stats()
 
         self._post_process(X)
 
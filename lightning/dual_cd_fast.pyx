@@ -12,14 +12,14 @@ from cython.operator cimport dereference as deref
 from cython.operator cimport preincrement as inc
 from cython.operator cimport predecrement as dec
 
-from libcpp.list cimport list
 from libcpp.vector cimport vector
 
 import numpy as np
 cimport numpy as np
 
-from lightning.kernel_fast cimport KernelCache
+from lightning.kernel_fast cimport KernelCache, MISS_BLOCK
 from lightning.select_fast cimport get_select_method, select_sv
+from lightning.select_fast cimport cache_aware_order
 from lightning.random.random_fast cimport RandomState
 
 cdef extern from "math.h":
@@ -32,7 +32,7 @@ cdef extern from "float.h":
 def _dual_cd(self,
              np.ndarray[double, ndim=1, mode='c'] w,
              np.ndarray[double, ndim=1, mode='c'] alpha,
-             np.ndarray[double, ndim=2, mode='c'] X,
+             X,
              np.ndarray[double, ndim=1]y,
              KernelCache kcache,
              int linear_kernel,
@@ -65,6 +65,11 @@ def _dual_cd(self,
         U = DBL_MAX
         D_ii = 1.0 / (2 * C)
 
+    # Only the linear solver reads X directly.
+    cdef np.ndarray[double, ndim=2, mode='c'] Xd
+    if linear_kernel:
+        Xd = X
+
     cdef np.ndarray[double, ndim=1, mode='c'] col
     col = np.zeros(n_samples, dtype=np.float64)
 
@@ -87,12 +92,16 @@ def _dual_cd(self,
     cdef double step
     cdef int r
 
-    cdef list[int].iterator it
+    cdef int k
+    cdef int[::1] support_set
 
     cdef int select_method = get_select_method(selection)
     cdef int check_n_sv = termination == "n_components"
     cdef int check_convergence = termination == "convergence"
-    cdef int permute = selection == "permute" or linear_kernel
+    cdef int permute = selection in ("permute", "cache_aware") or \
+                       linear_kernel
+    cdef int cache_aware = select_method == 4 and not linear_kernel
+    cdef int next_fill = 0
     cdef int has_callback = callback is not None
     cdef int stop = 0
 
@@ -109,6 +118,10 @@ def _dual_cd(self,
         if permute:
             rs.shuffle(A[:active_size])
 
+        if cache_aware:
+            # Visit the cached columns first.
+            next_fill = cache_aware_order(A, active_size, kcache)
+
         M = -DBL_MAX
         m = DBL_MAX
 
@@ -128,17 +141,21 @@ def _dual_cd(self,
                 # G = y_i * np.dot(w, X[i]) - 1 + D_ii * alpha_i
                 G = 0
                 for j in xrange(n_features):
-                    G += w[j] * X[i, j]
+                    G += w[j] * Xd[i, j]
                 G = y_i * G - 1 + D_ii * alpha_i
             else:
                 # G = np.dot(Q_bar, alpha)[i] - 1
                 G = -1
+                if cache_aware and s >= next_fill:
+                    next_fill = min(s + MISS_BLOCK, active_size)
+                    kcache.fill_columns(X, X, A, s, next_fill)
                 kcache.compute_column_sv(X, X, i, col)
-                it = kcache.support_set.begin()
-                while it != kcache.support_set.end():
-                    j = deref(it)
+                if permute:
+                    kcache.prefetch(A, s + 1, active_size)
+                support_set = kcache.get_support_set()
+                for k in xrange(support_set.shape[0]):
+                    j = support_set[k]
                     G += col[j] * y[i] * alpha[j]
-                    inc(it)
                 G += D_ii * alpha_i
 
             PG = 0
@@ -182,7 +199,7 @@ def _dual_cd(self,
 
                 if linear_kernel:
                     step = (alpha_i - alpha_old) * y_i
-                    w += step * X[i]
+                    w += step * Xd[i]
 
             # Exit if necessary.
             if check_n_sv and kcache.n_sv() >= n_components:
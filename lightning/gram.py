@@ -0,0 +1,83 @@
+# Author: Mathieu Blondel
+# License: BSD
+
+import hashlib
+import os
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from .base import check_kernel_input
+from .kernel_fast import get_kernel, get_n_threads
+from .shared_cache_fast import fingerprint
+
+
+def gram_matrix_path(X, cache_dir, kernel="linear", gamma=0.1, coef0=1,
+                     degree=4):
+    """Path of the file storing the Gram matrix of X in cache_dir."""
+    kernel = get_kernel(kernel, gamma=gamma, coef0=coef0, degree=degree)
+    key = fingerprint(check_kernel_input(X)) + repr(kernel._params())
+    name = "gram-%s.npy" % hashlib.sha1(key).hexdigest()[:24]
+    return os.path.join(cache_dir, name)
+
+
+def gram_matrix(X, cache_dir, kernel="linear", gamma=0.1, coef0=1,
+                degree=4, block_size=1000, n_jobs=1, verbose=0):
+    """Return the Gram matrix of X, memory-mapped from cache_dir.
+
+    The first call for given data and kernel parameters computes the matrix
+    by blocks of block_size rows, n_jobs blocks at a time, into a .npy file
+    named after their hash. Later calls only map the file, so that estimators
+    with kernel="precomputed" page in the columns they use.
+    """
+    if kernel == "precomputed":
+        raise ValueError("The kernel must not be precomputed.")
+
+    X = check_kernel_input(X)
+    path = gram_matrix_path(X, cache_dir, kernel, gamma, coef0, degree)
+
+    if not os.path.exists(path):
+        _build(X, path, get_kernel(kernel, gamma=gamma, coef0=coef0,
+                                   degree=degree),
+               block_size, n_jobs, verbose)
+
+    # Read-only: unlike a copy-on-write mapping, it doesn't need memory to
+    # back the whole store.
+    return np.load(path, mmap_mode="r")
+
+
+def _build(X, path, kernel, block_size, n_jobs, verbose):
+    n_samples = X.shape[0]
+    # Write to a temporary file first, so that other processes never map a
+    # partial matrix.
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    K = open_memmap(tmp, mode="w+", dtype=np.float64,
+                    shape=(n_samples, n_samples))
+
+    def _fill(start):
+        rows = np.arange(start, min(start + block_size, n_samples),
+                         dtype=np.int32)
+        out = np.zeros((len(rows), n_samples), dtype=np.float64)
+        kernel.compute_block(X, rows, X, None, out)
+        K[rows[0]:rows[-1] + 1] = out
+        if verbose >= 1:
+            print "Computed Gram matrix rows", rows[0], "to", rows[-1]
+
+    n_jobs = get_n_threads(n_jobs)
+
+    starts = range(0, n_samples, block_size)
+    if n_jobs == 1:
+        for start in starts:
+            _fill(start)
+    else:
+        pool = ThreadPool(n_jobs)
+        try:
+            pool.map(_fill, starts)
+        finally:
+            pool.close()
+            pool.join()
+
+    K.flush()
+    K = None
+    os.rename(tmp, path)
@@ -0,0 +1,218 @@
+# Author: Mathieu Blondel
+# License: BSD
+
+import numpy as np
+import scipy.sparse as sp
+
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.utils import check_random_state
+from sklearn.utils.extmath import safe_sparse_dot
+
+from .base import check_kernel_input
+from .kernel_fast import get_kernel, KernelCache
+
+
+def _sample(p, rs):
+    # Draw an index with probability proportional to p.
+    cumsum = np.cumsum(p)
+    return min(np.searchsorted(cumsum, rs.rand() * cumsum[-1]), len(p) - 1)
+
+
+def _sample_without_replacement(p, n_samples, rs):
+    p = p.copy()
+    ind = np.zeros(n_samples, dtype=np.int32)
+
+    for k in xrange(n_samples):
+        if p.sum() <= 0:
+            # The remaining points have zero weight: fall back to uniform.
+            p[p == 0] = 1
+            p[ind[:k]] = 0
+        ind[k] = _sample(p, rs)
+        p[ind[k]] = 0
+
+    return ind
+
+
+def _uniform_landmarks(kernel, X, n_components, rs):
+    return rs.permutation(X.shape[0])[:n_components].astype(np.int32)
+
+
+def _kmeanspp_landmarks(kernel, X, n_components, rs):
+    # k-means++ seeding in the feature space induced by the kernel.
+    n_samples = X.shape[0]
+    diag = np.zeros(n_samples, dtype=np.float64)
+    KernelCache(kernel, n_samples, 0, 0, 0).compute_diag(X, diag)
+
+    ind = np.zeros(n_components, dtype=np.int32)
+    ind[0] = rs.randint(n_samples)
+    col = np.zeros((n_samples, 1), dtype=np.float64)
+    dist = np.empty(n_samples, dtype=np.float64)
+    dist.fill(np.inf)
+
+    for k in xrange(n_components):
+        if k > 0:
+            d = np.maximum(dist, 0)
+            d[ind[:k]] = 0
+            ind[k] = _sample_without_replacement(d, 1, rs)[0]
+        kernel.compute_block(X, None, X, (ind[k],), col)
+        new = diag + diag[ind[k]] - 2 * col[:, 0]
+        np.minimum(dist, new, dist)
+
+    return ind
+
+
+def _leverage_landmarks(kernel, X, n_components, rs):
+    # Approximate leverage scores from the Nystroem features of a uniform
+    # pilot sample twice the requested size.
+    n_samples = X.shape[0]
+    pilot = _uniform_landmarks(kernel, X, min(2 * n_components, n_samples),
+                               rs)
+    C = np.zeros((n_samples, len(pilot)), dtype=np.float64)
+    kernel.compute_block(X, None, X, pilot, C)
+
+    U, S, V = np.linalg.svd(C[pilot])
+    nz = S > 1e-12 * S[0]
+    Q, _ = np.linalg.qr(np.dot(C, U[:, nz] / np.sqrt(S[nz])))
+    scores = np.sum(Q ** 2, axis=1)
+
+    return _sample_without_replacement(scores, n_components, rs)
+
+
+class Nystroem(BaseEstimator, TransformerMixin):
+    """Approximate a kernel map with a subset of the training points
+    (landmarks)."""
+
+    def __init__(self, kernel="rbf", gamma=0.1, coef0=1, degree=4,
+                 n_components=100, selection="uniform", random_state=None):
+        self.kernel = kernel
+        self.gamma = gamma
+        self.coef0 = coef0
+        self.degree = degree
+        self.n_components = n_components
+        self.selection = selection
+        self.random_state = random_state
+
+    def _get_kernel(self):
+        return get_kernel(self.kernel, gamma=self.gamma, degree=self.degree,
+                          coef0=self.coef0)
+
+    def _get_selection(self):
+        selections = {
+            "uniform" : _uniform_landmarks,
+            "kmeans++" : _kmeanspp_landmarks,
+            "leverage" : _leverage_landmarks,
+        }
+        if self.selection not in selections:
+            raise ValueError("Unknown landmark selection method '%s'." %
+                             self.selection)
+        return selections[self.selection]
+
+    def fit(self, X, y=None):
+        if self.kernel == "precomputed":
+            raise ValueError("Nystroem does not support precomputed kernels.")
+
+        X = check_kernel_input(X)
+        rs = check_random_state(self.random_state)
+        kernel = self._get_kernel()
+        n_components = min(self.n_components, X.shape[0])
+
+        ind = self._get_selection()(kernel, X, n_components, rs)
+        ind = np.sort(ind)
+        self.component_indices_ = ind
+        self.components_ = X[ind]
+
+        K = np.zeros((n_components, n_components), dtype=np.float64)
+        kernel.compute_block(self.components_, None, self.components_, None, K)
+        U, S, V = np.linalg.svd(K)
+        S = np.maximum(S, 1e-12)
+        self.normalization_ = np.dot(U / np.sqrt(S), V)
+
+        return self
+
+    def transform(self, X):
+        X = check_kernel_input(X)
+        K = np.zeros((X.shape[0], self.components_.shape[0]),
+                     dtype=np.float64)
+        self._get_kernel().compute_block(X, None, self.components_, None, K)
+        return np.dot(K, self.normalization_.T)
+
+
+class BaseFeatureMap(BaseEstimator, TransformerMixin):
+
+    def iter_transform(self, X, chunk_size=1000):
+        """Transform X by chunks of chunk_size rows.
+
+        Only one chunk of the feature map is held in memory at a time."""
+        for start in xrange(0, X.shape[0], chunk_size):
+            yield self.transform(X[start:start + chunk_size])
+
+
+class RandomFourierFeatures(BaseFeatureMap):
+    """Approximate the RBF kernel exp(-gamma ||x - y||^2) with random
+    Fourier features."""
+
+    def __init__(self, gamma=0.1, n_components=100, random_state=None):
+        self.gamma = gamma
+        self.n_components = n_components
+        self.random_state = random_state
+
+    def fit(self, X, y=None):
+        rs = check_random_state(self.random_state)
+        n_features = X.shape[1]
+        self.random_weights_ = np.sqrt(2 * self.gamma) * \
+                               rs.normal(size=(n_features, self.n_components))
+        self.random_offset_ = rs.uniform(0, 2 * np.pi,
+                                         size=self.n_components)
+        return self
+
+    def transform(self, X):
+        Z = safe_sparse_dot(X, self.random_weights_)
+        Z += self.random_offset_
+        np.cos(Z, Z)
+        Z *= np.sqrt(2.0 / self.n_components)
+        return Z
+
+
+class TensorSketch(BaseFeatureMap):
+    """Approximate the polynomial kernel (gamma <x, y> + coef0)^degree with
+    the tensor product of count sketches."""
+
+    def __init__(self, degree=4, coef0=1, gamma=0.1, n_components=100,
+                 random_state=None):
+        self.degree = degree
+        self.coef0 = coef0
+        self.gamma = gamma
+        self.n_components = n_components
+        self.random_state = random_state
+
+    def fit(self, X, y=None):
+        rs = check_random_state(self.random_state)
+        n_features = X.shape[1]
+
+        # One count sketch per degree, stored as a sparse projection matrix.
+        # The last row hashes the constant feature sqrt(coef0).
+        self.sketches_ = []
+        for d in xrange(self.degree):
+            hashes = rs.randint(self.n_components, size=n_features + 1)
+            signs = rs.randint(2, size=n_features + 1) * 2 - 1.0
+            S = sp.csr_matrix((signs, hashes, np.arange(n_features + 2)),
+                              shape=(n_features + 1, self.n_components))
+            self.sketches_.append(S)
+
+        return self
+
+    def transform(self, X):
+        sqrt_gamma = np.sqrt(self.gamma)
+        sqrt_coef0 = np.sqrt(self.coef0)
+        P = None
+
+        for S in self.sketches_:
+            C = safe_sparse_dot(X, S[:-1], dense_output=True) * sqrt_gamma
+            C += sqrt_coef0 * S[-1].toarray()
+            F = np.fft.fft(C, axis=1)
+            if P is None:
+                P = F
+            else:
+                P *= F
+
+        return np.real(np.fft.ifft(P, axis=1))
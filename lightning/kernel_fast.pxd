@@ -1,110 +1,456 @@
 # Author: Mathieu Blondel
 # License: BSD
 
-from libcpp.list cimport list
 from libcpp.map cimport map
+from libc.stdint cimport uint64_t
+from posix.time cimport timespec
 
 cimport numpy as np
 
+cdef extern from "pthread.h" nogil:
+    ctypedef struct pthread_mutex_t:
+        pass
+    ctypedef struct pthread_cond_t:
+        pass
+    int pthread_mutex_init(pthread_mutex_t* mutex, void* attr)
+    int pthread_mutex_destroy(pthread_mutex_t* mutex)
+    int pthread_mutex_lock(pthread_mutex_t* mutex)
+    int pthread_mutex_unlock(pthread_mutex_t* mutex)
+    int pthread_cond_init(pthread_cond_t* cond, void* attr)
+    int pthread_cond_destroy(pthread_cond_t* cond)
+    int pthread_cond_wait(pthread_cond_t* cond, pthread_mutex_t* mutex)
+    int pthread_cond_timedwait(pthread_cond_t* cond, pthread_mutex_t* mutex,
+                               timespec* abstime)
+    int pthread_cond_broadcast(pthread_cond_t* cond)
+
+# Number of missing columns fill_columns computes together.
+cdef enum:
+    MISS_BLOCK = 32
+
+cdef struct Column:
+    # float or double values, depending on the cache dtype.
+    void* data
+    # Bitmap of the entries of data holding a computed kernel value.
+    uint64_t* valid
+    # Number of entries: n_samples, or support set slots in compact mode.
+    int length
+
+cdef struct Store:
+    # Accounting shared by a cache and its forks.
+    long size
+    long clock
+    int n_free
+    int next_slot
+    long memory_hits
+    long disk_hits
+    long misses
+    long n_evals
+
+cdef struct Rows:
+    # Rows of a dense C-contiguous array (indptr is NULL) or of a CSR matrix.
+    double* data
+    int* indices
+    int* indptr
+    int n_features
+    # Squared row norms, only set for CSR matrices.
+    double* sq_norms
+
 cdef class Kernel:
+    cdef dict sq_norms
 
-    cpdef double compute(self,
-                         np.ndarray[double, ndim=2, mode='c'] X,
+    cdef double _compute(self,
+                         double* X,
                          int i,
-                         np.ndarray[double, ndim=2, mode='c'] Y,
-                         int j)
+                         double* Y,
+                         int j,
+                         int n_features) nogil
+
+    cdef double _compute_self(self,
+                              double* X,
+                              int i,
+                              int n_features) nogil
+
+    cdef double _finalize(self,
+                          double dot,
+                          double x_sq,
+                          double y_sq) nogil
+
+    cdef int _supports_sparse(self)
 
-    cpdef double compute_self(self,
-                              np.ndarray[double, ndim=2, mode='c'] X,
-                              int i)
+    cdef int _binary(self)
+
+    cdef double _base(self,
+                      double* X,
+                      int i,
+                      double* Y,
+                      int j,
+                      int n_features) nogil
+
+    cdef double _base_finalize(self,
+                               double dot,
+                               double x_sq,
+                               double y_sq) nogil
+
+    cdef double _transform(self, double value) nogil
+
+    cdef _get_sq_norms(self, X)
+
+    cpdef double compute(self, X, int i, Y, int j) except *
+
+    cpdef double compute_self(self, X, int i) except *
+
+    cpdef compute_block(self,
+                        X,
+                        rows,
+                        Y,
+                        cols,
+                        np.ndarray[double, ndim=2, mode='c'] out)
 
 cdef class LinearKernel(Kernel):
 
-    cpdef double compute(self,
-                         np.ndarray[double, ndim=2, mode='c'] X,
+    cdef double _compute(self,
+                         double* X,
                          int i,
-                         np.ndarray[double, ndim=2, mode='c'] Y,
-                         int j)
+                         double* Y,
+                         int j,
+                         int n_features) nogil
+
+    cdef int _supports_sparse(self)
+
+    cpdef compute_block(self,
+                        X,
+                        rows,
+                        Y,
+                        cols,
+                        np.ndarray[double, ndim=2, mode='c'] out)
 
 
 cdef class PolynomialKernel(Kernel):
     cdef int degree
     cdef double coef0, gamma
 
-    cpdef double compute(self,
-                         np.ndarray[double, ndim=2, mode='c'] X,
+    cdef double _compute(self,
+                         double* X,
                          int i,
-                         np.ndarray[double, ndim=2, mode='c'] Y,
-                         int j)
+                         double* Y,
+                         int j,
+                         int n_features) nogil
+
+    cdef double _finalize(self,
+                          double dot,
+                          double x_sq,
+                          double y_sq) nogil
+
+    cdef double _base(self,
+                      double* X,
+                      int i,
+                      double* Y,
+                      int j,
+                      int n_features) nogil
+
+    cdef double _base_finalize(self,
+                               double dot,
+                               double x_sq,
+                               double y_sq) nogil
+
+    cdef double _transform(self, double value) nogil
+
+    cdef int _supports_sparse(self)
+
+    cpdef compute_block(self,
+                        X,
+                        rows,
+                        Y,
+                        cols,
+                        np.ndarray[double, ndim=2, mode='c'] out)
 
 
 cdef class RbfKernel(Kernel):
     cdef double gamma
 
-    cpdef double compute(self,
-                         np.ndarray[double, ndim=2, mode='c'] X,
+    cdef double _compute(self,
+                         double* X,
+                         int i,
+                         double* Y,
+                         int j,
+                         int n_features) nogil
+
+    cdef double _compute_self(self,
+                              double* X,
+                              int i,
+                              int n_features) nogil
+
+    cdef double _finalize(self,
+                          double dot,
+                          double x_sq,
+                          double y_sq) nogil
+
+    cdef double _base(self,
+                      double* X,
+                      int i,
+                      double* Y,
+                      int j,
+                      int n_features) nogil
+
+    cdef double _base_finalize(self,
+                               double dot,
+                               double x_sq,
+                               double y_sq) nogil
+
+    cdef double _transform(self, double value) nogil
+
+    cdef int _supports_sparse(self)
+
+    cpdef compute_block(self,
+                        X,
+                        rows,
+                        Y,
+                        cols,
+                        np.ndarray[double, ndim=2, mode='c'] out)
+
+
+cdef class IntersectionKernel(Kernel):
+
+    cdef double _compute(self,
+                         double* X,
+                         int i,
+                         double* Y,
+                         int j,
+                         int n_features) nogil
+
+
+cdef class AdditiveChi2Kernel(Kernel):
+
+    cdef double _compute(self,
+                         double* X,
+                         int i,
+                         double* Y,
+                         int j,
+                         int n_features) nogil
+
+
+cdef class BinaryLinearKernel(Kernel):
+
+    cdef double _compute(self,
+                         double* X,
+                         int i,
+                         double* Y,
+                         int j,
+                         int n_features) nogil
+
+    cdef int _binary(self)
+
+
+cdef class HammingKernel(Kernel):
+    cdef double gamma
+
+    cdef double _compute(self,
+                         double* X,
+                         int i,
+                         double* Y,
+                         int j,
+                         int n_features) nogil
+
+    cdef double _compute_self(self,
+                              double* X,
+                              int i,
+                              int n_features) nogil
+
+    cdef double _base(self,
+                      double* X,
+                      int i,
+                      double* Y,
+                      int j,
+                      int n_features) nogil
+
+    cdef double _transform(self, double value) nogil
+
+    cdef int _binary(self)
+
+
+cdef class JaccardKernel(Kernel):
+
+    cdef double _compute(self,
+                         double* X,
                          int i,
-                         np.ndarray[double, ndim=2, mode='c'] Y,
-                         int j)
+                         double* Y,
+                         int j,
+                         int n_features) nogil
 
-    cpdef double compute_self(self,
-                              np.ndarray[double, ndim=2, mode='c'] X,
-                              int i)
+    cdef int _binary(self)
 
 
 cdef class PrecomputedKernel(Kernel):
 
-    cpdef double compute(self,
-                         np.ndarray[double, ndim=2, mode='c'] X,
+    cdef double _compute(self,
+                         double* X,
                          int i,
-                         np.ndarray[double, ndim=2, mode='c'] Y,
-                         int j)
+                         double* Y,
+                         int j,
+                         int n_features) nogil
+
+
+cdef Rows get_rows(Kernel kernel, X) except *
+cdef double kernel_value(Kernel kernel, Rows* X, int i, Rows* Y, int j,
+                         double* work) nogil
+cdef double base_value(Kernel kernel, Rows* X, int i, Rows* Y, int j,
+                       double* work) nogil
+cpdef int get_n_threads(int n_jobs)
+cdef int get_cache_policy(policy) except -1
+cdef int get_cache_dtype(dtype) except -1
 
 
 cdef class KernelCache(Kernel):
     cdef Kernel kernel
     cdef int n_samples
-    cdef list[int]* support_set
-    cdef list[int].iterator* support_it
+    # Support vectors in the first n_support entries of support_set, and
+    # the position of each sample in it (-1 if not a support vector).
+    cdef np.ndarray support_set
+    cdef int n_support
     cdef int* support_vector
-    cdef map[int, double*]* columns
+    # Everything below the support set is shared with the forks, which keep
+    # a reference to the cache that owns it.
+    cdef KernelCache root
+    cdef Store* store
+    cdef map[int, Column]* columns
+    # Number of threads computing entries of each column.
+    cdef int* pins
     cdef int* n_computed
+    cdef int n_words
+    cdef int single
+    cdef long col_size
+    # Columns only hold support vector entries, indexed by their position
+    # in support_set.
+    cdef int compact
+    # Values computed for a column are also stored in the other resident
+    # columns. Only used when X is Y, and all columns must then come from
+    # the same training data.
+    cdef int symmetric
+    # Columns hold base values (see Kernel._base), which the kernel
+    # transforms on read, rather than kernel values.
+    cdef int base
     cdef long capacity
     cdef int verbose
-    cdef long size
+    cdef int policy
+    cdef int n_threads
+    # Workspace for the support set entries compute_column_sv computes.
+    cdef int* missing
+    cdef long* last_access
+    cdef long* n_access
+    cdef np.ndarray work
+    # Disk tier: evicted columns are kept in slots of a memory-mapped
+    # scratch file.
+    cdef object spill_file
+    cdef np.ndarray spill
+    cdef int n_slots
+    cdef int* spill_slot
+    cdef int* spill_count
+    cdef int* slot_owner
+    # Arena: fixed-size column blocks carved out of a single mapping.
+    cdef char* arena
+    cdef long arena_size
+    cdef long block_size
+    cdef int* free_blocks
+    cdef char* staging
+    # Prefetching: a worker thread computes upcoming columns of (pf_X, pf_Y)
+    # into pf_buffer. Slot states are 0 (free), 1 (queued), 2 (computing),
+    # 3 (ready) and 4 (computing, but given up), and are protected by
+    # pf_lock.
+    cdef int pf_depth
+    cdef int pf_stop
+    cdef double* pf_buffer
+    cdef int* pf_index
+    cdef int* pf_state
+    cdef double* pf_work
+    cdef Rows pf_X
+    cdef Rows pf_Y
+    cdef int pf_by_rows
+    cdef object pf_refs
+    cdef object pf_thread
+    cdef pthread_mutex_t pf_lock
+    cdef pthread_cond_t pf_cond
+    cdef long pf_hits
+    cdef long pf_late
+    cdef long pf_timeouts
+    cdef long pf_wasted
+    cdef long pf_evals
+    # Seconds to wait for a column the worker has started.
+    cdef double pf_timeout
 
+    cdef double* _get_work(self, Rows* Y, int j)
+    cdef void _release_work(self, Rows* Y, int j)
+    cdef _create_store(self)
+    cdef _create_arena(self, int huge_pages)
+    cdef long _column_bytes(self, int length)
     cdef _create_column(self, int i)
-    cdef _clear_columns(self, int n)
+    cdef Column _grow_column(self, int i, int length)
+    cdef void _touch_column(self, int i)
+    cdef int _select_victim(self)
+    cdef _evict_column(self, int i)
+    cdef void _spill_column(self, int i, Column* col)
+    cdef void _compact_column(self, int j, Column* col, int pos, int last)
+    cdef void _symmetrize(self, int j)
+    cdef int _prefetch_slot(self, int j) nogil
+    cdef int _take_prefetched(self, X, Y, int j) except -1
+    cdef _clear_columns(self)
 
-    cpdef double compute(self,
-                         np.ndarray[double, ndim=2, mode='c'] X,
+    cdef double _compute(self,
+                         double* X,
                          int i,
-                         np.ndarray[double, ndim=2, mode='c'] Y,
-                         int j)
+                         double* Y,
+                         int j,
+                         int n_features) nogil
+
+    cdef double _compute_self(self,
+                              double* X,
+                              int i,
+                              int n_features) nogil
 
-    cpdef double compute_self(self,
-                              np.ndarray[double, ndim=2, mode='c'] X,
-                              int i)
+    cpdef double compute(self, X, int i, Y, int j) except *
 
-    cpdef compute_diag(self,
-                       np.ndarray[double, ndim=2, mode='c'] X,
-                       np.ndarray[double, ndim=1, mode='c'] out)
+    cpdef double compute_self(self, X, int i) except *
 
+    cpdef compute_block(self,
+                        X,
+                        rows,
+                        Y,
+                        cols,
+                        np.ndarray[double, ndim=2, mode='c'] out)
+
+    cpdef compute_diag(self, X, np.ndarray[double, ndim=1, mode='c'] out)
 
     cpdef compute_column(self,
-                         np.ndarray[double, ndim=2, mode='c'] X,
-                         np.ndarray[double, ndim=2, mode='c'] Y,
+                         X,
+                         Y,
                          int j,
                          np.ndarray[double, ndim=1, mode='c'] out)
 
     cpdef compute_column_sv(self,
-                            np.ndarray[double, ndim=2, mode='c'] X,
-                            np.ndarray[double, ndim=2, mode='c'] Y,
+                            X,
+                            Y,
                             int j,
                             np.ndarray[double, ndim=1, mode='c'] out)
 
+    cpdef fill_columns(self,
+                       X,
+                       Y,
+                       np.ndarray[int, ndim=1, mode='c'] indices,
+                       int start,
+                       int stop)
+
     cpdef remove_column(self, int i)
     cpdef add_sv(self, int i)
     cpdef remove_sv(self, int i)
+    cpdef clear_sv(self)
+    cpdef start_prefetch(self, X, Y, int depth, double timeout=*)
+    cpdef prefetch(self,
+                   np.ndarray[int, ndim=1, mode='c'] indices,
+                   int start,
+                   int stop)
+    cpdef stop_prefetch(self)
+    cpdef KernelCache fork(self)
     cpdef int n_sv(self)
+    cpdef int[::1] get_support_set(self)
+    cpdef int is_cached(self, int i)
     cpdef get_size(self)
+    cpdef get_stats(self)
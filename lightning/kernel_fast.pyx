@@ -9,21 +9,37 @@
 from cython.operator cimport dereference as deref
 from cython.operator cimport preincrement as inc
 from cython.operator cimport postincrement as postinc
-from cython.operator cimport predecrement as dec
 
-from libcpp.list cimport list
 from libcpp.map cimport map
 from libc cimport stdlib
+from libc.string cimport memcpy, memset
+from libc.stdint cimport uint64_t
+from posix.time cimport timespec, clock_gettime, CLOCK_REALTIME
+from posix.mman cimport mmap, munmap, madvise, PROT_READ, PROT_WRITE, \
+                        MAP_PRIVATE, MAP_ANONYMOUS, MAP_FAILED, \
+                        MADV_HUGEPAGE
+from cython.parallel cimport prange
+
+import tempfile
+import threading
+from multiprocessing import cpu_count
 
 import numpy as np
 cimport numpy as np
+import scipy.sparse as sp
+
+from sklearn.utils.extmath import safe_sparse_dot
 
 
 cdef extern from "math.h":
-   double exp(double)
+   double exp(double) nogil
+
 
+cdef extern from *:
+    int __builtin_popcountll(unsigned long long) nogil
 
-cdef double powi(double base, int times):
+
+cdef inline double powi(double base, int times) nogil:
     cdef double tmp = base, ret = 1.0
 
     cdef int t = times
@@ -38,40 +54,381 @@ cdef double powi(double base, int times):
     return ret
 
 
-cdef class Kernel:
+cdef inline double* _row(double* X, int i, int n_features) nogil:
+    # Row offsets overflow an int past 2^31 entries.
+    return X + <Py_ssize_t>i * n_features
+
+
+cdef inline double _dot(double* x, double* y, int n_features) nogil:
+    # Four independent accumulators break the dependency chain so that the
+    # compiler can vectorize the loop without reordering additions.
+    cdef double s0 = 0, s1 = 0, s2 = 0, s3 = 0
+    cdef int m = n_features - n_features % 4
+    cdef int k = 0
+
+    while k < m:
+        s0 += x[k] * y[k]
+        s1 += x[k + 1] * y[k + 1]
+        s2 += x[k + 2] * y[k + 2]
+        s3 += x[k + 3] * y[k + 3]
+        k += 4
+
+    while k < n_features:
+        s0 += x[k] * y[k]
+        k += 1
+
+    return (s0 + s1) + (s2 + s3)
+
+
+cdef inline double _sqdist(double* x, double* y, int n_features) nogil:
+    cdef double s0 = 0, s1 = 0, s2 = 0, s3 = 0
+    cdef double d0, d1, d2, d3
+    cdef int m = n_features - n_features % 4
+    cdef int k = 0
+
+    while k < m:
+        d0 = x[k] - y[k]
+        d1 = x[k + 1] - y[k + 1]
+        d2 = x[k + 2] - y[k + 2]
+        d3 = x[k + 3] - y[k + 3]
+        s0 += d0 * d0
+        s1 += d1 * d1
+        s2 += d2 * d2
+        s3 += d3 * d3
+        k += 4
+
+    while k < n_features:
+        d0 = x[k] - y[k]
+        s0 += d0 * d0
+        k += 1
+
+    return (s0 + s1) + (s2 + s3)
+
+
+cdef inline double _csr_dot(Rows* X, int i, Rows* Y, int j) nogil:
+    # Merge of two rows with sorted indices.
+    cdef int p = X.indptr[i], p_end = X.indptr[i + 1]
+    cdef int q = Y.indptr[j], q_end = Y.indptr[j + 1]
+    cdef double dot = 0
+
+    while p < p_end and q < q_end:
+        if X.indices[p] == Y.indices[q]:
+            dot += X.data[p] * Y.data[q]
+            p += 1
+            q += 1
+        elif X.indices[p] < Y.indices[q]:
+            p += 1
+        else:
+            q += 1
 
-    cpdef double compute(self,
-                         np.ndarray[double, ndim=2, mode='c'] X,
-                         int i,
-                         np.ndarray[double, ndim=2, mode='c'] Y,
-                         int j):
-        raise NotImplementedError()
+    return dot
 
-    cpdef double compute_self(self,
-                              np.ndarray[double, ndim=2, mode='c'] X,
-                              int i):
-        return self.compute(X, i, X, i)
 
+cdef inline double _scatter_dot(Rows* X, int i, double* work) nogil:
+    # work holds a row of Y scattered into a dense array.
+    cdef int p
+    cdef double dot = 0
 
+    for p in xrange(X.indptr[i], X.indptr[i + 1]):
+        dot += X.data[p] * work[X.indices[p]]
 
-cdef class LinearKernel(Kernel):
+    return dot
 
-    cpdef double compute(self,
-                         np.ndarray[double, ndim=2, mode='c'] X,
-                         int i,
-                         np.ndarray[double, ndim=2, mode='c'] Y,
-                         int j):
 
-        cdef Py_ssize_t n_features = X.shape[1]
+cdef inline void _scatter(Rows* Y, int j, double* work, int clear) nogil:
+    cdef int p
 
-        cdef double dot = 0
-        cdef int k
+    for p in xrange(Y.indptr[j], Y.indptr[j + 1]):
+        if clear:
+            work[Y.indices[p]] = 0
+        else:
+            work[Y.indices[p]] = Y.data[p]
+
+
+cdef void* _dense_data(X, dtype) except NULL:
+    # Kernels never write to their input: read-only arrays, such as a Gram
+    # matrix mapped from a store, are used in place.
+    if not isinstance(X, np.ndarray) or X.ndim != 2 or \
+       X.dtype != dtype or not X.flags.c_contiguous:
+        raise ValueError("Dense input must be a C-contiguous 2d array of "
+                         "%s." % np.dtype(dtype).name)
+    return np.PyArray_DATA(<np.ndarray>X)
+
+
+cdef Rows get_rows(Kernel kernel, X) except *:
+    cdef Rows rows
+    cdef np.ndarray[double, ndim=1, mode='c'] data
+    cdef np.ndarray[int, ndim=1, mode='c'] indices
+    cdef np.ndarray[int, ndim=1, mode='c'] indptr
+    cdef np.ndarray[double, ndim=1, mode='c'] sq_norms
+
+    rows.n_features = X.shape[1]
+
+    if kernel._binary() or X.dtype == np.uint64:
+        if not kernel._binary() or X.dtype != np.uint64:
+            raise ValueError("Binary kernels require input packed with "
+                             "pack_binary, and only them.")
+        # Binary kernels cast data back to words, and take n_features as
+        # the number of words per row.
+        rows.data = <double*>_dense_data(X, np.uint64)
+        rows.indices = NULL
+        rows.indptr = NULL
+        rows.sq_norms = NULL
+    elif sp.issparse(X):
+        if not kernel._supports_sparse():
+            raise ValueError("Sparse input is not supported by this kernel.")
+        # CSR matrices with sorted indices are assumed.
+        data = X.data
+        indices = X.indices
+        indptr = X.indptr
+        sq_norms = kernel._get_sq_norms(X)
+        rows.data = <double*>data.data
+        rows.indices = <int*>indices.data
+        rows.indptr = <int*>indptr.data
+        rows.sq_norms = <double*>sq_norms.data
+    else:
+        rows.data = <double*>_dense_data(X, np.float64)
+        rows.indices = NULL
+        rows.indptr = NULL
+        rows.sq_norms = NULL
+
+    return rows
+
+
+cdef double kernel_value(Kernel kernel, Rows* X, int i, Rows* Y, int j,
+                         double* work) nogil:
+    # work, if not NULL, holds row j of a sparse Y scattered.
+    cdef double dot
+
+    if X.indptr == NULL:
+        return kernel._compute(X.data, i, Y.data, j, X.n_features)
+
+    if work != NULL:
+        dot = _scatter_dot(X, i, work)
+    else:
+        dot = _csr_dot(X, i, Y, j)
+
+    return kernel._finalize(dot, X.sq_norms[i], Y.sq_norms[j])
+
+
+cdef double base_value(Kernel kernel, Rows* X, int i, Rows* Y, int j,
+                       double* work) nogil:
+    cdef double dot
+
+    if X.indptr == NULL:
+        return kernel._base(X.data, i, Y.data, j, X.n_features)
+
+    if work != NULL:
+        dot = _scatter_dot(X, i, work)
+    else:
+        dot = _csr_dot(X, i, Y, j)
+
+    return kernel._base_finalize(dot, X.sq_norms[i], Y.sq_norms[j])
+
+
+cdef inline double _cached_value(Kernel kernel, Rows* X, int i, Rows* Y,
+                                 int j, double* work, int base) nogil:
+    # Value stored in a cache column.
+    if base:
+        return base_value(kernel, X, i, Y, j, work)
+    return kernel_value(kernel, X, i, Y, j, work)
+
+
+cdef inline double _column_value(Kernel kernel, Rows* X, int i, Rows* Y,
+                                 int j, double* work, int base,
+                                 int by_rows) nogil:
+    # Entry i of column j, read from row j if by_rows (see _by_rows).
+    if by_rows:
+        return _cached_value(kernel, Y, j, X, i, work, base)
+    return _cached_value(kernel, X, i, Y, j, work, base)
+
+
+cdef inline double _self_value(Kernel kernel, Rows* X, int i) nogil:
+    if X.indptr == NULL:
+        return kernel._compute_self(X.data, i, X.n_features)
+    return kernel._finalize(X.sq_norms[i], X.sq_norms[i], X.sq_norms[i])
+
+
+cdef _check_same_format(X, Y):
+    if sp.issparse(X) != sp.issparse(Y):
+        raise ValueError("X and Y must be both dense or both sparse.")
+
+
+cdef _take_rows(X, indices):
+    if indices is None:
+        return X
+    if sp.issparse(X):
+        return X[np.asarray(indices)]
+    return X.take(indices, axis=0)
 
-        for k in xrange(n_features):
-            dot += X[i, k] * Y[j, k]
 
+cdef _dot_block(X, rows, Y, cols, np.ndarray[double, ndim=2, mode='c'] out):
+    X = _take_rows(X, rows)
+    Y = _take_rows(Y, cols)
+
+    if sp.issparse(X) or sp.issparse(Y):
+        np.copyto(out, safe_sparse_dot(X, Y.T, dense_output=True))
+    else:
+        np.dot(X, Y.T, out)
+
+
+cdef np.ndarray _block_indices(indices, int n):
+    if indices is None:
+        return np.arange(n, dtype=np.int32)
+    return np.ascontiguousarray(indices, dtype=np.int32)
+
+
+cdef class Kernel:
+
+    def __cinit__(self, *args, **kw):
+        if type(self) is Kernel:
+            raise TypeError("Kernel is abstract: use one of its subclasses.")
+        self.sq_norms = {}
+
+    def _params(self):
+        # Identifies the kernel function, e.g. to share computed values.
+        return (self.__class__.__name__,)
+
+    # X and Y point to C-contiguous arrays whose rows are n_features apart.
+    # Subclasses must override this method: Kernel itself can't be
+    # instantiated.
+    cdef double _compute(self,
+                         double* X,
+                         int i,
+                         double* Y,
+                         int j,
+                         int n_features) nogil:
+        return 0
+
+    cdef double _compute_self(self,
+                              double* X,
+                              int i,
+                              int n_features) nogil:
+        return self._compute(X, i, X, i, n_features)
+
+    # Kernel value from the dot product of two samples and their squared
+    # norms. Used for sparse input by kernels that support it.
+    cdef double _finalize(self,
+                          double dot,
+                          double x_sq,
+                          double y_sq) nogil:
         return dot
 
+    cdef int _supports_sparse(self):
+        return 0
+
+    cdef int _binary(self):
+        return 0
+
+    # Base value: a quantity the kernel value is a function of, and that
+    # doesn't depend on the kernel parameters (e.g. the squared distance
+    # for the RBF kernel). _transform maps it to the kernel value.
+    cdef double _base(self,
+                      double* X,
+                      int i,
+                      double* Y,
+                      int j,
+                      int n_features) nogil:
+        return self._compute(X, i, Y, j, n_features)
+
+    cdef double _base_finalize(self,
+                               double dot,
+                               double x_sq,
+                               double y_sq) nogil:
+        return self._finalize(dot, x_sq, y_sq)
+
+    cdef double _transform(self, double value) nogil:
+        return value
+
+    cdef _get_sq_norms(self, X):
+        # Squared row norms are cached per array (at most two of them, e.g.
+        # the test samples and the support vectors), so that successive
+        # blocks on the same data don't recompute them.
+        key = id(X)
+        if key in self.sq_norms:
+            return self.sq_norms[key][1]
+
+        if len(self.sq_norms) >= 2:
+            self.sq_norms.clear()
+
+        if sp.issparse(X):
+            norms = np.asarray(X.multiply(X).sum(axis=1), dtype=np.float64)
+            norms = norms.ravel()
+        else:
+            norms = np.einsum("ij,ij->i", X, X)
+        # Keep a reference to X so that its id can't be reused.
+        self.sq_norms[key] = (X, norms)
+
+        return norms
+
+    cpdef double compute(self, X, int i, Y, int j) except *:
+        _check_same_format(X, Y)
+        cdef Rows Xr = get_rows(self, X)
+        cdef Rows Yr = get_rows(self, Y)
+        return kernel_value(self, &Xr, i, &Yr, j, NULL)
+
+    cpdef double compute_self(self, X, int i) except *:
+        cdef Rows Xr = get_rows(self, X)
+        return _self_value(self, &Xr, i)
+
+    cpdef compute_block(self,
+                        X,
+                        rows,
+                        Y,
+                        cols,
+                        np.ndarray[double, ndim=2, mode='c'] out):
+        # Generic implementation: fill out[a, b] = K(X[rows[a]], Y[cols[b]])
+        # pair by pair. Subclasses override it with matrix products.
+        cdef np.ndarray[int, ndim=1, mode='c'] r
+        cdef np.ndarray[int, ndim=1, mode='c'] c
+
+        _check_same_format(X, Y)
+        if not sp.issparse(X) and not self._binary():
+            X = np.ascontiguousarray(X, dtype=np.float64)
+            Y = np.ascontiguousarray(Y, dtype=np.float64)
+        r = _block_indices(rows, X.shape[0])
+        c = _block_indices(cols, Y.shape[0])
+
+        cdef Rows Xr = get_rows(self, X)
+        cdef Rows Yr = get_rows(self, Y)
+        cdef int n_rows = r.shape[0]
+        cdef int n_cols = c.shape[0]
+        cdef int* r_ptr = <int*>r.data
+        cdef int* c_ptr = <int*>c.data
+        cdef double* out_ptr = <double*>out.data
+        cdef int a, b
+
+        with nogil:
+            for a in xrange(n_rows):
+                for b in xrange(n_cols):
+                    _row(out_ptr, a, n_cols)[b] = kernel_value(self,
+                                                               &Xr, r_ptr[a],
+                                                               &Yr, c_ptr[b],
+                                                               NULL)
+
+
+cdef class LinearKernel(Kernel):
+
+    cdef double _compute(self,
+                         double* X,
+                         int i,
+                         double* Y,
+                         int j,
+                         int n_features) nogil:
+        return _dot(_row(X, i, n_features), _row(Y, j, n_features),
+                    n_features)
+
+    cdef int _supports_sparse(self):
+        return 1
+
+    cpdef compute_block(self,
+                        X,
+                        rows,
+                        Y,
+                        cols,
+                        np.ndarray[double, ndim=2, mode='c'] out):
+        _dot_block(X, rows, Y, cols, out)
+
 
 cdef class PolynomialKernel(Kernel):
 
@@ -80,296 +437,1500 @@ cdef class PolynomialKernel(Kernel):
         self.coef0 = coef0
         self.gamma = gamma
 
-    cpdef double compute(self,
-                         np.ndarray[double, ndim=2, mode='c'] X,
+    def _params(self):
+        return ("poly", self.degree, self.coef0, self.gamma)
+
+    cdef double _compute(self,
+                         double* X,
+                         int i,
+                         double* Y,
+                         int j,
+                         int n_features) nogil:
+        cdef double dot = _dot(_row(X, i, n_features),
+                               _row(Y, j, n_features), n_features)
+        return powi(self.coef0 + dot * self.gamma, self.degree)
+
+    cdef double _finalize(self,
+                          double dot,
+                          double x_sq,
+                          double y_sq) nogil:
+        return powi(self.coef0 + dot * self.gamma, self.degree)
+
+    cdef double _base(self,
+                      double* X,
+                      int i,
+                      double* Y,
+                      int j,
+                      int n_features) nogil:
+        return _dot(_row(X, i, n_features), _row(Y, j, n_features),
+                    n_features)
+
+    cdef double _base_finalize(self,
+                               double dot,
+                               double x_sq,
+                               double y_sq) nogil:
+        return dot
+
+    cdef double _transform(self, double value) nogil:
+        return powi(self.coef0 + value * self.gamma, self.degree)
+
+    cdef int _supports_sparse(self):
+        return 1
+
+    cpdef compute_block(self,
+                        X,
+                        rows,
+                        Y,
+                        cols,
+                        np.ndarray[double, ndim=2, mode='c'] out):
+        _dot_block(X, rows, Y, cols, out)
+        out *= self.gamma
+        out += self.coef0
+        np.power(out, self.degree, out)
+
+
+cdef class RbfKernel(Kernel):
+
+    def __init__(self, double gamma):
+        self.gamma = gamma
+
+    def _params(self):
+        return ("rbf", self.gamma)
+
+    cdef double _compute(self,
+                         double* X,
+                         int i,
+                         double* Y,
+                         int j,
+                         int n_features) nogil:
+        cdef double value = _sqdist(_row(X, i, n_features),
+                                    _row(Y, j, n_features), n_features)
+        return exp(-self.gamma * value)
+
+    cdef double _compute_self(self,
+                              double* X,
+                              int i,
+                              int n_features) nogil:
+        return 1.0
+
+    cdef double _finalize(self,
+                          double dot,
+                          double x_sq,
+                          double y_sq) nogil:
+        cdef double value = x_sq + y_sq - 2 * dot
+        # Rounding errors may produce small negative distances.
+        if value < 0:
+            value = 0
+        return exp(-self.gamma * value)
+
+    cdef double _base(self,
+                      double* X,
+                      int i,
+                      double* Y,
+                      int j,
+                      int n_features) nogil:
+        return _sqdist(_row(X, i, n_features), _row(Y, j, n_features),
+                       n_features)
+
+    cdef double _base_finalize(self,
+                               double dot,
+                               double x_sq,
+                               double y_sq) nogil:
+        cdef double value = x_sq + y_sq - 2 * dot
+        if value < 0:
+            value = 0
+        return value
+
+    cdef double _transform(self, double value) nogil:
+        return exp(-self.gamma * value)
+
+    cdef int _supports_sparse(self):
+        return 1
+
+    cpdef compute_block(self,
+                        X,
+                        rows,
+                        Y,
+                        cols,
+                        np.ndarray[double, ndim=2, mode='c'] out):
+        # ||x - y||^2 = ||x||^2 + ||y||^2 - 2 x^T y
+        X_norms = _take_rows(self._get_sq_norms(X), rows)
+        Y_norms = _take_rows(self._get_sq_norms(Y), cols)
+
+        _dot_block(X, rows, Y, cols, out)
+        out *= -2
+        out += X_norms[:, np.newaxis]
+        out += Y_norms[np.newaxis, :]
+        # Rounding errors may produce small negative distances.
+        np.maximum(out, 0, out)
+        out *= -self.gamma
+        np.exp(out, out)
+
+
+cdef class IntersectionKernel(Kernel):
+    # Histogram intersection: sum_k min(x_k, y_k).
+
+    cdef double _compute(self,
+                         double* X,
                          int i,
-                         np.ndarray[double, ndim=2, mode='c'] Y,
-                         int j):
+                         double* Y,
+                         int j,
+                         int n_features) nogil:
+        cdef double* x = _row(X, i, n_features)
+        cdef double* y = _row(Y, j, n_features)
+        cdef double value = 0
+        cdef int k
+
+        for k in xrange(n_features):
+            if x[k] < y[k]:
+                value += x[k]
+            else:
+                value += y[k]
+
+        return value
 
-        cdef Py_ssize_t n_features = X.shape[1]
 
-        cdef double dot = 0
+cdef class AdditiveChi2Kernel(Kernel):
+    # Additive chi2 kernel for histograms: sum_k 2 x_k y_k / (x_k + y_k).
+
+    cdef double _compute(self,
+                         double* X,
+                         int i,
+                         double* Y,
+                         int j,
+                         int n_features) nogil:
+        cdef double* x = _row(X, i, n_features)
+        cdef double* y = _row(Y, j, n_features)
+        cdef double value = 0
+        cdef double total
         cdef int k
 
         for k in xrange(n_features):
-            dot += X[i, k] * Y[j, k]
+            total = x[k] + y[k]
+            if total != 0:
+                value += 2 * x[k] * y[k] / total
 
-        return powi(self.coef0 + dot * self.gamma, self.degree)
+        return value
 
 
-cdef class RbfKernel(Kernel):
+cdef inline uint64_t* _words(double* X, int i, int n_words) nogil:
+    return (<uint64_t*>X) + <Py_ssize_t>i * n_words
+
+
+cdef class BinaryLinearKernel(Kernel):
+    # Dot product of binary vectors: popcount(x AND y).
+
+    cdef double _compute(self,
+                         double* X,
+                         int i,
+                         double* Y,
+                         int j,
+                         int n_features) nogil:
+        cdef uint64_t* x = _words(X, i, n_features)
+        cdef uint64_t* y = _words(Y, j, n_features)
+        cdef int value = 0
+        cdef int k
+
+        for k in xrange(n_features):
+            value += __builtin_popcountll(x[k] & y[k])
+
+        return value
+
+    cdef int _binary(self):
+        return 1
+
+
+cdef class HammingKernel(Kernel):
+    # exp(-gamma * popcount(x XOR y)), i.e., the RBF kernel on binary
+    # vectors.
 
     def __init__(self, double gamma):
         self.gamma = gamma
 
-    cpdef double compute(self,
-                         np.ndarray[double, ndim=2, mode='c'] X,
+    def _params(self):
+        return ("hamming", self.gamma)
+
+    cdef double _compute(self,
+                         double* X,
                          int i,
-                         np.ndarray[double, ndim=2, mode='c'] Y,
-                         int j):
+                         double* Y,
+                         int j,
+                         int n_features) nogil:
+        return exp(-self.gamma * self._base(X, i, Y, j, n_features))
 
-        cdef Py_ssize_t n_features = X.shape[1]
+    cdef double _compute_self(self,
+                              double* X,
+                              int i,
+                              int n_features) nogil:
+        return 1.0
 
-        cdef double diff, value = 0
+    cdef double _base(self,
+                      double* X,
+                      int i,
+                      double* Y,
+                      int j,
+                      int n_features) nogil:
+        cdef uint64_t* x = _words(X, i, n_features)
+        cdef uint64_t* y = _words(Y, j, n_features)
+        cdef int value = 0
         cdef int k
 
         for k in xrange(n_features):
-            diff = X[i, k] - Y[j, k]
-            value += diff * diff
+            value += __builtin_popcountll(x[k] ^ y[k])
 
+        return value
+
+    cdef double _transform(self, double value) nogil:
         return exp(-self.gamma * value)
 
-    cpdef double compute_self(self,
-                              np.ndarray[double, ndim=2, mode='c'] X,
-                              int i):
-        return 1.0
+    cdef int _binary(self):
+        return 1
+
+
+cdef class JaccardKernel(Kernel):
+    # Jaccard (Tanimoto) similarity of binary vectors:
+    # popcount(x AND y) / popcount(x OR y), and 1 if both are zero.
+
+    cdef double _compute(self,
+                         double* X,
+                         int i,
+                         double* Y,
+                         int j,
+                         int n_features) nogil:
+        cdef uint64_t* x = _words(X, i, n_features)
+        cdef uint64_t* y = _words(Y, j, n_features)
+        cdef int n_and = 0, n_or = 0
+        cdef int k
+
+        for k in xrange(n_features):
+            n_and += __builtin_popcountll(x[k] & y[k])
+            n_or += __builtin_popcountll(x[k] | y[k])
+
+        if n_or == 0:
+            return 1.0
+        return <double>n_and / n_or
+
+    cdef int _binary(self):
+        return 1
 
 
 cdef class PrecomputedKernel(Kernel):
 
-    cpdef double compute(self,
-                         np.ndarray[double, ndim=2, mode='c'] X,
+    cdef double _compute(self,
+                         double* X,
                          int i,
-                         np.ndarray[double, ndim=2, mode='c'] Y,
-                         int j):
-        return X[i, j]
+                         double* Y,
+                         int j,
+                         int n_features) nogil:
+        return _row(X, i, n_features)[j]
+
+
+cdef inline int _by_rows(Kernel kernel, X, Y):
+    # A precomputed training Gram matrix is symmetric: its columns are read
+    # from rows, which are contiguous (and span few pages when the matrix
+    # is memory-mapped).
+    return isinstance(kernel, PrecomputedKernel) and X is Y
+
+
+cdef _compute_block_column(Kernel kernel, X, Y, int j, np.ndarray out):
+    if _by_rows(kernel, X, Y):
+        kernel.compute_block(Y, (j,), X, None, out.reshape(1, -1))
+    else:
+        kernel.compute_block(X, None, Y, (j,), out.reshape(-1, 1))
+
+
+cdef inline void _deadline(timespec* ts, double timeout) nogil:
+    # Absolute time timeout seconds from now, for pthread_cond_timedwait.
+    cdef long ns
+
+    clock_gettime(CLOCK_REALTIME, ts)
+    ns = ts.tv_nsec + <long>((timeout - <long>timeout) * 1e9)
+    ts.tv_sec += <long>timeout + ns / 1000000000
+    ts.tv_nsec = ns % 1000000000
+
+
+cdef inline int _is_valid(uint64_t* valid, int i) nogil:
+    return (valid[i >> 6] >> (i & 63)) & 1
+
+
+cdef inline void _set_valid(uint64_t* valid, int i) nogil:
+    valid[i >> 6] |= (<uint64_t>1) << (i & 63)
+
+
+cdef inline void _clear_valid(uint64_t* valid, int i) nogil:
+    valid[i >> 6] &= ~((<uint64_t>1) << (i & 63))
+
+
+cdef inline int _round_length(int n_support):
+    # Compact columns are allocated by blocks of 16 entries.
+    return max((n_support + 15) / 16, 1) * 16
+
+
+cdef inline double _load(void* data, int i, int single) nogil:
+    if single:
+        return (<float*>data)[i]
+    return (<double*>data)[i]
+
+
+cdef inline double _store(void* data, int i, double value, int single) nogil:
+    # Returns the stored value so that callers see what later reads will.
+    if single:
+        (<float*>data)[i] = <float>value
+        return (<float*>data)[i]
+    (<double*>data)[i] = value
+    return value
+
+
+cdef int get_cache_dtype(dtype) except -1:
+    if dtype == "float64" or dtype is np.float64:
+        return 0
+    elif dtype == "float32" or dtype is np.float32:
+        return 1
+    else:
+        raise ValueError("Wrong cache dtype.")
+
+
+cpdef int get_n_threads(int n_jobs):
+    if n_jobs < 0:
+        return max(cpu_count() + 1 + n_jobs, 1)
+    return max(n_jobs, 1)
+
+
+cdef int get_cache_policy(policy) except -1:
+    if policy == "lru":
+        return 0
+    elif policy == "lfu":
+        return 1
+    elif policy == "sv":
+        return 2
+    else:
+        raise ValueError("Wrong cache policy.")
 
 
 cdef class KernelCache(Kernel):
 
     def __init__(self, Kernel kernel, int n_samples,
-                 long capacity, int mb, int verbose):
+                 double capacity, int mb, int verbose, policy="lru",
+                 dtype="float64", double spill_capacity=0, spill_dir=None,
+                 int n_jobs=1, int compact_sv=False, int arena=False,
+                 int huge_pages=False, int symmetric=False,
+                 int base_values=False):
+        cdef int i
+
+        self._create_store()
         self.kernel = kernel
         self.n_samples = n_samples
         if mb:
-            self.capacity = capacity * (1 << 20)
-        else:
-            self.capacity = capacity
+            capacity *= (1 << 20)
+            spill_capacity *= (1 << 20)
+        self.capacity = <long>capacity
         self.verbose = verbose
-        self.size = 0
+        self.n_words = (n_samples + 63) / 64
+        self.single = get_cache_dtype(dtype)
+        if self.single:
+            self.col_size = n_samples * sizeof(float)
+        else:
+            self.col_size = n_samples * sizeof(double)
+        self.col_size += self.n_words * sizeof(uint64_t)
+        self.policy = get_cache_policy(policy)
+        self.n_threads = get_n_threads(n_jobs)
+        self.compact = compact_sv
+        self.symmetric = symmetric
+        self.base = base_values
+
+        # A slot holds the values of a column followed by its bitmap.
+        self.n_slots = min(<long>spill_capacity / self.col_size, n_samples)
+        if self.compact and self.capacity > 0 and self.n_slots > 0:
+            raise ValueError("Compact columns cannot be spilled to disk.")
+        if self.compact and arena:
+            raise ValueError("Compact columns cannot be allocated from an "
+                             "arena.")
+        if self.compact and symmetric:
+            raise ValueError("Compact columns cannot be used in symmetric "
+                             "mode.")
+
+        if arena and self.capacity > 0:
+            self._create_arena(huge_pages)
+        if self.capacity > 0 and self.n_slots > 0:
+            self.spill_file = tempfile.TemporaryFile(dir=spill_dir)
+            self.spill = np.memmap(self.spill_file, dtype=np.uint8,
+                                   mode="w+",
+                                   shape=(self.n_slots, self.col_size))
+            self.slot_owner = <int*> stdlib.malloc(sizeof(int) * self.n_slots)
+            for i in xrange(self.n_slots):
+                self.slot_owner[i] = -1
+        else:
+            self.n_slots = 0
 
-    def __cinit__(self, Kernel kernel, int n_samples,
-                  long capacity, int mb, int verbose):
+    def __cinit__(self, Kernel kernel, int n_samples, *args, **kw):
+        # Only the support set is allocated here: forks share the rest.
         cdef int i
 
-        self.support_set = new list[int]()
+        self.n_samples = n_samples
+        self.support_set = np.zeros(n_samples, dtype=np.int32)
+        self.n_support = 0
         self.support_vector = <int*> stdlib.malloc(sizeof(int) * n_samples)
-        self.support_it = <list[int].iterator*> \
-            stdlib.malloc(sizeof(list[int].iterator) * n_samples)
+        self.missing = <int*> stdlib.malloc(sizeof(int) * n_samples)
 
-        self.n_computed = <int*> stdlib.malloc(sizeof(int) * n_samples)
-        self.columns = new map[int, double*]()
+        pthread_mutex_init(&self.pf_lock, NULL)
+        pthread_cond_init(&self.pf_cond, NULL)
 
         for i in xrange(n_samples):
             self.support_vector[i] = -1
+
+    cdef _create_store(self):
+        cdef int i
+        cdef int n_samples = self.n_samples
+
+        self.store = <Store*> stdlib.calloc(1, sizeof(Store))
+        self.n_computed = <int*> stdlib.malloc(sizeof(int) * n_samples)
+        self.columns = new map[int, Column]()
+        self.pins = <int*> stdlib.calloc(n_samples, sizeof(int))
+
+        self.last_access = <long*> stdlib.malloc(sizeof(long) * n_samples)
+        self.n_access = <long*> stdlib.malloc(sizeof(long) * n_samples)
+        self.spill_slot = <int*> stdlib.malloc(sizeof(int) * n_samples)
+        self.spill_count = <int*> stdlib.malloc(sizeof(int) * n_samples)
+
+        for i in xrange(n_samples):
             self.n_computed[i] = 0
+            self.last_access[i] = 0
+            self.n_access[i] = 0
+            self.spill_slot[i] = -1
+            self.spill_count[i] = 0
+
+    cdef _create_arena(self, int huge_pages):
+        # One block per column that fits in the budget, and at least one
+        # since the cache always keeps the last column.
+        cdef int n_blocks = max(min(self.capacity / self.col_size,
+                                    self.n_samples), 1)
+        cdef int i
+
+        self.block_size = (self.col_size + 7) / 8 * 8
+        self.arena_size = n_blocks * self.block_size
+        # Anonymous mappings are page aligned and only committed when
+        # touched.
+        cdef void* arena = mmap(NULL, self.arena_size,
+                                PROT_READ | PROT_WRITE,
+                                MAP_PRIVATE | MAP_ANONYMOUS, -1, 0)
+        if arena == MAP_FAILED:
+            raise MemoryError("Could not allocate the kernel cache arena.")
+        if huge_pages:
+            madvise(arena, self.arena_size, MADV_HUGEPAGE)
+        self.arena = <char*>arena
+
+        self.free_blocks = <int*> stdlib.malloc(sizeof(int) * n_blocks)
+        for i in xrange(n_blocks):
+            self.free_blocks[i] = n_blocks - 1 - i
+        self.store.n_free = n_blocks
+        self.staging = <char*> stdlib.malloc(self.col_size)
 
     def __dealloc__(self):
-        del self.support_set
         stdlib.free(self.support_vector)
-        stdlib.free(self.support_it)
+        stdlib.free(self.missing)
+        # The worker thread holds a reference to the cache, so it has been
+        # stopped by now.
+        stdlib.free(self.pf_buffer)
+        stdlib.free(self.pf_index)
+        stdlib.free(self.pf_state)
+        stdlib.free(self.pf_work)
+        pthread_mutex_destroy(&self.pf_lock)
+        pthread_cond_destroy(&self.pf_cond)
+
+        # Forks keep their root alive, which owns the columns.
+        if self.root is not None or self.store == NULL:
+            return
+
+        # No need to spill columns that are about to be freed.
+        self.n_slots = 0
 
-        self._clear_columns(self.n_samples)
-        self.columns.clear()
+        self._clear_columns()
+        if self.arena != NULL:
+            munmap(self.arena, self.arena_size)
+        stdlib.free(self.free_blocks)
+        stdlib.free(self.staging)
         del self.columns
+        stdlib.free(self.store)
+        stdlib.free(self.pins)
         stdlib.free(self.n_computed)
-
-    cpdef double compute(self,
-                         np.ndarray[double, ndim=2, mode='c'] X,
+        stdlib.free(self.last_access)
+        stdlib.free(self.n_access)
+        stdlib.free(self.spill_slot)
+        stdlib.free(self.spill_count)
+        stdlib.free(self.slot_owner)
+
+    cdef double _compute(self,
+                         double* X,
                          int i,
-                         np.ndarray[double, ndim=2, mode='c'] Y,
-                         int j):
+                         double* Y,
+                         int j,
+                         int n_features) nogil:
+        return self.kernel._compute(X, i, Y, j, n_features)
+
+    cdef double _compute_self(self,
+                              double* X,
+                              int i,
+                              int n_features) nogil:
+        return self.kernel._compute_self(X, i, n_features)
+
+    cpdef double compute(self, X, int i, Y, int j) except *:
         return self.kernel.compute(X, i, Y, j)
 
-    cpdef double compute_self(self,
-                              np.ndarray[double, ndim=2, mode='c'] X,
-                              int i):
+    cpdef double compute_self(self, X, int i) except *:
         return self.kernel.compute_self(X, i)
 
-    cdef _create_column(self, int i):
-        cdef int n_computed = self.n_computed[i]
+    cdef double* _get_work(self, Rows* Y, int j):
+        # Scatter row j of a sparse Y into a dense workspace.
+        if Y.indptr == NULL:
+            return NULL
+
+        if self.work is None or self.work.shape[0] < Y.n_features:
+            self.work = np.zeros(Y.n_features, dtype=np.float64)
+
+        cdef double* work = <double*>self.work.data
+        _scatter(Y, j, work, 0)
+        return work
+
+    cdef void _release_work(self, Rows* Y, int j):
+        if Y.indptr != NULL:
+            _scatter(Y, j, <double*>self.work.data, 1)
 
-        if n_computed != 0:
+    cdef long _column_bytes(self, int length):
+        cdef long n_words = (length + 63) / 64
+        if self.single:
+            return length * sizeof(float) + n_words * sizeof(uint64_t)
+        return length * sizeof(double) + n_words * sizeof(uint64_t)
+
+    cdef _create_column(self, int i):
+        if self.columns.count(i):
+            self.store.memory_hits += 1
             return
 
-        cdef int col_size = self.n_samples * sizeof(double)
+        cdef int length = self.n_samples
+        if self.compact:
+            length = min(_round_length(self.n_support), length)
+
+        cdef int n_words = (length + 63) / 64
+        cdef long data_size = self._column_bytes(length) - \
+                              n_words * sizeof(uint64_t)
+        cdef char* slot = NULL
+        cdef char* block
+        cdef Column col
+        col.length = length
+
+        if self.spill_slot[i] >= 0:
+            # Read the column back from the disk tier before evictions can
+            # reuse its slot.
+            slot = self.spill.data + self.spill_slot[i] * self.col_size
+            if self.arena != NULL:
+                memcpy(self.staging, slot, self.col_size)
+                slot = self.staging
+            self.n_computed[i] = self.spill_count[i]
+            self.store.disk_hits += 1
+        else:
+            self.store.misses += 1
+
+        if self.arena == NULL:
+            col.data = stdlib.malloc(data_size)
+            col.valid = <uint64_t*> stdlib.calloc(n_words, sizeof(uint64_t))
+            if slot != NULL:
+                memcpy(col.data, slot, data_size)
+                memcpy(col.valid, slot + data_size,
+                       n_words * sizeof(uint64_t))
+
+        # Make room one column at a time. Columns pinned by other threads
+        # can't be evicted, in which case the cache goes over capacity.
+        cdef long needed = self._column_bytes(length)
+        cdef int victim
+        while (self.store.size + needed > self.capacity or
+               (self.arena != NULL and self.store.n_free == 0)) and \
+              not self.columns.empty():
+            victim = self._select_victim()
+            if victim == -1:
+                break
+            self._evict_column(victim)
+
+        if self.arena != NULL and self.store.n_free == 0:
+            raise MemoryError("All the arena blocks are pinned: the cache is "
+                              "too small for the number of threads using "
+                              "it.")
+
+        if self.arena != NULL:
+            # Arena blocks hold the bitmap followed by the values.
+            self.store.n_free -= 1
+            block = self.arena + self.free_blocks[self.store.n_free] * \
+                    self.block_size
+            col.valid = <uint64_t*>block
+            col.data = block + n_words * sizeof(uint64_t)
+            if slot != NULL:
+                memcpy(col.data, slot, data_size)
+                memcpy(col.valid, slot + data_size,
+                       n_words * sizeof(uint64_t))
+            else:
+                memset(col.valid, 0, n_words * sizeof(uint64_t))
+
+        self.columns[0][i] = col
+        self.store.size += self._column_bytes(length)
+
+    cdef Column _grow_column(self, int i, int length):
+        # Make room for length entries in the compact column i.
+        cdef Column col = self.columns[0][i]
+        cdef int n_words = (col.length + 63) / 64
+        cdef int new_words, victim
+        cdef int esize = sizeof(float) if self.single else sizeof(double)
+
+        if length <= col.length:
+            return col
+
+        # Grow geometrically, up to a full column.
+        length = min(max(_round_length(length), 2 * col.length),
+                     self.n_samples)
+        new_words = (length + 63) / 64
+        col.data = stdlib.realloc(col.data, length * esize)
+        col.valid = <uint64_t*> stdlib.realloc(col.valid,
+                                               new_words * sizeof(uint64_t))
+        memset(col.valid + n_words, 0,
+               (new_words - n_words) * sizeof(uint64_t))
+        self.store.size += self._column_bytes(length) - \
+                     self._column_bytes(col.length)
+        col.length = length
+        self.columns[0][i] = col
+
+        while self.store.size > self.capacity and self.columns.size() > 1:
+            victim = self._select_victim()
+            if victim == i or victim == -1:
+                break
+            self._evict_column(victim)
+
+        return col
 
-        if self.size + col_size > self.capacity:
-            if self.verbose >= 2:
-                print "Empty cache by half"
-            self._clear_columns(self.columns.size() / 2)
+    cdef void _spill_column(self, int i, Column* col):
+        cdef long data_size = self.col_size - self.n_words * sizeof(uint64_t)
+        cdef int slot = self.spill_slot[i]
+        cdef char* dest
 
-        self.columns[0][i] = <double*> stdlib.calloc(self.n_samples,
-                                                     sizeof(double))
-        self.size += col_size
+        if self.n_slots == 0 or self.n_computed[i] == 0:
+            return
 
-    cdef _clear_columns(self, int n):
-        cdef map[int, double*].iterator it
-        it = self.columns.begin()
-        cdef int i = 0
-        cdef int col_size
+        if slot >= 0:
+            # The copy on disk is up to date.
+            if self.spill_count[i] == self.n_computed[i]:
+                return
+        else:
+            # Slots are reused in FIFO order.
+            slot = self.store.next_slot
+            self.store.next_slot = (self.store.next_slot + 1) % self.n_slots
+            if self.slot_owner[slot] >= 0:
+                self.spill_slot[self.slot_owner[slot]] = -1
+            self.slot_owner[slot] = i
+            self.spill_slot[i] = slot
+
+        dest = self.spill.data + slot * self.col_size
+        memcpy(dest, col.data, data_size)
+        memcpy(dest + data_size, col.valid, self.n_words * sizeof(uint64_t))
+        self.spill_count[i] = self.n_computed[i]
+
+    cdef void _touch_column(self, int i):
+        self.store.clock += 1
+        self.last_access[i] = self.store.clock
+        self.n_access[i] += 1
+
+    cdef int _select_victim(self):
+        cdef map[int, Column].iterator it = self.columns.begin()
+        cdef int j, selected = -1
+        cdef int keep, best_keep = 0
+        cdef long count, best_count = 0
+        cdef long time, best_time = 0
 
         while it != self.columns.end():
-            col_size = self.n_samples * sizeof(double)
-            stdlib.free(deref(it).second)
-            self.n_computed[deref(it).first] = 0
-            self.size -= col_size
-            self.columns.erase(postinc(it))
+            j = deref(it).first
+            if self.pins[j] > 0:
+                # Being filled by another thread.
+                inc(it)
+                continue
+            time = self.last_access[j]
+            count = 0
+            keep = 0
+
+            if self.policy == 1: # lfu
+                count = self.n_access[j]
+            elif self.policy == 2: # sv
+                keep = self.support_vector[j] >= 0
+
+            # Lexicographic order: keep flag, access count, access time.
+            if selected == -1 or \
+               keep < best_keep or \
+               (keep == best_keep and count < best_count) or \
+               (keep == best_keep and count == best_count and
+                time < best_time):
+                selected = j
+                best_keep = keep
+                best_count = count
+                best_time = time
 
-            if i >= n - 1:
-                break
+            inc(it)
+
+        return selected
 
-            i += 1
+    cdef _evict_column(self, int i):
+        cdef map[int, Column].iterator it = self.columns.find(i)
+
+        if it == self.columns.end():
+            return
 
-    cpdef compute_diag(self,
-                       np.ndarray[double, ndim=2, mode='c'] X,
-                       np.ndarray[double, ndim=1, mode='c'] out):
-        cdef Py_ssize_t n_samples = X.shape[0]
+        if self.verbose >= 2:
+            print "Evict column", i
+
+        cdef Column col = deref(it).second
+        self._spill_column(i, &col)
+        if self.arena != NULL:
+            self.free_blocks[self.store.n_free] = \
+                (<char*>col.valid - self.arena) / self.block_size
+            self.store.n_free += 1
+        else:
+            stdlib.free(col.data)
+            stdlib.free(col.valid)
+        self.columns.erase(it)
+        self.n_computed[i] = 0
+        self.store.size -= self._column_bytes(col.length)
+
+    cdef void _symmetrize(self, int j):
+        # K[i, j] is both entry i of column j and entry j of column i:
+        # exchange the computed values between column j and the other
+        # resident columns.
+        cdef map[int, Column].iterator it = self.columns.begin()
+        cdef Column col = self.columns[0][j]
+        cdef Column other
         cdef int i
+        cdef int single = self.single
 
-        for i in xrange(n_samples):
-            out[i] = self.kernel.compute_self(X, i)
+        while it != self.columns.end():
+            i = deref(it).first
+            other = deref(it).second
+
+            if i != j:
+                if _is_valid(col.valid, i):
+                    if not _is_valid(other.valid, j):
+                        _store(other.data, j, _load(col.data, i, single),
+                               single)
+                        _set_valid(other.valid, j)
+                        self.n_computed[i] += 1
+                elif _is_valid(other.valid, j):
+                    _store(col.data, i, _load(other.data, j, single), single)
+                    _set_valid(col.valid, i)
+                    self.n_computed[j] += 1
 
+            inc(it)
+
+    cdef _clear_columns(self):
+        while not self.columns.empty():
+            self._evict_column(deref(self.columns.begin()).first)
+
+    cpdef compute_block(self,
+                        X,
+                        rows,
+                        Y,
+                        cols,
+                        np.ndarray[double, ndim=2, mode='c'] out):
+        self.kernel.compute_block(X, rows, Y, cols, out)
+
+    cpdef compute_diag(self, X, np.ndarray[double, ndim=1, mode='c'] out):
+        cdef int n_samples = X.shape[0]
+        cdef double* out_ptr = <double*>out.data
+        cdef Kernel kernel = self.kernel
+        cdef Rows Xr = get_rows(kernel, X)
+        cdef int n_threads = self.n_threads
+        cdef int i
+
+        with nogil:
+            for i in prange(n_samples, num_threads=n_threads,
+                            schedule='static'):
+                out_ptr[i] = _self_value(kernel, &Xr, i)
 
     cpdef compute_column(self,
-                         np.ndarray[double, ndim=2, mode='c'] X,
-                         np.ndarray[double, ndim=2, mode='c'] Y,
+                         X,
+                         Y,
                          int j,
                          np.ndarray[double, ndim=1, mode='c'] out):
 
         cdef int i = 0
-
-        if self.capacity == 0:
-            for i in xrange(self.n_samples):
-                out[i] = self.kernel.compute(X, i, Y, j)
+        cdef int n_samples = self.n_samples
+        cdef double* out_ptr = <double*>out.data
+        cdef Kernel kernel = self.kernel
+        cdef int sparse = sp.issparse(X)
+        cdef int n_threads = self.n_threads
+        cdef int symmetric = self.symmetric and X is Y
+        cdef int by_rows = _by_rows(kernel, X, Y)
+        cdef double* work
+        cdef int n_computed
+        cdef Column col
+        cdef void* cache
+        cdef uint64_t* valid
+        cdef int single = self.single
+        cdef int base = self.base
+
+        _check_same_format(X, Y)
+
+        # Compact columns only cache support vector entries.
+        cdef int uncached = self.capacity == 0 or self.compact
+
+        if uncached:
+            self.store.misses += 1
+            self.store.n_evals += n_samples
+
+        if uncached and not sparse:
+            _compute_block_column(kernel, X, Y, j, out)
             return
 
-        cdef int n_computed = self.n_computed[j]
+        cdef Rows Xr = get_rows(kernel, X)
+        cdef Rows Yr = get_rows(kernel, Y)
+
+        if uncached:
+            work = self._get_work(&Yr, j)
+            with nogil:
+                for i in prange(n_samples, num_threads=n_threads,
+                                schedule='static'):
+                    out_ptr[i] = _column_value(kernel, &Xr, i, &Yr, j, work,
+                                               0, by_rows)
+            self._release_work(&Yr, j)
+            return
 
         self._create_column(j)
-
-        cdef double* cache = &(self.columns[0][j][0])
-
-        if n_computed == -1:
-            # Full column is already computed.
-            for i in xrange(self.n_samples):
-                out[i] = cache[i]
-        elif n_computed > 0:
-            # Some elements are already computed.
-            for i in xrange(self.n_samples):
-                if cache[i] == 0:
-                    out[i] = self.kernel.compute(X, i, Y, j)
-                    cache[i] = out[i]
+        self._touch_column(j)
+        # Keep the column resident while its values are computed.
+        self.pins[j] += 1
+        try:
+            if self.n_computed[j] < n_samples:
+                self._take_prefetched(X, Y, j)
+            if symmetric:
+                # Prefill from the resident columns.
+                self._symmetrize(j)
+            n_computed = self.n_computed[j]
+            self.store.n_evals += n_samples - n_computed
+
+            col = self.columns[0][j]
+            cache = col.data
+            valid = col.valid
+
+            if n_computed == n_samples and base:
+                with nogil:
+                    for i in prange(n_samples, num_threads=n_threads,
+                                    schedule='static'):
+                        out_ptr[i] = kernel._transform(_load(cache, i, single))
+            elif n_computed == n_samples:
+                # Full column is already computed.
+                if single:
+                    with nogil:
+                        for i in xrange(n_samples):
+                            out_ptr[i] = (<float*>cache)[i]
                 else:
-                    out[i] = cache[i]
-        else:
-            # All elements must be computed.
-            for i in xrange(self.n_samples):
-                out[i] = self.kernel.compute(X, i, Y, j)
-                cache[i] = out[i]
+                    memcpy(out_ptr, cache, n_samples * sizeof(double))
+            elif n_computed > 0 or sparse or base:
+                # Some elements are already computed. The bitmap is only read
+                # here, so rows can be filled concurrently.
+                work = self._get_work(&Yr, j)
+                with nogil:
+                    for i in prange(n_samples, num_threads=n_threads,
+                                    schedule='static'):
+                        if _is_valid(valid, i):
+                            out_ptr[i] = _load(cache, i, single)
+                        else:
+                            out_ptr[i] = _store(cache, i,
+                                                _column_value(kernel, &Xr, i,
+                                                              &Yr, j, work,
+                                                              base, by_rows),
+                                                single)
+                        if base:
+                            out_ptr[i] = kernel._transform(out_ptr[i])
+                self._release_work(&Yr, j)
+            else:
+                # All elements must be computed.
+                _compute_block_column(kernel, X, Y, j, out)
+                if single:
+                    with nogil:
+                        for i in xrange(n_samples):
+                            out_ptr[i] = _store(cache, i, out_ptr[i], 1)
+                else:
+                    memcpy(cache, out_ptr, n_samples * sizeof(double))
 
-        self.n_computed[j] = -1
+            memset(valid, 0xff, self.n_words * sizeof(uint64_t))
+            self.n_computed[j] = n_samples
+        finally:
+            self.pins[j] -= 1
 
+        if symmetric:
+            self._symmetrize(j)
 
     cpdef compute_column_sv(self,
-                            np.ndarray[double, ndim=2, mode='c'] X,
-                            np.ndarray[double, ndim=2, mode='c'] Y,
+                            X,
+                            Y,
                             int j,
                             np.ndarray[double, ndim=1, mode='c'] out):
 
-        cdef int s
-        cdef list[int].iterator it
-        cdef int n_computed = self.n_computed[j]
-        cdef int ssize = self.support_set.size()
+        cdef int s, t, k, c
+        cdef int compact = self.compact
+        cdef int n_computed = 0
+        cdef int n_missing = 0
+        cdef int* missing = self.missing
+        cdef int ssize = self.n_support
+        cdef int n_threads = self.n_threads
+        cdef double* out_ptr = <double*>out.data
+        cdef Kernel kernel = self.kernel
+        cdef int* support_set = <int*>self.support_set.data
+        cdef int symmetric = self.symmetric and X is Y
+        cdef double* work
+        cdef Column col
+        cdef void* cache = NULL
+        cdef uint64_t* valid = NULL
+        cdef int single = self.single
+        cdef int base = 0
+        cdef int by_rows = _by_rows(kernel, X, Y)
+        cdef int pinned = 0
 
         if ssize == 0:
             return
 
-        if self.capacity == 0:
-            it = self.support_set.begin()
-            while it != self.support_set.end():
-                s = deref(it)
-                out[s] = self.kernel(X, s, Y, j)
-                inc(it)
+        _check_same_format(X, Y)
+        cdef Rows Xr = get_rows(kernel, X)
+        cdef Rows Yr = get_rows(kernel, Y)
+
+        if self.capacity > 0:
+            self._create_column(j)
+            self._touch_column(j)
+            self.pins[j] += 1
+            pinned = 1
+        else:
+            self.store.misses += 1
+
+        try:
+            if pinned:
+                if not compact and self.n_computed[j] < self.n_samples:
+                    self._take_prefetched(X, Y, j)
+                if symmetric:
+                    self._symmetrize(j)
+                n_computed = self.n_computed[j]
+                if compact:
+                    col = self._grow_column(j, ssize)
+                else:
+                    col = self.columns[0][j]
+                cache = col.data
+                valid = col.valid
+                base = self.base
+
+            work = self._get_work(&Yr, j)
+            with nogil:
+                # Copy cached entries and collect the ones to compute, so that
+                # they can be computed in parallel.
+                for k in xrange(ssize):
+                    s = support_set[k]
+                    c = k if compact else s
+                    if valid != NULL and _is_valid(valid, c):
+                        out_ptr[s] = _load(cache, c, single)
+                        if base:
+                            out_ptr[s] = kernel._transform(out_ptr[s])
+                    else:
+                        missing[n_missing] = k
+                        n_missing += 1
+
+                for k in prange(n_missing, num_threads=n_threads,
+                                schedule='static'):
+                    t = support_set[missing[k]]
+                    out_ptr[t] = _column_value(kernel, &Xr, t, &Yr, j, work,
+                                               base, by_rows)
+                    if cache != NULL:
+                        c = missing[k] if compact else t
+                        out_ptr[t] = _store(cache, c, out_ptr[t], single)
+                    if base:
+                        out_ptr[t] = kernel._transform(out_ptr[t])
+
+            # Bits of different entries share words: set them serially, and
+            # while holding the GIL since forks may share the column.
+            if valid != NULL:
+                for k in xrange(n_missing):
+                    c = missing[k] if compact else support_set[missing[k]]
+                    _set_valid(valid, c)
+
+            self._release_work(&Yr, j)
+            self.store.n_evals += n_missing
+
+            if valid != NULL:
+                self.n_computed[j] = n_computed + n_missing
+        finally:
+            if pinned:
+                self.pins[j] -= 1
+
+        if valid != NULL and symmetric:
+            self._symmetrize(j)
+
+    cpdef fill_columns(self,
+                       X,
+                       Y,
+                       np.ndarray[int, ndim=1, mode='c'] indices,
+                       int start,
+                       int stop):
+        """Compute the columns indices[start:stop] that are not in the cache
+        with a single kernel block."""
+        cdef int i, j, k
+        cdef int n_samples = self.n_samples
+        cdef int single = self.single
+        cdef int symmetric = self.symmetric and X is Y
+        cdef Column col
+
+        if self.capacity == 0 or self.compact:
             return
 
-        self._create_column(j)
-        cdef double* cache = &(self.columns[0][j][0])
+        _check_same_format(X, Y)
 
-        if n_computed == -1:
-            it = self.support_set.begin()
-            while it != self.support_set.end():
-                s = deref(it)
-                out[s] = cache[s]
-                inc(it)
-            return
+        # The block must not evict its own columns, and its temporary
+        # buffer stays within MISS_BLOCK columns.
+        cdef int max_cols = min(max(self.capacity / self.col_size / 2, 1),
+                                MISS_BLOCK)
+        cdef list cols = []
 
-        it = self.support_set.begin()
-        while it != self.support_set.end():
-            s = deref(it)
-            if cache[s] == 0:
-                out[s] = self.kernel.compute(X, s, Y, j)
-                cache[s] = out[s]
-            else:
-                out[s] = cache[s]
+        for k in xrange(start, stop):
+            j = indices[k]
+            if not self.columns.count(j):
+                cols.append(j)
+                if len(cols) == max_cols:
+                    break
 
-            inc(it)
+        if len(cols) == 0:
+            return
 
-        self.n_computed[j] = ssize
+        if self.base:
+            # Kernel blocks hold kernel values: compute base values column
+            # by column.
+            buf = np.zeros(n_samples, dtype=np.float64)
+            for j in cols:
+                self.compute_column(X, Y, j, buf)
+            return
+
+        cdef np.ndarray[double, ndim=2] block
+        cdef np.ndarray[double, ndim=2, mode='c'] rows
+        if _by_rows(self.kernel, X, Y):
+            rows = np.zeros((len(cols), n_samples), dtype=np.float64)
+            self.kernel.compute_block(Y, np.array(cols, dtype=np.int32), X,
+                                      None, rows)
+            block = rows.T
+        else:
+            block = np.zeros((n_samples, len(cols)), dtype=np.float64)
+            self.kernel.compute_block(X, None, Y,
+                                      np.array(cols, dtype=np.int32), block)
+        self.store.n_evals += n_samples * len(cols)
+
+        for k in xrange(len(cols)):
+            j = cols[k]
+            self._create_column(j)
+            self._touch_column(j)
+            col = self.columns[0][j]
+            for i in xrange(n_samples):
+                _store(col.data, i, block[i, k], single)
+            memset(col.valid, 0xff, self.n_words * sizeof(uint64_t))
+            self.n_computed[j] = n_samples
+            if symmetric:
+                self._symmetrize(j)
 
     cpdef remove_column(self, int i):
         if self.verbose >= 2:
             print "Remove column SV", i
 
-        cdef map[int, double*].iterator it
-        cdef int col_size = self.n_samples * sizeof(double)
-
-        it = self.columns.find(i)
-
-        if it != self.columns.end():
-            self.n_computed[deref(it).first] = 0
-            stdlib.free(deref(it).second)
-            self.columns.erase(it)
-            self.size -= col_size
+        if self.pins[i] == 0:
+            self._evict_column(i)
 
     cpdef add_sv(self, int i):
         if self.verbose >= 2:
             print "Add SV", i
 
-        cdef list[int].iterator it
         if self.support_vector[i] == -1:
-            self.support_set.push_back(i)
-            it = self.support_set.end()
-            dec(it)
-            self.support_it[i] = it
-            self.support_vector[i] = self.support_set.size() - 1
+            self.support_set[self.n_support] = i
+            self.support_vector[i] = self.n_support
+            self.n_support += 1
 
     cpdef remove_sv(self, int i):
         if self.verbose >= 2:
             print "Remove SV", i
 
-        cdef list[int].iterator it
-        cdef map[int, double*].iterator it2
-        cdef double* cache
-        cdef int j
-
-        if self.support_vector[i] >= 0:
-            it = self.support_it[i]
-            self.support_set.erase(it)
-            k = self.support_vector[i]
+        cdef int pos = self.support_vector[i]
+        cdef int last
+        cdef map[int, Column].iterator it
+        cdef Column col
+
+        # Cached kernel values stay valid: only the support set changes.
+        if pos >= 0:
+            # Move the last support vector into the freed position.
+            self.n_support -= 1
+            last = self.support_set[self.n_support]
+            self.support_set[pos] = last
+            self.support_vector[last] = pos
             self.support_vector[i] = -1
 
-            it2 = self.columns.begin()
-            while it2 != self.columns.end():
-                j = deref(it2).first
-                self.columns[0][j][i] = 0
-                inc(it2)
+            if self.compact:
+                # Compact columns are indexed by position: move their
+                # entries the same way.
+                it = self.columns.begin()
+                while it != self.columns.end():
+                    col = deref(it).second
+                    self._compact_column(deref(it).first, &col, pos,
+                                         self.n_support)
+                    inc(it)
+
+    cpdef clear_sv(self):
+        # Last first, so that compact columns are not reordered.
+        while self.n_support > 0:
+            self.remove_sv(self.support_set[self.n_support - 1])
+
+    cdef void _compact_column(self, int j, Column* col, int pos, int last):
+        if pos < col.length and _is_valid(col.valid, pos):
+            _clear_valid(col.valid, pos)
+            self.n_computed[j] -= 1
+
+        if pos != last and last < col.length and _is_valid(col.valid, last):
+            _store(col.data, pos, _load(col.data, last, self.single),
+                   self.single)
+            _set_valid(col.valid, pos)
+            _clear_valid(col.valid, last)
+
+    cpdef start_prefetch(self, X, Y, int depth, double timeout=1.0):
+        """Start a worker thread computing the columns of (X, Y) passed to
+        prefetch, up to depth columns ahead.
+
+        A column the worker has started but not finished within timeout
+        seconds is computed in place instead."""
+        cdef int i
+
+        self.stop_prefetch()
+
+        if depth <= 0 or self.capacity == 0 or self.compact:
+            return
+
+        _check_same_format(X, Y)
+        self.pf_refs = [X, Y]
+        if sp.issparse(Y):
+            # Keep the squared norms the rows point to alive.
+            self.pf_refs.append(self.kernel._get_sq_norms(X))
+            self.pf_refs.append(self.kernel._get_sq_norms(Y))
+            self.pf_work = <double*> stdlib.calloc(Y.shape[1], sizeof(double))
+        self.pf_X = get_rows(self.kernel, X)
+        self.pf_Y = get_rows(self.kernel, Y)
+        self.pf_by_rows = _by_rows(self.kernel, X, Y)
+
+        self.pf_buffer = <double*> stdlib.malloc(sizeof(double) * depth *
+                                                 self.n_samples)
+        self.pf_index = <int*> stdlib.malloc(sizeof(int) * depth)
+        self.pf_state = <int*> stdlib.malloc(sizeof(int) * depth)
+        for i in xrange(depth):
+            self.pf_index[i] = -1
+            self.pf_state[i] = 0
+        self.pf_stop = 0
+        self.pf_depth = depth
+        self.pf_timeout = timeout
+
+        self.pf_thread = threading.Thread(target=self._prefetch_loop)
+        self.pf_thread.daemon = True
+        self.pf_thread.start()
+
+    def _prefetch_loop(self):
+        cdef Kernel kernel = self.kernel
+        cdef int n_samples = self.n_samples
+        cdef int base = self.base
+        cdef int slot, i, j
+        cdef double* dest
+
+        with nogil:
+            pthread_mutex_lock(&self.pf_lock)
+            while not self.pf_stop:
+                slot = -1
+                for i in xrange(self.pf_depth):
+                    if self.pf_state[i] == 1:
+                        slot = i
+                        break
+
+                if slot == -1:
+                    pthread_cond_wait(&self.pf_cond, &self.pf_lock)
+                    continue
+
+                self.pf_state[slot] = 2
+                j = self.pf_index[slot]
+                pthread_mutex_unlock(&self.pf_lock)
+
+                dest = self.pf_buffer + slot * n_samples
+                if self.pf_work != NULL:
+                    _scatter(&self.pf_Y, j, self.pf_work, 0)
+                for i in xrange(n_samples):
+                    dest[i] = _column_value(kernel, &self.pf_X, i,
+                                            &self.pf_Y, j, self.pf_work,
+                                            base, self.pf_by_rows)
+                if self.pf_work != NULL:
+                    _scatter(&self.pf_Y, j, self.pf_work, 1)
+
+                pthread_mutex_lock(&self.pf_lock)
+                if self.pf_state[slot] == 4:
+                    # Given up by _take_prefetched.
+                    self.pf_state[slot] = 0
+                    self.pf_wasted += 1
+                else:
+                    self.pf_state[slot] = 3
+                self.pf_evals += n_samples
+                pthread_cond_broadcast(&self.pf_cond)
+            pthread_mutex_unlock(&self.pf_lock)
+
+    cdef int _prefetch_slot(self, int j) nogil:
+        cdef int slot
+
+        for slot in xrange(self.pf_depth):
+            if self.pf_state[slot] != 0 and self.pf_state[slot] != 4 and \
+               self.pf_index[slot] == j:
+                return slot
+
+        return -1
+
+    cpdef prefetch(self,
+                   np.ndarray[int, ndim=1, mode='c'] indices,
+                   int start,
+                   int stop):
+        """Queue the columns indices[start:stop] for the worker thread.
+
+        Prefetched columns outside of this window are dropped."""
+        cdef int depth = self.pf_depth
+        cdef int k, j, slot, needed
+
+        if depth == 0:
+            return
+
+        stop = min(stop, start + depth)
+
+        pthread_mutex_lock(&self.pf_lock)
+
+        for slot in xrange(depth):
+            if self.pf_state[slot] == 1 or self.pf_state[slot] == 3:
+                needed = 0
+                for k in xrange(start, stop):
+                    if indices[k] == self.pf_index[slot]:
+                        needed = 1
+                        break
+                if not needed:
+                    if self.pf_state[slot] == 3:
+                        self.pf_wasted += 1
+                    self.pf_state[slot] = 0
+
+        slot = 0
+        for k in xrange(start, stop):
+            j = indices[k]
+            if self.n_computed[j] == self.n_samples or \
+               self._prefetch_slot(j) >= 0:
+                continue
+            while slot < depth and self.pf_state[slot] != 0:
+                slot += 1
+            if slot == depth:
+                break
+            self.pf_index[slot] = j
+            self.pf_state[slot] = 1
+
+        pthread_cond_broadcast(&self.pf_cond)
+        pthread_mutex_unlock(&self.pf_lock)
+
+    cdef int _take_prefetched(self, X, Y, int j) except -1:
+        # Move column j from the prefetch buffer to its (resident) cache
+        # column.
+        cdef int slot, i
+        cdef int n_samples = self.n_samples
+        cdef Column col
+        cdef double* src
+        cdef timespec deadline
+
+        if self.pf_depth == 0 or X is not self.pf_refs[0] or \
+           Y is not self.pf_refs[1]:
+            return 0
+
+        with nogil:
+            pthread_mutex_lock(&self.pf_lock)
+            slot = self._prefetch_slot(j)
+            if slot >= 0 and self.pf_state[slot] == 1:
+                # Not started yet: the caller computes it.
+                self.pf_state[slot] = 0
+                slot = -1
+            elif slot >= 0 and self.pf_state[slot] == 2:
+                self.pf_late += 1
+                _deadline(&deadline, self.pf_timeout)
+                while self.pf_state[slot] != 3:
+                    if pthread_cond_timedwait(&self.pf_cond, &self.pf_lock,
+                                              &deadline) != 0:
+                        break
+                if self.pf_state[slot] != 3:
+                    # The worker stalls: leave it the slot and compute the
+                    # column in place.
+                    self.pf_state[slot] = 4
+                    self.pf_timeouts += 1
+                    slot = -1
+            elif slot >= 0:
+                self.pf_hits += 1
+            pthread_mutex_unlock(&self.pf_lock)
+
+        if slot < 0:
+            return 0
+
+        # Ready slots are only released by this thread.
+        col = self.columns[0][j]
+        src = self.pf_buffer + slot * n_samples
+        if self.single:
+            for i in xrange(n_samples):
+                _store(col.data, i, src[i], 1)
+        else:
+            memcpy(col.data, src, n_samples * sizeof(double))
+        memset(col.valid, 0xff, self.n_words * sizeof(uint64_t))
+        self.n_computed[j] = n_samples
+
+        pthread_mutex_lock(&self.pf_lock)
+        self.pf_state[slot] = 0
+        pthread_mutex_unlock(&self.pf_lock)
+
+        return 1
+
+    cpdef stop_prefetch(self):
+        cdef int slot
+
+        if self.pf_depth == 0:
+            return
+
+        pthread_mutex_lock(&self.pf_lock)
+        self.pf_stop = 1
+        for slot in xrange(self.pf_depth):
+            if self.pf_state[slot] == 3:
+                self.pf_wasted += 1
+        pthread_cond_broadcast(&self.pf_cond)
+        pthread_mutex_unlock(&self.pf_lock)
+
+        self.pf_thread.join()
+        self.pf_thread = None
+        self.pf_refs = None
+        self.pf_depth = 0
+
+        stdlib.free(self.pf_buffer)
+        stdlib.free(self.pf_index)
+        stdlib.free(self.pf_state)
+        stdlib.free(self.pf_work)
+        self.pf_buffer = NULL
+        self.pf_index = NULL
+        self.pf_state = NULL
+        self.pf_work = NULL
+
+        if self.root is not None:
+            # The statistics of a fork are reported by its root, whose
+            # worker may be running.
+            pthread_mutex_lock(&self.root.pf_lock)
+            self.root.pf_hits += self.pf_hits
+            self.root.pf_late += self.pf_late
+            self.root.pf_timeouts += self.pf_timeouts
+            self.root.pf_wasted += self.pf_wasted
+            self.root.pf_evals += self.pf_evals
+            pthread_mutex_unlock(&self.root.pf_lock)
+            self.pf_hits = 0
+            self.pf_late = 0
+            self.pf_timeouts = 0
+            self.pf_wasted = 0
+            self.pf_evals = 0
+
+    def set_kernel(self, Kernel kernel):
+        """Compute subsequent values with kernel.
+
+        Cached columns are kept if they hold values of kernel: in base mode,
+        this is the case for any kernel of the same type, e.g. an RBF kernel
+        with another gamma. Otherwise, they are cleared."""
+        self.stop_prefetch()
+
+        if self.base:
+            keep = type(kernel) is type(self.kernel)
+        else:
+            keep = kernel._params() == self.kernel._params()
+
+        if not keep:
+            self._clear_columns()
+
+        self.kernel = kernel
+
+    cpdef KernelCache fork(self):
+        """Return a cache sharing the columns of this one, with its own
+        (empty) support set.
+
+        The cache and its forks can be used from different threads, e.g. to
+        solve several binary subproblems in parallel. Columns are pinned
+        while a thread computes them, so that other threads don't evict
+        them.
+
+        If this cache is prefetching, the fork starts its own worker on the
+        same data: call its stop_prefetch when done, which adds its prefetch
+        statistics to those of the root cache."""
+        if self.compact:
+            raise ValueError("Compact columns cannot be shared between "
+                             "support sets.")
+
+        cdef KernelCache view = KernelCache.__new__(KernelCache, self.kernel,
+                                                    self.n_samples)
+        view.root = self if self.root is None else self.root
+        view.kernel = self.kernel
+        view.verbose = self.verbose
+        view.n_threads = self.n_threads
+        view.work = None
+
+        view.store = self.store
+        view.columns = self.columns
+        view.pins = self.pins
+        view.n_computed = self.n_computed
+        view.n_words = self.n_words
+        view.single = self.single
+        view.col_size = self.col_size
+        view.symmetric = self.symmetric
+        view.base = self.base
+        view.capacity = self.capacity
+        view.policy = self.policy
+        view.last_access = self.last_access
+        view.n_access = self.n_access
+        view.spill_file = self.spill_file
+        view.spill = self.spill
+        view.n_slots = self.n_slots
+        view.spill_slot = self.spill_slot
+        view.spill_count = self.spill_count
+        view.slot_owner = self.slot_owner
+        view.arena = self.arena
+        view.arena_size = self.arena_size
+        view.block_size = self.block_size
+        view.free_blocks = self.free_blocks
+        view.staging = self.staging
+
+        if self.pf_depth > 0:
+            view.start_prefetch(self.pf_refs[0], self.pf_refs[1],
+                                self.pf_depth, self.pf_timeout)
+
+        return view
 
     cpdef int n_sv(self):
-        return self.support_set.size()
+        return self.n_support
+
+    cpdef int[::1] get_support_set(self):
+        return self.support_set[:self.n_support]
+
+    cpdef int is_cached(self, int i):
+        return self.columns.count(i)
 
     cpdef get_size(self):
-        return self.size
+        return self.store.size
+
+    cpdef get_stats(self):
+        cdef int i, n_spilled = 0
+
+        for i in xrange(self.n_slots):
+            if self.slot_owner[i] >= 0:
+                n_spilled += 1
+
+        return {"memory_hits": self.store.memory_hits,
+                "disk_hits": self.store.disk_hits,
+                "misses": self.store.misses,
+                "spilled": n_spilled,
+                "evaluations": self.store.n_evals + self.pf_evals,
+                "prefetch_hits": self.pf_hits,
+                "prefetch_late": self.pf_late,
+                "prefetch_timeouts": self.pf_timeouts,
+                "prefetch_wasted": self.pf_wasted}
 
 
 def get_kernel(kernel, **kw):
@@ -381,5 +1942,38 @@ def get_kernel(kernel, **kw):
         return PolynomialKernel(degree=kw["degree"],
                                 coef0=kw["coef0"],
                                 gamma=kw["gamma"])
+    elif kernel == "intersection":
+        return IntersectionKernel()
+    elif kernel == "additive_chi2":
+        return AdditiveChi2Kernel()
+    elif kernel == "binary_linear":
+        return BinaryLinearKernel()
+    elif kernel == "hamming":
+        return HammingKernel(gamma=kw["gamma"])
+    elif kernel == "jaccard" or kernel == "tanimoto":
+        return JaccardKernel()
     elif kernel == "precomputed":
         return PrecomputedKernel()
+    else:
+        raise ValueError("Unknown kernel '%s'." % kernel)
+
+
+def pack_binary(X, int chunk_size=1000):
+    """Pack the non-zero pattern of a dense array or sparse matrix into rows
+    of uint64 words, 64 features per word, for the binary kernels
+    (binary_linear, hamming and jaccard)."""
+    cdef int n_samples = X.shape[0]
+    cdef int n_words = (X.shape[1] + 63) / 64
+    cdef int start
+
+    out = np.zeros((n_samples, n_words), dtype=np.uint64)
+    out_bytes = out.view(np.uint8)
+
+    for start in xrange(0, n_samples, chunk_size):
+        chunk = X[start:start + chunk_size]
+        if sp.issparse(chunk):
+            chunk = chunk.toarray()
+        bits = np.packbits(chunk != 0, axis=1)
+        out_bytes[start:start + bits.shape[0], :bits.shape[1]] = bits
+
+    return out
@@ -9,7 +9,6 @@ from sklearn.utils import check_random_state, safe_mask
 from sklearn.metrics.pairwise import pairwise_kernels
 
 from .base import BaseKernelClassifier
-from .kernel_fast import KernelCache
 from .lasvm_fast import _lasvm
 
 class LaSVM(BaseKernelClassifier, ClassifierMixin):
@@ -19,8 +18,11 @@ class LaSVM(BaseKernelClassifier, ClassifierMixin):
                  selection="permute", search_size=60,
                  termination="n_iter", n_components=1000,
                  tau=1e-3, finish_step=True,
-                 warm_start=False, cache_mb=500,
-                 random_state=None, callback=None, verbose=0, n_jobs=1):
+                 warm_start=False, cache_mb=500, memory_limit=None,
+                 cache_policy="lru",
+                 cache_dtype="float64", compact_sv=False,
+                 cache_symmetric=False, random_state=None, callback=None,
+                 verbose=0, n_jobs=1, ovr_jobs=1):
         self.C = C
         self.max_iter = max_iter
         self.kernel = kernel
@@ -36,15 +38,22 @@ class LaSVM(BaseKernelClassifier, ClassifierMixin):
         self.warm_start = warm_start
         self.random_state = random_state
         self.cache_mb = cache_mb
+        self.memory_limit = memory_limit
+        self.cache_policy = cache_policy
+        self.cache_dtype = cache_dtype
+        self.compact_sv = compact_sv
+        self.cache_symmetric = cache_symmetric
         self.callback = callback
         self.verbose = verbose
         self.n_jobs = n_jobs
+        self.ovr_jobs = ovr_jobs
         self.support_vectors_ = None
         self.coef_ = None
 
     def fit(self, X, y):
         n_samples = X.shape[0]
         rs = self._get_random_state()
+        X = self._check_input(X)
 
         self.label_binarizer_ = LabelBinarizer(neg_label=-1, pos_label=1)
         Y = self.label_binarizer_.fit_transform(y).astype(np.float64)
@@ -62,21 +71,26 @@ class LaSVM(BaseKernelClassifier, ClassifierMixin):
 
         self.coef_ = coef
 
-        kernel = self._get_kernel()
-        kcache = KernelCache(kernel, n_samples, self.cache_mb, 1, self.verbose)
+        kcache = self._get_kernel_cache(n_samples, (X, Y, self.coef_),
+                                        compact_sv=self.compact_sv,
+                                        symmetric=self.cache_symmetric)
         self.support_vectors_ = X
 
-        for i in xrange(n_vectors):
-            b = _lasvm(self, self.coef_[i],
-                       X, Y[:, i], kcache, self.selection, self.search_size,
-                       self.termination, self.n_components, self.tau,
-                       self.finish_step, self.C, self.max_iter, rs,
-                       self.callback,
-                       verbose=self.verbose, warm_start=warm_start)
-            self.intercept_[i] = b
+        def _fit(i, kcache, rs):
+            self.intercept_[i] = _lasvm(self, self.coef_[i],
+                                        X, Y[:, i], kcache, self.selection,
+                                        self.search_size, self.termination,
+                                        self.n_components, self.tau,
+                                        self.finish_step, self.C,
+                                        self.max_iter, rs, self.callback,
+                                        verbose=self.verbose,
+                                        warm_start=warm_start)
+
+        self._fit_binary(_fit, n_vectors, kcache, rs)
 
         sv = np.sum(self.coef_ != 0, axis=0, dtype=bool)
         self.support_indices_ = np.arange(n_samples)[sv]
+        self.cache_stats_ = kcache.get_stats()
 
         self._post_process(X)
 
@@ -28,20 +28,19 @@ cdef struct Intpair:
 
 cdef Intpair _argmin_argmax(np.ndarray[double, ndim=1] y,
                             np.ndarray[double, ndim=1, mode='c'] g,
-                            list[int]* support_set,
+                            int[::1] support_set,
                             np.ndarray[double, ndim=1, mode='c'] alpha,
                             double C):
 
-    cdef int s, sel_min, sel_max
+    cdef int k, s, sel_min, sel_max
     cdef double min_ = DBL_MAX
     cdef double max_ = -DBL_MAX
     cdef double As
     cdef double Bs
     cdef double Cy
 
-    cdef list[int].iterator it = support_set.begin()
-    while it != support_set.end():
-        s = deref(it)
+    for k in xrange(support_set.shape[0]):
+        s = support_set[k]
         Cy = C * y[s]
 
         As = min(0, Cy)
@@ -55,8 +54,6 @@ cdef Intpair _argmin_argmax(np.ndarray[double, ndim=1] y,
             min_ = g[s]
             sel_min = s
 
-        inc(it)
-
     cdef Intpair ret
     ret.left = sel_min
     ret.right = sel_max
@@ -64,7 +61,7 @@ cdef Intpair _argmin_argmax(np.ndarray[double, ndim=1] y,
     return ret
 
 
-cdef void _update(np.ndarray[double, ndim=2, mode='c'] X,
+cdef void _update(X,
                   np.ndarray[double, ndim=1] y,
                   KernelCache kcache,
                   np.ndarray[double, ndim=1, mode='c'] g,
@@ -75,7 +72,7 @@ cdef void _update(np.ndarray[double, ndim=2, mode='c'] X,
                   double Bi,
                   np.ndarray[double, ndim=1, mode='c'] col,
                   np.ndarray[double, ndim=1, mode='c'] col2):
-    cdef list[int]* support_set = kcache.support_set
+    cdef int[::1] support_set = kcache.get_support_set()
     cdef double Kii, Kjj, Kij, Kis, Kjs
 
     # Need only three elements.
@@ -88,18 +85,16 @@ cdef void _update(np.ndarray[double, ndim=2, mode='c'] X,
     alpha[j] -= lambda_
 
 
-    cdef int s
-    cdef list[int].iterator it = support_set.begin()
+    cdef int k, s
     kcache.compute_column_sv(X, X, i, col)
     kcache.compute_column_sv(X, X, j, col2)
-    while it != support_set.end():
-        s = deref(it)
+    for k in xrange(support_set.shape[0]):
+        s = support_set[k]
         g[s] -= lambda_ * (col[s] - col2[s])
-        inc(it)
 
 
 cdef void _process(int k,
-                   np.ndarray[double, ndim=2, mode='c'] X,
+                   X,
                    np.ndarray[double, ndim=1] y,
                    KernelCache kcache,
                    np.ndarray[double, ndim=1, mode='c'] alpha,
@@ -110,26 +105,25 @@ cdef void _process(int k,
                    np.ndarray[double, ndim=1, mode='c'] col2):
 
     cdef int* support_vectors = kcache.support_vector
-    cdef list[int]* support_set = kcache.support_set
+    cdef int[::1] support_set = kcache.get_support_set()
 
     if support_vectors[k] >= 0:
         return
 
     alpha[k] = 0
 
-    cdef int s, j, i
+    cdef int l, s, j, i
     cdef double pred = 0
 
-    cdef list[int].iterator it = support_set.begin()
     kcache.compute_column_sv(X, X, k, col)
-    while it != support_set.end():
-        s = deref(it)
+    for l in xrange(support_set.shape[0]):
+        s = support_set[l]
         pred += alpha[s] * col[s]
-        inc(it)
 
     g[k] = y[k] - pred
 
     kcache.add_sv(k)
+    support_set = kcache.get_support_set()
 
     if y[k] == 1:
         i = k
@@ -151,7 +145,7 @@ cdef void _process(int k,
 
 
 
-cdef void _reprocess(np.ndarray[double, ndim=2, mode='c'] X,
+cdef void _reprocess(X,
                      np.ndarray[double, ndim=1] y,
                      KernelCache kcache,
                      np.ndarray[double, ndim=1, mode='c'] alpha,
@@ -164,7 +158,7 @@ cdef void _reprocess(np.ndarray[double, ndim=2, mode='c'] X,
                      np.ndarray[double, ndim=1, mode='c'] col2):
 
     cdef int* support_vectors = kcache.support_vector
-    cdef list[int]* support_set = kcache.support_set
+    cdef int[::1] support_set = kcache.get_support_set()
 
     cdef Intpair p
     p = _argmin_argmax(y, g, support_set, alpha, C)
@@ -189,17 +183,15 @@ cdef void _reprocess(np.ndarray[double, ndim=2, mode='c'] X,
     cdef int s, k = 0
     cdef int n_removed = 0
 
-    cdef list[int].iterator it = support_set.begin()
+    cdef list[int].iterator it
     cdef list[int] to_remove
-    while it != support_set.end():
-        s = deref(it)
+    for k in xrange(support_set.shape[0]):
+        s = support_set[k]
 
         if alpha[s] == 0:
             if (y[s] == -1 and g[s] >= g[i]) or (y[s] == 1 and g[s] <= g[j]):
                 to_remove.push_back(s)
 
-        inc(it)
-
     it = to_remove.begin()
     while it != to_remove.begin():
         kcache.remove_sv(deref(it))
@@ -210,7 +202,7 @@ cdef void _reprocess(np.ndarray[double, ndim=2, mode='c'] X,
 
 
 cdef void _boostrap(index,
-                    np.ndarray[double, ndim=2, mode='c'] X,
+                    X,
                     np.ndarray[double, ndim=1] y,
                     KernelCache kcache,
                     np.ndarray[double, ndim=1, mode='c'] alpha,
@@ -218,7 +210,6 @@ cdef void _boostrap(index,
                     np.ndarray[double, ndim=1, mode='c'] col,
                     rs):
     cdef int* support_vectors = kcache.support_vector
-    cdef list[int]* support_set = kcache.support_set
     cdef np.ndarray[int, ndim=1, mode='c'] A = index
     cdef int n_pos = 0
     cdef int n_neg = 0
@@ -251,14 +242,13 @@ cdef void _boostrap(index,
 
 
 cdef void _boostrap_warm_start(index,
-                               np.ndarray[double, ndim=2, mode='c']X,
+                               X,
                                np.ndarray[double, ndim=1]y,
                                KernelCache kcache,
                                np.ndarray[double, ndim=1, mode='c'] alpha,
                                np.ndarray[double, ndim=1, mode='c'] g,
                                np.ndarray[double, ndim=1, mode='c'] col):
     cdef int* support_vectors = kcache.support_vector
-    cdef list[int]* support_set = kcache.support_set
     cdef np.ndarray[int, ndim=1, mode='c'] A = index
     cdef int i, s
     cdef Py_ssize_t n_samples = index.shape[0]
@@ -277,7 +267,7 @@ cdef void _boostrap_warm_start(index,
 
 def _lasvm(self,
            np.ndarray[double, ndim=1, mode='c'] alpha,
-           np.ndarray[double, ndim=2, mode='c'] X,
+           X,
            np.ndarray[double, ndim=1] y,
            KernelCache kcache,
            selection,
@@ -299,8 +289,6 @@ def _lasvm(self,
     cdef np.ndarray[int, ndim=1, mode='c'] A
     A = np.arange(n_samples, dtype=np.int32)
 
-    cdef list[int] support_set
-
     cdef np.ndarray[double, ndim=1, mode='c'] g
     g = y.copy()
 
@@ -2,17 +2,27 @@ cimport numpy as np
 
 from lightning.kernel_fast cimport Kernel
 
-cpdef decision_function_alpha(np.ndarray[double, ndim=2, mode='c'] X,
-                              np.ndarray[double, ndim=2, mode='c'] sv,
+cpdef decision_function_alpha(X,
+                              sv,
                               np.ndarray[double, ndim=2, mode='c'] alpha,
                               np.ndarray[double, ndim=1, mode='c'] b,
                               Kernel kernel,
-                              np.ndarray[double, ndim=2, mode='c'] out)
+                              np.ndarray[double, ndim=2, mode='c'] out,
+                              int block_size=*,
+                              int row_block_size=*)
 
-cpdef predict_alpha(np.ndarray[double, ndim=2, mode='c'] X,
-                    np.ndarray[double, ndim=2, mode='c'] sv,
+cpdef predict_alpha(X,
+                    sv,
                     np.ndarray[double, ndim=2, mode='c'] alpha,
                     np.ndarray[double, ndim=1, mode='c'] b,
                     np.ndarray[int, ndim=1, mode='c'] classes,
                     Kernel kernel,
                     np.ndarray[double, ndim=1, mode='c'] out)
+
+cpdef decision_function_tables(X,
+                               np.ndarray[double, ndim=2, mode='c'] grid,
+                               np.ndarray[double, ndim=3, mode='c'] values,
+                               np.ndarray[double, ndim=2, mode='c'] left,
+                               np.ndarray[double, ndim=2, mode='c'] right,
+                               np.ndarray[double, ndim=1, mode='c'] b,
+                               np.ndarray[double, ndim=2, mode='c'] out)
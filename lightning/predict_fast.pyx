@@ -11,41 +11,66 @@ cdef extern from "float.h":
 
 import numpy as np
 cimport numpy as np
+import scipy.sparse as sp
 
-cpdef decision_function_alpha(np.ndarray[double, ndim=2, mode='c'] X,
-                              np.ndarray[double, ndim=2, mode='c'] sv,
+from lightning.kernel_fast import IntersectionKernel, AdditiveChi2Kernel
+
+cpdef decision_function_alpha(X,
+                              sv,
                               np.ndarray[double, ndim=2, mode='c'] alpha,
                               np.ndarray[double, ndim=1, mode='c'] b,
                               Kernel kernel,
-                              np.ndarray[double, ndim=2, mode='c'] out):
+                              np.ndarray[double, ndim=2, mode='c'] out,
+                              int block_size=256,
+                              int row_block_size=1024):
+    """Add the decision function of X to out, tile by tile.
 
-    cdef Py_ssize_t n_samples = X.shape[0]
-    cdef Py_ssize_t n_sv = sv.shape[0]
-    cdef Py_ssize_t n_vectors = alpha.shape[0]
-    cdef double kvalue
+    The kernel values between row_block_size samples and block_size support
+    vectors are computed with one compute_block call (a matrix product for
+    the linear, polynomial and RBF kernels), then multiplied by the
+    coefficients with another. Only a tile of kernel values is held in
+    memory, and each output row is updated once per tile."""
+    cdef int n_samples = X.shape[0]
+    cdef int n_vectors = alpha.shape[0]
+    cdef int start, stop, sv_start, k
 
-    cdef int i, j, k
+    cdef np.ndarray[double, ndim=2, mode='c'] K
+    cdef np.ndarray[double, ndim=2, mode='c'] tmp
 
-    if n_vectors == 1:
-        for i in xrange(n_sv):
-            if alpha[0, i] != 0:
-                for j in xrange(n_samples):
-                    out[j, 0] += alpha[0, i] * kernel.compute(X, j, sv, i)
-    else:
-        for i in xrange(n_sv):
-            for j in xrange(n_samples):
-                kvalue = kernel.compute(X, j, sv, i)
-                for k in xrange(n_vectors):
-                    out[j, k] += alpha[k, i] * kvalue
+    # Support vectors with a non-zero coefficient for at least one vector.
+    nz = np.flatnonzero(np.any(alpha != 0, axis=0)).astype(np.int32)
+    cdef int n_nz = nz.shape[0]
+    coef = np.ascontiguousarray(alpha[:, nz].T)
+
+    if n_nz > 0:
+        K = np.empty((min(row_block_size, n_samples),
+                      min(block_size, n_nz)), dtype=np.float64)
+        tmp = np.empty((K.shape[0], n_vectors), dtype=np.float64)
+
+    for start in xrange(0, n_samples, row_block_size):
+        stop = min(start + row_block_size, n_samples)
+        X_rows = X[start:stop]
+
+        for sv_start in xrange(0, n_nz, block_size):
+            cols = nz[sv_start:sv_start + block_size]
+
+            if K.shape[0] != stop - start or K.shape[1] != cols.shape[0]:
+                K = np.empty((stop - start, cols.shape[0]), dtype=np.float64)
+                tmp = np.empty((stop - start, n_vectors), dtype=np.float64)
+
+            # Kernel values between a block of samples and a block of
+            # support vectors.
+            kernel.compute_block(X_rows, None, sv, cols, K)
+            np.dot(K, coef[sv_start:sv_start + block_size], tmp)
+            out[start:stop] += tmp
 
     for k in xrange(n_vectors):
         if b[k] != 0:
-            for j in xrange(n_samples):
-                out[j, k] += b[k]
+            out[:, k] += b[k]
 
 
-cpdef predict_alpha(np.ndarray[double, ndim=2, mode='c'] X,
-                    np.ndarray[double, ndim=2, mode='c'] sv,
+cpdef predict_alpha(X,
+                    sv,
                     np.ndarray[double, ndim=2, mode='c'] alpha,
                     np.ndarray[double, ndim=1, mode='c'] b,
                     np.ndarray[int, ndim=1, mode='c'] classes,
@@ -53,32 +78,22 @@ cpdef predict_alpha(np.ndarray[double, ndim=2, mode='c'] X,
                     np.ndarray[double, ndim=1, mode='c'] out):
 
     cdef Py_ssize_t n_samples = X.shape[0]
-    cdef Py_ssize_t n_sv = sv.shape[0]
     cdef Py_ssize_t n_classes = classes.shape[0]
     cdef np.ndarray[double, ndim=2, mode='c'] out2
     cdef double max_
     cdef int selected
     cdef int i, j
 
-    if n_classes == 2:
-        for i in xrange(n_sv):
-            if alpha[0, i] != 0:
-                for j in xrange(n_samples):
-                    out[j] += alpha[0, i] * kernel.compute(X, j, sv, i)
-
-        if b[0] != 0:
-            for j in xrange(n_samples):
-                out[j] += b[0]
+    out2 = np.zeros((n_samples, alpha.shape[0]), dtype=np.float64)
+    decision_function_alpha(X, sv, alpha, b, kernel, out2)
 
+    if n_classes == 2:
         for j in xrange(n_samples):
-            if out[j] > 0:
+            if out2[j, 0] > 0:
                 out[j] = classes[1]
-            elif out[j] < 0:
+            elif out2[j, 0] < 0:
                 out[j] = classes[0]
     else:
-        out2 = np.zeros((n_samples, n_classes), dtype=np.float64)
-        decision_function_alpha(X, sv, alpha, b, kernel, out2)
-
         for i in xrange(n_samples):
 
             selected = 0
@@ -90,3 +105,169 @@ cpdef predict_alpha(np.ndarray[double, ndim=2, mode='c'] X,
                     selected = j
 
             out[i] = classes[selected]
+
+
+def additive_tables(Kernel kernel,
+                    np.ndarray[double, ndim=2, mode='c'] sv,
+                    np.ndarray[double, ndim=2, mode='c'] alpha,
+                    int n_bins=500):
+    """Per-dimension tables of h_ck(s) = sum_i alpha[c, i] k(s, sv[i, k]),
+    for an additive kernel k.
+
+    Returns (grid, values, left, right): values[c, k] holds h_ck at the
+    sorted points grid[k], and left[c, k] and right[c, k] are its slopes
+    before the first and after the last point. Between points, h_ck is
+    interpolated linearly, which is exact for the intersection kernel. The
+    chi2 kernel is sampled at n_bins points."""
+    cdef int n_sv = sv.shape[0]
+    cdef int n_features = sv.shape[1]
+    cdef int n_vectors = alpha.shape[0]
+    cdef int c, p
+
+    if isinstance(kernel, IntersectionKernel):
+        # h_ck is piecewise linear, with a knot at each support vector.
+        order = np.argsort(sv, axis=0, kind="mergesort")
+        V = sv[order, np.arange(n_features)]
+        grid = np.ascontiguousarray(V.T)
+        values = np.zeros((n_vectors, n_features, n_sv), dtype=np.float64)
+        left = np.zeros((n_vectors, n_features), dtype=np.float64)
+        right = np.zeros((n_vectors, n_features), dtype=np.float64)
+
+        for c in xrange(n_vectors):
+            A = alpha[c][order]
+            total = A.sum(axis=0)
+            # Support vectors below the knot contribute their value, the
+            # others the knot itself.
+            H = np.cumsum(A * V, axis=0) + V * (total - np.cumsum(A, axis=0))
+            values[c] = H.T
+            left[c] = total
+
+    elif isinstance(kernel, AdditiveChi2Kernel):
+        grid = np.linspace(0, 1, n_bins)[np.newaxis, :] * \
+               sv.max(axis=0)[:, np.newaxis]
+        values = np.zeros((n_vectors, n_features, n_bins), dtype=np.float64)
+
+        for p in xrange(n_bins):
+            G = grid[:, p]
+            total = G + sv
+            M = 2 * G * sv / np.where(total != 0, total, 1)
+            values[:, :, p] = np.dot(alpha, M)
+
+        # Derivatives of h_ck at the ends of the grid.
+        total = grid[:, 0] + sv
+        M = 2 * sv ** 2 / np.where(total != 0, total, 1) ** 2
+        left = np.dot(alpha, M)
+        total = grid[:, -1] + sv
+        M = 2 * sv ** 2 / np.where(total != 0, total, 1) ** 2
+        right = np.dot(alpha, M)
+
+    else:
+        raise ValueError("Lookup tables require an additive kernel.")
+
+    return (np.ascontiguousarray(grid), values,
+            np.ascontiguousarray(left), np.ascontiguousarray(right))
+
+
+cdef inline int _search(double* grid, int size, double value) nogil:
+    # Number of grid points lower than or equal to value.
+    cdef int lo = 0, hi = size, mid
+
+    while lo < hi:
+        mid = (lo + hi) / 2
+        if grid[mid] <= value:
+            lo = mid + 1
+        else:
+            hi = mid
+
+    return lo
+
+
+cdef inline double _interpolate(double* grid, double* values, int size,
+                                int pos, double left, double right,
+                                double value) nogil:
+    if pos == 0:
+        return values[0] + left * (value - grid[0])
+    if pos == size:
+        return values[size - 1] + right * (value - grid[size - 1])
+    return values[pos - 1] + (values[pos] - values[pos - 1]) * \
+           (value - grid[pos - 1]) / (grid[pos] - grid[pos - 1])
+
+
+cpdef decision_function_tables(X,
+                               np.ndarray[double, ndim=2, mode='c'] grid,
+                               np.ndarray[double, ndim=3, mode='c'] values,
+                               np.ndarray[double, ndim=2, mode='c'] left,
+                               np.ndarray[double, ndim=2, mode='c'] right,
+                               np.ndarray[double, ndim=1, mode='c'] b,
+                               np.ndarray[double, ndim=2, mode='c'] out):
+    """Decision function from the tables of additive_tables, in
+    O(n_features log n_points) per sample and vector."""
+    cdef int n_samples = X.shape[0]
+    cdef int n_features = grid.shape[0]
+    cdef int size = grid.shape[1]
+    cdef int n_vectors = values.shape[0]
+    cdef double* grid_ptr = <double*>grid.data
+    cdef double* values_ptr = <double*>values.data
+    cdef double* left_ptr = <double*>left.data
+    cdef double* right_ptr = <double*>right.data
+    cdef double* out_ptr = <double*>out.data
+    cdef int i, k, c, n, pos, row
+    cdef double value
+
+    cdef np.ndarray[double, ndim=2, mode='c'] Xd
+    cdef np.ndarray[double, ndim=1, mode='c'] data
+    cdef np.ndarray[int, ndim=1, mode='c'] indices
+    cdef np.ndarray[int, ndim=1, mode='c'] indptr
+    cdef np.ndarray[double, ndim=2, mode='c'] at_zero
+    cdef double* zero_ptr
+
+    if sp.issparse(X):
+        data = X.data
+        indices = X.indices
+        indptr = X.indptr
+
+        # Zero features contribute h_ck(0).
+        at_zero = np.zeros((n_vectors, n_features), dtype=np.float64)
+        zero_ptr = <double*>at_zero.data
+        for k in xrange(n_features):
+            pos = _search(grid_ptr + k * size, size, 0)
+            for c in xrange(n_vectors):
+                row = c * n_features + k
+                zero_ptr[row] = _interpolate(grid_ptr + k * size,
+                                             values_ptr + row * size, size,
+                                             pos, left_ptr[row],
+                                             right_ptr[row], 0)
+        out += at_zero.sum(axis=1)
+
+        with nogil:
+            for i in xrange(n_samples):
+                for n in xrange(indptr[i], indptr[i + 1]):
+                    k = indices[n]
+                    value = data[n]
+                    pos = _search(grid_ptr + k * size, size, value)
+                    for c in xrange(n_vectors):
+                        row = c * n_features + k
+                        out_ptr[i * n_vectors + c] += \
+                            _interpolate(grid_ptr + k * size,
+                                         values_ptr + row * size, size, pos,
+                                         left_ptr[row], right_ptr[row],
+                                         value) - zero_ptr[row]
+    else:
+        Xd = X
+
+        with nogil:
+            for i in xrange(n_samples):
+                for k in xrange(n_features):
+                    value = Xd[i, k]
+                    pos = _search(grid_ptr + k * size, size, value)
+                    for c in xrange(n_vectors):
+                        row = c * n_features + k
+                        out_ptr[i * n_vectors + c] += \
+                            _interpolate(grid_ptr + k * size,
+                                         values_ptr + row * size, size, pos,
+                                         left_ptr[row], right_ptr[row],
+                                         value)
+
+    for c in xrange(n_vectors):
+        if b[c] != 0:
+            out[:, c] += b[c]
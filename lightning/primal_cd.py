@@ -9,6 +9,7 @@ from sklearn.utils import check_random_state
 
 from .base import BaseLinearClassifier, BaseKernelClassifier
 
+from .kernel_approximation import Nystroem
 from .kernel_fast import get_kernel, KernelCache
 from .primal_cd_fast import _primal_cd_l2r
 from .primal_cd_fast import _primal_cd_l2svm_l2r
@@ -96,6 +97,11 @@ class PrimalLinearSVC(BaseSVC, BaseLinearClassifier, ClassifierMixin):
 
 
 class PrimalSVC(BaseSVC, BaseKernelClassifier, ClassifierMixin):
+    """Kernel SVM solved by coordinate descent in the primal.
+
+    prefetch columns are computed ahead of the solver by a worker thread,
+    per binary subproblem when they are solved in parallel (ovr_jobs != 1).
+    """
 
     def __init__(self, C=1.0, loss="squared_hinge", penalty="l1",
                  max_iter=10, tol=1e-3, kernel_regularizer=False,
@@ -103,8 +109,11 @@ class PrimalSVC(BaseSVC, BaseKernelClassifier, ClassifierMixin):
                  Cd=1.0, warm_debiasing=False,
                  selection="permute", search_size=60,
                  termination="convergence", n_components=1000,
-                 cache_mb=500, warm_start=False, random_state=None,
-                 components=None, callback=None, verbose=0, n_jobs=1):
+                 cache_mb=500, memory_limit=None, cache_policy="lru",
+                 cache_dtype="float64", cache_arena=False, huge_pages=False,
+                 prefetch=0, spill_mb=0, spill_dir=None, warm_start=False,
+                 random_state=None, components=None, callback=None,
+                 verbose=0, n_jobs=1, ovr_jobs=1):
         self.C = C
         self.loss = loss
         self.penalty = penalty
@@ -122,19 +131,28 @@ class PrimalSVC(BaseSVC, BaseKernelClassifier, ClassifierMixin):
         self.termination = termination
         self.n_components = n_components
         self.cache_mb = cache_mb
+        self.memory_limit = memory_limit
+        self.cache_policy = cache_policy
+        self.cache_dtype = cache_dtype
+        self.cache_arena = cache_arena
+        self.huge_pages = huge_pages
+        self.prefetch = prefetch
+        self.spill_mb = spill_mb
+        self.spill_dir = spill_dir
         self.warm_start = warm_start
         self.random_state = random_state
         self.components = components
         self.callback = callback
         self.verbose = verbose
         self.n_jobs = n_jobs
+        self.ovr_jobs = ovr_jobs
         self.support_vectors_ = None
         self.coef_ = None
 
     def fit(self, X, y, kcache=None):
         n_samples = X.shape[0]
         rs = self._get_random_state()
-        X = np.ascontiguousarray(X, dtype=np.float64)
+        X = self._check_input(X)
 
         self.label_binarizer_ = LabelBinarizer(neg_label=-1, pos_label=1)
         Y = self.label_binarizer_.fit_transform(y).astype(np.float64)
@@ -147,7 +165,13 @@ class PrimalSVC(BaseSVC, BaseKernelClassifier, ClassifierMixin):
         selection = self.selection
 
         if self.penalty == "l2" and self.components is not None:
-            A = self.components
+            if isinstance(self.components, Nystroem):
+                # Let the transformer select the landmarks.
+                nystroem = clone(self.components).fit(X)
+                self.components_ = nystroem.components_
+            else:
+                self.components_ = self.components
+            A = self._check_input(self.components_)
 
         if self.warm_start and self.coef_ is not None:
             coef = np.zeros((n_vectors, A.shape[0]), dtype=np.float64)
@@ -160,58 +184,72 @@ class PrimalSVC(BaseSVC, BaseKernelClassifier, ClassifierMixin):
         indices = np.arange(A.shape[0], dtype=np.int32)
 
         if kcache is None:
-            kernel = self._get_kernel()
-            kcache = KernelCache(kernel, n_samples,
-                                 self.cache_mb, 1, self.verbose)
+            kcache = self._get_kernel_cache(n_samples,
+                                            (X, A, Y, self.coef_,
+                                             self.errors_),
+                                            spill_capacity=self.spill_mb,
+                                            spill_dir=self.spill_dir,
+                                            arena=self.cache_arena,
+                                            huge_pages=self.huge_pages)
+        else:
+            # Keep the cached values, but solvers rebuild the support set
+            # from coef_.
+            kcache.set_kernel(self._get_kernel())
+            kcache.clear_sv()
 
         self.support_vectors_ = X
         self.intercept_ = np.zeros(n_vectors, dtype=np.float64)
 
-        if self.penalty in ("l1", "l1l2"):
-            for i in xrange(n_vectors):
-                    _primal_cd_l2svm_l1r(self, self.coef_[i], self.errors_[i],
-                                         X, Y[:, i], indices, kcache, False,
-                                         self.selection, self.search_size,
-                                         self.termination, self.n_components,
-                                         self.C, self.max_iter, rs, self.tol,
-                                         self.callback, verbose=self.verbose)
-
-        if self.penalty in ("l2", "l2l2"):
-            for i in xrange(n_vectors):
-                _primal_cd_l2r(self, self.coef_[i], self.errors_[i],
-                               X, A, Y[:, i], indices,
-                               self._get_loss(), kcache, False,
-                               self.kernel_regularizer,
-                               self.selection, self.search_size,
-                               termination, self.n_components,
-                               C, self.max_iter, rs, self.tol,
-                               self.callback, verbose=self.verbose)
-
-        if self.penalty in ("l1l2", "l2l2"):
-            sv = np.sum(self.coef_ != 0, axis=0, dtype=bool)
-            self.support_indices_ = np.arange(n_samples, dtype=np.int32)[sv]
-            indices = self.support_indices_.copy()
-            A = X
-            self.support_vectors_ = A
-            if not self.warm_debiasing:
-                self.coef_ = np.zeros((n_vectors, n_samples), dtype=np.float64)
-                self.errors_ = np.ones((n_vectors, n_samples), dtype=np.float64)
-            C = self.Cd
-            termination = "convergence"
-            selection = "permute"
-
-            for i in xrange(n_vectors):
-                _primal_cd_l2r(self, self.coef_[i], self.errors_[i],
-                               X, A, Y[:, i], indices,
-                               self._get_loss(), kcache, False,
-                               self.kernel_regularizer,
-                               selection, self.search_size,
-                               termination, self.n_components,
-                               C, self.max_iter, rs, self.tol,
-                               self.callback, verbose=self.verbose)
+        def _fit_l1r(i, kcache, rs):
+            _primal_cd_l2svm_l1r(self, self.coef_[i], self.errors_[i],
+                                 X, Y[:, i], indices, kcache, False,
+                                 self.selection, self.search_size,
+                                 self.termination, self.n_components,
+                                 self.C, self.max_iter, rs, self.tol,
+                                 self.callback, verbose=self.verbose)
+
+        def _fit_l2r(i, kcache, rs):
+            _primal_cd_l2r(self, self.coef_[i], self.errors_[i],
+                           X, A, Y[:, i], indices,
+                           self._get_loss(), kcache, False,
+                           self.kernel_regularizer,
+                           selection, self.search_size,
+                           termination, self.n_components,
+                           C, self.max_iter, rs, self.tol,
+                           self.callback, verbose=self.verbose)
+
+        try:
+            if self.penalty in ("l1", "l1l2"):
+                kcache.start_prefetch(X, X, self.prefetch)
+                self._fit_binary(_fit_l1r, n_vectors, kcache, rs)
+
+            if self.penalty in ("l2", "l2l2"):
+                kcache.start_prefetch(X, A, self.prefetch)
+                self._fit_binary(_fit_l2r, n_vectors, kcache, rs)
+
+            if self.penalty in ("l1l2", "l2l2"):
+                sv = np.sum(self.coef_ != 0, axis=0, dtype=bool)
+                self.support_indices_ = np.arange(n_samples,
+                                                  dtype=np.int32)[sv]
+                indices = self.support_indices_.copy()
+                A = X
+                self.support_vectors_ = A
+                if not self.warm_debiasing:
+                    self.coef_ = np.zeros((n_vectors, n_samples),
+                                          dtype=np.float64)
+                    self.errors_ = np.ones((n_vectors, n_samples),
+                                           dtype=np.float64)
+                C = self.Cd
+                termination = "convergence"
+                selection = "permute"
+                kcache.start_prefetch(X, A, self.prefetch)
+                self._fit_binary(_fit_l2r, n_vectors, kcache, rs)
+        finally:
+            kcache.stop_prefetch()
 
         sv = np.sum(self.coef_ != 0, axis=0, dtype=bool)
         self.support_indices_ = np.arange(A.shape[0], dtype=np.int32)[sv]
+        self.cache_stats_ = kcache.get_stats()
 
         if np.sum(sv) == 0:
             # Empty model...
@@ -227,8 +265,9 @@ class PrimalL2SVC(BaseSVC, BaseKernelClassifier, ClassifierMixin):
     def __init__(self, C=1.0,
                  max_outer=10, max_inner=20, tol=1e-3, kernel_regularizer=False,
                  kernel="linear", gamma=0.1, coef0=1, degree=4,
-                 cache_mb=500, random_state=None,
-                 verbose=0, n_jobs=1):
+                 cache_mb=500, memory_limit=None, cache_policy="lru",
+                 cache_dtype="float64", random_state=None, verbose=0,
+                 n_jobs=1):
         self.C = C
         self.max_outer = max_outer
         self.max_inner = max_inner
@@ -239,6 +278,9 @@ class PrimalL2SVC(BaseSVC, BaseKernelClassifier, ClassifierMixin):
         self.coef0 = coef0
         self.degree = degree
         self.cache_mb = cache_mb
+        self.memory_limit = memory_limit
+        self.cache_policy = cache_policy
+        self.cache_dtype = cache_dtype
         self.random_state = random_state
         self.verbose = verbose
         self.n_jobs = n_jobs
@@ -248,7 +290,7 @@ class PrimalL2SVC(BaseSVC, BaseKernelClassifier, ClassifierMixin):
     def fit(self, X, y, kcache=None):
         n_samples = X.shape[0]
         rs = self._get_random_state()
-        X = np.ascontiguousarray(X, dtype=np.float64)
+        X = self._check_input(X)
 
         self.label_binarizer_ = LabelBinarizer(neg_label=-1, pos_label=1)
         Y = self.label_binarizer_.fit_transform(y).astype(np.float64)
@@ -260,9 +302,13 @@ class PrimalL2SVC(BaseSVC, BaseKernelClassifier, ClassifierMixin):
         self.intercept_ = np.zeros(n_vectors, dtype=np.float64)
 
         if kcache is None:
-            kernel = self._get_kernel()
-            kcache = KernelCache(kernel, n_samples,
-                                 self.cache_mb, 1, self.verbose)
+            kcache = self._get_kernel_cache(n_samples,
+                                            (X, Y, self.coef_, self.errors_))
+        else:
+            # Keep the cached values, but solvers rebuild the support set
+            # from coef_.
+            kcache.set_kernel(self._get_kernel())
+            kcache.clear_sv()
 
         for i in xrange(n_vectors):
             _primal_cd_l2svm_l2r(self, self.coef_[i], self.errors_[i],
@@ -18,9 +18,10 @@ from libcpp.vector cimport vector
 import numpy as np
 cimport numpy as np
 
-from lightning.kernel_fast cimport KernelCache
+from lightning.kernel_fast cimport KernelCache, MISS_BLOCK
 from lightning.kernel_fast cimport Kernel
 from lightning.select_fast cimport get_select_method
+from lightning.select_fast cimport cache_aware_order
 from lightning.select_fast cimport select_sv_precomputed
 from lightning.random.random_fast cimport RandomState
 
@@ -548,13 +549,12 @@ def _primal_cd_l2svm_l1r(self,
     cdef Py_ssize_t n_samples = X.shape[0]
     cdef Py_ssize_t n_features = X.shape[1]
 
+    # Kernel models only pass X to the kernel cache (dense or sparse).
     cdef np.ndarray[double, ndim=2, mode='fortran'] Xf
-    cdef np.ndarray[double, ndim=2, mode='c'] Xc
 
     if linear_kernel:
         Xf = X
     else:
-        Xc = X
         n_features = n_samples
 
     cdef int j, s, t, i = 0
@@ -588,7 +588,10 @@ def _primal_cd_l2svm_l1r(self,
     cdef int check_convergence = termination == "convergence"
     cdef int stop = 0
     cdef int select_method = get_select_method(selection)
-    cdef int permute = selection == "permute" or linear_kernel
+    cdef int permute = selection in ("permute", "cache_aware") or \
+                       linear_kernel
+    cdef int cache_aware = select_method == 4 and not linear_kernel
+    cdef int next_fill = 0
     cdef int has_callback = callback is not None
 
     # FIXME: would be better to store the support indices in the class.
@@ -606,6 +609,10 @@ def _primal_cd_l2svm_l1r(self,
         if permute:
             rs.shuffle(index[:active_size])
 
+        if cache_aware:
+            # Visit the cached columns first.
+            next_fill = cache_aware_order(index, active_size, kcache)
+
         s = 0
 
         while s < active_size:
@@ -622,10 +629,15 @@ def _primal_cd_l2svm_l1r(self,
             xj_sq = 0
 
             if linear_kernel:
-                col_ro = (<double*>Xf.data) + j * n_samples
+                col_ro = (<double*>Xf.data) + <Py_ssize_t>j * n_samples
             else:
-                kcache.compute_column(Xc, Xc, j, col)
+                if cache_aware and s >= next_fill:
+                    next_fill = min(s + MISS_BLOCK, active_size)
+                    kcache.fill_columns(X, X, index, s, next_fill)
+                kcache.compute_column(X, X, j, col)
                 col_ro = col_data
+                if permute:
+                    kcache.prefetch(index, s + 1, active_size)
 
             for i in xrange(n_samples):
                 val = col_ro[i] * y[i]
@@ -803,14 +815,10 @@ def _primal_cd_l2r(self,
     cdef Py_ssize_t n_features = X.shape[1]
 
     cdef np.ndarray[double, ndim=2, mode='fortran'] Xf
-    cdef np.ndarray[double, ndim=2, mode='c'] Xc
-    cdef np.ndarray[double, ndim=2, mode='c'] Ac
 
     if linear_kernel:
         Xf = X
     else:
-        Xc = X
-        Ac = A
         n_features = index.shape[0]
 
     cdef int i, j, s, t
@@ -830,7 +838,10 @@ def _primal_cd_l2r(self,
     cdef int check_convergence = termination == "convergence"
     cdef int has_callback = callback is not None
     cdef int select_method = get_select_method(selection)
-    cdef int permute = selection == "permute" or linear_kernel
+    cdef int permute = selection in ("permute", "cache_aware") or \
+                       linear_kernel
+    cdef int cache_aware = select_method == 4 and not linear_kernel
+    cdef int next_fill = 0
     cdef int stop = 0
     cdef int n_sv = 0
 
@@ -844,6 +855,9 @@ def _primal_cd_l2r(self,
         if permute:
             rs.shuffle(index)
 
+        if cache_aware:
+            next_fill = cache_aware_order(index, n_features, kcache)
+
         for s in xrange(n_features):
             if permute:
                 j = index[s]
@@ -853,9 +867,14 @@ def _primal_cd_l2r(self,
                                           0, rs)
 
             if linear_kernel:
-                col_ro_ptr = (<double*>Xf.data) + j * n_samples
+                col_ro_ptr = (<double*>Xf.data) + <Py_ssize_t>j * n_samples
             else:
-                kcache.compute_column(Xc, Ac, j, col_ro)
+                if cache_aware and s >= next_fill:
+                    next_fill = min(s + MISS_BLOCK, n_features)
+                    kcache.fill_columns(X, A, index, s, next_fill)
+                kcache.compute_column(X, A, j, col_ro)
+                if permute:
+                    kcache.prefetch(index, s + 1, n_features)
 
             loss.solve_l2(j,
                           n_samples,
@@ -911,7 +930,7 @@ def _primal_cd_l2r(self,
 def _primal_cd_l2svm_l2r(self,
                          np.ndarray[double, ndim=1, mode='c'] w,
                          np.ndarray[double, ndim=1, mode='c'] b,
-                         np.ndarray[double, ndim=2, mode='c'] X,
+                         X,
                          np.ndarray[double, ndim=1] y,
                          KernelCache kcache,
                          int kernel_regularizer,
@@ -1028,7 +1047,7 @@ def _primal_cd_l2svm_l2r(self,
     return w
 
 
-cpdef _C_lower_bound_kernel(np.ndarray[double, ndim=2, mode='c'] X,
+cpdef _C_lower_bound_kernel(X,
                             np.ndarray[double, ndim=2, mode='c'] Y,
                             Kernel kernel,
                             search_size=None,
@@ -1055,8 +1074,7 @@ cpdef _C_lower_bound_kernel(np.ndarray[double, ndim=2, mode='c'] X,
     for j in xrange(n):
         k = ind[j]
 
-        for i in xrange(n_samples):
-            col[i] = kernel.compute(X, i, X, k)
+        kernel.compute_block(X, None, X, (k,), col.reshape(-1, 1))
 
         for l in xrange(n_vectors):
             val = 0
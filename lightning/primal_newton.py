@@ -9,7 +9,6 @@ from scipy.linalg import solve
 from sklearn.base import BaseEstimator, ClassifierMixin
 from sklearn.preprocessing import LabelBinarizer
 from sklearn.utils import check_random_state
-from sklearn.metrics.pairwise import pairwise_kernels
 
 from .base import BaseKernelClassifier
 
@@ -116,9 +115,9 @@ class PrimalNewton(BaseKernelClassifier, ClassifierMixin):
         if self.verbose:
             print "Pre-computing kernel matrix..."
 
-        K = pairwise_kernels(X, filter_params=True, n_jobs=self.n_jobs,
-                             metric=self.kernel, **self._kernel_params())
-
+        X = self._check_input(X)
+        K = np.empty((n_samples, n_samples), dtype=np.float64)
+        self._get_kernel().compute_block(X, None, X, None, K)
 
         func = self._fit_binary if self.n_components is None \
                                 else self._fit_binary_inc
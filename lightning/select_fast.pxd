@@ -1,5 +1,3 @@
-from libcpp.list cimport list
-
 cimport numpy as np
 
 from lightning.kernel_fast cimport KernelCache
@@ -13,7 +11,7 @@ cdef int select_sv(np.ndarray[int, ndim=1, mode='c'] A,
                    int select_method,
                    np.ndarray[double, ndim=1, mode='c'] alpha,
                    double b,
-                   np.ndarray[double, ndim=2, mode='c'] X,
+                   X,
                    np.ndarray[double, ndim=1] y,
                    KernelCache kcache,
                    np.ndarray[double, ndim=1, mode='c'] col,
@@ -29,3 +27,7 @@ cdef int select_sv_precomputed(np.ndarray[int, ndim=1, mode='c'] A,
                                int check_duplicates,
                                RandomState rs)
 
+cdef int cache_aware_order(np.ndarray[int, ndim=1, mode='c'] A,
+                           int size,
+                           KernelCache kcache)
+
@@ -6,7 +6,7 @@
 # Author: Mathieu Blondel
 # License: BSD
 
-from cython.operator cimport dereference as deref, preincrement as inc
+import numpy as np
 
 from lightning.random.random_fast cimport RandomState
 
@@ -26,6 +26,8 @@ cdef int get_select_method(selection):
         return 2
     elif selection == "loss":
         return 3
+    elif selection == "cache_aware":
+        return 4
     else:
         raise ValueError("Wrong selection method.")
 
@@ -36,20 +38,19 @@ cdef int select_sv(np.ndarray[int, ndim=1, mode='c'] A,
                    int select_method,
                    np.ndarray[double, ndim=1, mode='c'] alpha,
                    double b,
-                   np.ndarray[double, ndim=2, mode='c'] X,
+                   X,
                    np.ndarray[double, ndim=1] y,
                    KernelCache kcache,
                    np.ndarray[double, ndim=1, mode='c'] col,
                    int check_duplicates,
                    RandomState rs):
 
-    cdef int i
+    cdef int i, k
     cdef int s, j
     cdef double score
     cdef double min_score = DBL_MAX
     cdef int selected = 0
-    cdef list[int].iterator it
-    cdef list[int]* support_set = kcache.support_set
+    cdef int[::1] support_set = kcache.get_support_set()
     cdef int* support_vectors = kcache.support_vector
 
     for i in xrange(search_size):
@@ -61,12 +62,10 @@ cdef int select_sv(np.ndarray[int, ndim=1, mode='c'] A,
         score = 0
 
         # Compute prediction.
-        it = support_set.begin()
         kcache.compute_column_sv(X, X, s, col)
-        while it != support_set.end():
-            j = deref(it)
+        for k in xrange(support_set.shape[0]):
+            j = support_set[k]
             score += alpha[j] * col[j]
-            inc(it)
 
         score += b
 
@@ -113,3 +112,27 @@ cdef int select_sv_precomputed(np.ndarray[int, ndim=1, mode='c'] A,
             selected = s
 
     return selected
+
+
+cdef int cache_aware_order(np.ndarray[int, ndim=1, mode='c'] A,
+                           int size,
+                           KernelCache kcache):
+    # Move the (shuffled) coordinates whose column is in the cache to the
+    # front of A, keeping the relative order of both groups. Returns the
+    # number of cached columns.
+    cdef np.ndarray[int, ndim=1, mode='c'] misses
+    misses = np.empty(size, dtype=np.int32)
+    cdef int k, n_cached = 0, n_misses = 0
+
+    for k in xrange(size):
+        if kcache.is_cached(A[k]):
+            A[n_cached] = A[k]
+            n_cached += 1
+        else:
+            misses[n_misses] = A[k]
+            n_misses += 1
+
+    for k in xrange(n_misses):
+        A[n_cached + k] = misses[k]
+
+    return n_cached
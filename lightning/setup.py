@@ -16,7 +16,9 @@ def configuration(parent_package='', top_path=None):
 
     config.add_extension('kernel_fast',
          sources=['kernel_fast.cpp'],
-         include_dirs=[numpy.get_include()]
+         include_dirs=[numpy.get_include()],
+         extra_compile_args=['-fopenmp'],
+         extra_link_args=['-fopenmp'],
          )
 
     config.add_extension('lasvm_fast',
@@ -39,6 +41,11 @@ def configuration(parent_package='', top_path=None):
          include_dirs=[numpy.get_include(), randomdir],
          )
 
+    config.add_extension('shared_cache_fast',
+         sources=['shared_cache_fast.cpp'],
+         include_dirs=[numpy.get_include()]
+         )
+
     config.add_extension('sgd_fast',
          sources=['sgd_fast.cpp'],
          include_dirs=[numpy.get_include()]
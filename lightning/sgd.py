@@ -127,7 +127,9 @@ class KernelSGDClassifier(BaseKernelClassifier, BaseSGD, ClassifierMixin):
                  learning_rate="pegasos", eta0=0.03, power_t=0.5,
                  epsilon=0.01, fit_intercept=True, intercept_decay=1.0,
                  n_components=0, max_iter=10, random_state=None,
-                 cache_mb=500, verbose=0, n_jobs=1):
+                 cache_mb=500, memory_limit=None, cache_policy="lru",
+                 cache_dtype="float64", compact_sv=False, verbose=0,
+                 n_jobs=1, ovr_jobs=1):
         self.loss = loss
         self.multiclass = multiclass
         self.lmbda = lmbda
@@ -145,8 +147,13 @@ class KernelSGDClassifier(BaseKernelClassifier, BaseSGD, ClassifierMixin):
         self.max_iter = max_iter
         self.random_state = random_state
         self.cache_mb = cache_mb
+        self.memory_limit = memory_limit
+        self.cache_policy = cache_policy
+        self.cache_dtype = cache_dtype
+        self.compact_sv = compact_sv
         self.verbose = verbose
         self.n_jobs = n_jobs
+        self.ovr_jobs = ovr_jobs
         self.coef_ = None
 
     def fit(self, X, y):
@@ -155,16 +162,17 @@ class KernelSGDClassifier(BaseKernelClassifier, BaseSGD, ClassifierMixin):
 
         n_classes, n_vectors = self._set_label_transformers(y)
 
+        X = self._check_input(X)
         self.coef_ = np.zeros((n_vectors, n_samples), dtype=np.float64)
         self.intercept_ = np.zeros(n_vectors, dtype=np.float64)
 
-        kernel = self._get_kernel()
-        kcache = KernelCache(kernel, n_samples,
-                             self.cache_mb, 1, self.verbose)
+        kcache = self._get_kernel_cache(n_samples, (X, self.coef_),
+                                        compact_sv=self.compact_sv)
 
         if n_vectors == 1 or self.multiclass == "one-vs-rest":
             Y = self.label_binarizer_.transform(y)
-            for i in xrange(n_vectors):
+
+            def _fit(i, kcache, rs):
                 _binary_sgd(self,
                             self.coef_, self.intercept_, i,
                             X, Y[:, i],
@@ -178,6 +186,8 @@ class KernelSGDClassifier(BaseKernelClassifier, BaseSGD, ClassifierMixin):
                             self.max_iter * n_samples,
                             rs, self.verbose)
 
+            self._fit_binary(_fit, n_vectors, kcache, rs)
+
         elif self.multiclass == "natural":
             if self.loss in ("hinge", "log"):
                 func = eval("_multiclass_%s_sgd" % self.loss)
@@ -14,8 +14,6 @@ from cython.operator cimport dereference as deref
 from cython.operator cimport preincrement as inc
 from cython.operator cimport predecrement as dec
 
-from libcpp.list cimport list
-
 from lightning.kernel_fast cimport KernelCache
 from lightning.kernel_fast cimport Kernel
 
@@ -196,21 +194,20 @@ cdef double _dot(np.ndarray[double, ndim=2, mode='c'] W,
 
 cdef double _kernel_dot(np.ndarray[double, ndim=2, mode='c'] W,
                         int k,
-                        np.ndarray[double, ndim=2, mode='c'] X,
+                        X,
                         int i,
                         KernelCache kcache,
                         np.ndarray[double, ndim=1, mode='c'] col):
-    cdef int j
+    cdef int j, s
     cdef double pred = 0
-    cdef list[int].iterator it
+    cdef int[::1] support_set
 
     kcache.compute_column_sv(X, X, i, col)
-    it = kcache.support_set.begin()
+    support_set = kcache.get_support_set()
 
-    while it != kcache.support_set.end():
-        j = deref(it)
+    for s in xrange(support_set.shape[0]):
+        j = support_set[s]
         pred += col[j] * W[k, j]
-        inc(it)
 
     return pred
 
@@ -241,7 +238,7 @@ def _binary_sgd(self,
                 np.ndarray[double, ndim=2, mode='c'] W,
                 np.ndarray[double, ndim=1] intercepts,
                 int k,
-                np.ndarray[double, ndim=2, mode='c'] X,
+                X,
                 np.ndarray[double, ndim=1] y,
                 LossFunction loss,
                 KernelCache kcache,
@@ -269,8 +266,13 @@ def _binary_sgd(self,
     cdef double w_scale = 1.0
     cdef double intercept = 0.0
 
+    # Linear models read the samples directly, kernel models go through
+    # the kernel cache, which also accepts sparse matrices.
+    cdef np.ndarray[double, ndim=2, mode='c'] Xd
     cdef np.ndarray[double, ndim=1, mode='c'] col
-    if not linear_kernel:
+    if linear_kernel:
+        Xd = X
+    else:
         col = np.zeros(n_samples, dtype=np.float64)
 
     random_state.shuffle(indices)
@@ -279,7 +281,7 @@ def _binary_sgd(self,
         i = indices[(t-1) % n_samples]
 
         if linear_kernel:
-            pred = _dot(W, k, X, i)
+            pred = _dot(W, k, Xd, i)
         else:
             pred = _kernel_dot(W, k, X, i, kcache, col)
 
@@ -294,7 +296,7 @@ def _binary_sgd(self,
             update_eta_scaled = update_eta / w_scale
 
             if linear_kernel:
-                _add(W, k, X, i, update_eta_scaled)
+                _add(W, k, Xd, i, update_eta_scaled)
             else:
                 W[k, i] += update_eta_scaled
 
@@ -356,28 +358,26 @@ cdef int _predict_multiclass(np.ndarray[double, ndim=2, mode='c'] W,
 cdef int _kernel_predict_multiclass(np.ndarray[double, ndim=2, mode='c'] W,
                                     np.ndarray[double, ndim=1] w_scales,
                                     np.ndarray[double, ndim=1] intercepts,
-                                    np.ndarray[double, ndim=2, mode='c'] X,
+                                    X,
                                     int i,
                                     KernelCache kcache,
                                     np.ndarray[double, ndim=1] col):
-    cdef Py_ssize_t n_features = X.shape[1]
     cdef Py_ssize_t n_vectors = W.shape[0]
-    cdef int j, l
+    cdef int j, l, s
     cdef double pred
     cdef double best = -DBL_MAX
     cdef int selected = 0
-    cdef list[int].iterator it
+    cdef int[::1] support_set
 
     kcache.compute_column_sv(X, X, i, col)
+    support_set = kcache.get_support_set()
 
     for l in xrange(n_vectors):
         pred = 0
 
-        it = kcache.support_set.begin()
-        while it != kcache.support_set.end():
-            j = deref(it)
+        for s in xrange(support_set.shape[0]):
+            j = support_set[s]
             pred += col[j] * W[l, j]
-            inc(it)
 
         pred *= w_scales[l]
         pred += intercepts[l]
@@ -394,7 +394,7 @@ cdef int _kernel_predict_multiclass(np.ndarray[double, ndim=2, mode='c'] W,
 def _multiclass_hinge_sgd(self,
                           np.ndarray[double, ndim=2, mode='c'] W,
                           np.ndarray[double, ndim=1] intercepts,
-                          np.ndarray[double, ndim=2, mode='c'] X,
+                          X,
                           np.ndarray[int, ndim=1] y,
                           KernelCache kcache,
                           int linear_kernel,
@@ -424,8 +424,11 @@ def _multiclass_hinge_sgd(self,
     cdef np.ndarray[double, ndim=1, mode='c'] w_scales
     w_scales = np.ones(n_vectors, dtype=np.float64)
 
+    cdef np.ndarray[double, ndim=2, mode='c'] Xd
     cdef np.ndarray[double, ndim=1, mode='c'] col
-    if not linear_kernel:
+    if linear_kernel:
+        Xd = X
+    else:
         col = np.zeros(n_samples, dtype=np.float64)
 
     random_state.shuffle(indices)
@@ -436,15 +439,15 @@ def _multiclass_hinge_sgd(self,
         eta = _get_eta(learning_rate, lmbda, eta0, power_t, t)
 
         if linear_kernel:
-            k = _predict_multiclass(W, w_scales, intercepts, X, i)
+            k = _predict_multiclass(W, w_scales, intercepts, Xd, i)
         else:
             k = _kernel_predict_multiclass(W, w_scales, intercepts, X, i,
                                            kcache, col)
 
         if k != y[i]:
             if linear_kernel:
-                _add(W, k, X, i, -eta / w_scales[k])
-                _add(W, y[i], X, i, eta / w_scales[y[i]])
+                _add(W, k, Xd, i, -eta / w_scales[k])
+                _add(W, y[i], Xd, i, eta / w_scales[y[i]])
             else:
                 W[k, i] -= eta / w_scales[k]
                 W[y[i], i] += eta / w_scales[y[i]]
@@ -504,7 +507,7 @@ cdef void _softmax(np.ndarray[double, ndim=1] scores):
 def _multiclass_log_sgd(self,
                         np.ndarray[double, ndim=2, mode='c'] W,
                         np.ndarray[double, ndim=1] intercepts,
-                        np.ndarray[double, ndim=2, mode='c'] X,
+                        X,
                         np.ndarray[int, ndim=1] y,
                         KernelCache kcache,
                         int linear_kernel,
@@ -537,8 +540,11 @@ def _multiclass_log_sgd(self,
     cdef np.ndarray[double, ndim=1, mode='c'] scores
     scores = np.ones(n_vectors, dtype=np.float64)
 
+    cdef np.ndarray[double, ndim=2, mode='c'] Xd
     cdef np.ndarray[double, ndim=1, mode='c'] col
-    if not linear_kernel:
+    if linear_kernel:
+        Xd = X
+    else:
         col = np.zeros(n_samples, dtype=np.float64)
 
     cdef int all_zero
@@ -552,7 +558,7 @@ def _multiclass_log_sgd(self,
 
         for l in xrange(n_vectors):
             if linear_kernel:
-                scores[l] = _dot(W, l, X, i)
+                scores[l] = _dot(W, l, Xd, i)
             else:
                 scores[l] = _kernel_dot(W, l, X, i, kcache, col)
 
@@ -572,7 +578,7 @@ def _multiclass_log_sgd(self,
                     update = -eta * scores[l]
 
                 if linear_kernel:
-                    _add(W, l, X, i, update / w_scales[l])
+                    _add(W, l, Xd, i, update / w_scales[l])
                 else:
                     W[l, i] += update / w_scales[l]
 
@@ -0,0 +1,258 @@
+# encoding: utf-8
+# cython: cdivision=True
+# cython: boundscheck=False
+# cython: wraparound=False
+#
+# Author: Mathieu Blondel
+# License: BSD
+
+from libc.string cimport memcpy
+from posix.mman cimport mmap, munmap, PROT_READ, PROT_WRITE, MAP_SHARED, \
+                        MAP_FAILED
+
+import errno
+import hashlib
+import os
+import time
+
+import numpy as np
+cimport numpy as np
+import scipy.sparse as sp
+
+from lightning.kernel_fast cimport Kernel, KernelCache
+
+# Seconds to wait for the process creating a segment to size it.
+ATTACH_TIMEOUT = 1.0
+
+cdef extern from *:
+    int __sync_fetch_and_add(int* ptr, int value) nogil
+    bint __sync_bool_compare_and_swap(int* ptr, int old, int new) nogil
+    void __sync_synchronize() nogil
+
+
+cdef struct Slot:
+    # Sequence number, odd while a process writes the values of the slot.
+    int seq
+    # Index of the column held in the slot plus one (0 if empty).
+    int column
+
+
+def fingerprint(X):
+    """Hash of the shape and content of a dense array or CSR matrix."""
+    h = hashlib.sha1()
+    h.update(repr(X.shape).encode("ascii"))
+
+    if sp.issparse(X):
+        arrays = (X.data, X.indices, X.indptr)
+    else:
+        arrays = (X,)
+
+    for a in arrays:
+        h.update(np.ascontiguousarray(a).data)
+
+    return h.hexdigest()
+
+
+cdef class SharedKernelCache(KernelCache):
+    """Kernel cache whose columns are stored in a POSIX shared memory
+    segment, so that processes working on the same data share them.
+
+    The segment is named after the fingerprints of X and Y and the kernel
+    parameters. Column j is stored in slot j % n_slots of its table. It is
+    left in shm_dir for other processes: call unlink() once it is no longer
+    needed."""
+
+    cdef object shm_dir
+    cdef long shm_capacity
+    cdef object path
+    cdef char* segment
+    cdef long segment_size
+    cdef int n_shared
+    cdef Slot* slots
+    cdef double* values
+    cdef object seg_X
+    cdef object seg_Y
+    cdef np.ndarray buffer
+
+    def __init__(self, Kernel kernel, int n_samples, double capacity, int mb,
+                 int verbose, shm_dir="/dev/shm", int n_jobs=1):
+        # Columns are only cached in the segment.
+        KernelCache.__init__(self, kernel, n_samples, 0, 0, verbose,
+                             n_jobs=n_jobs)
+        if mb:
+            capacity *= (1 << 20)
+        self.shm_capacity = <long>capacity
+        self.shm_dir = shm_dir
+        self.buffer = np.zeros(n_samples, dtype=np.float64)
+
+    def __dealloc__(self):
+        self._detach()
+
+    cdef long _slot_size(self):
+        return sizeof(Slot) + self.n_samples * sizeof(double)
+
+    cdef _attach(self, X, Y):
+        if X is self.seg_X and Y is self.seg_Y:
+            return
+
+        self._detach()
+        self.seg_X = X
+        self.seg_Y = Y
+
+        cdef int n_shared = min(self.shm_capacity / self._slot_size(),
+                                self.n_samples)
+        if n_shared == 0:
+            return
+
+        key = "|".join((fingerprint(X), fingerprint(Y),
+                        repr(self.kernel._params()), str(self.n_samples)))
+        name = "lightning-kcache-" + hashlib.sha1(key).hexdigest()[:24]
+        path = os.path.join(self.shm_dir, name)
+        cdef long size = n_shared * self._slot_size()
+
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+            os.ftruncate(fd, size)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            # The process that created the segment chose its size.
+            fd = os.open(path, os.O_RDWR)
+            size = os.fstat(fd).st_size
+            deadline = time.time() + ATTACH_TIMEOUT
+            while size == 0 and time.time() < deadline:
+                time.sleep(0.001)
+                size = os.fstat(fd).st_size
+            if size == 0:
+                # Its creator died before sizing it: work without sharing,
+                # and remove it so that the next cache creates it again.
+                os.close(fd)
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+                return
+            n_shared = size / self._slot_size()
+
+        cdef void* segment
+        try:
+            segment = mmap(NULL, size, PROT_READ | PROT_WRITE, MAP_SHARED,
+                           fd, 0)
+        finally:
+            os.close(fd)
+
+        if segment == MAP_FAILED:
+            raise MemoryError("Could not map the shared kernel cache.")
+
+        if self.verbose >= 1:
+            print "Attached shared kernel cache", path
+
+        self.path = path
+        self.segment = <char*>segment
+        self.segment_size = size
+        self.n_shared = n_shared
+        self.slots = <Slot*>segment
+        self.values = <double*>(self.segment + n_shared * sizeof(Slot))
+
+    cdef _detach(self):
+        if self.segment != NULL:
+            munmap(self.segment, self.segment_size)
+        self.segment = NULL
+        self.slots = NULL
+        self.values = NULL
+        self.n_shared = 0
+        self.seg_X = None
+        self.seg_Y = None
+
+    cdef int _read_column(self, int j, double* out) nogil:
+        # Seqlock read: the copy is only valid if no process wrote the slot
+        # meanwhile.
+        cdef Slot* slot = self.slots + j % self.n_shared
+        cdef double* values = self.values + \
+                              <long>(j % self.n_shared) * self.n_samples
+        cdef int seq = __sync_fetch_and_add(&slot.seq, 0)
+
+        if seq % 2 == 1 or slot.column != j + 1:
+            return 0
+
+        memcpy(out, values, self.n_samples * sizeof(double))
+        __sync_synchronize()
+
+        return __sync_fetch_and_add(&slot.seq, 0) == seq
+
+    cdef void _write_column(self, int j, double* col) nogil:
+        cdef Slot* slot = self.slots + j % self.n_shared
+        cdef double* values = self.values + \
+                              <long>(j % self.n_shared) * self.n_samples
+        cdef int seq = __sync_fetch_and_add(&slot.seq, 0)
+
+        # Give up if another process is writing the slot.
+        if seq % 2 == 1 or \
+           not __sync_bool_compare_and_swap(&slot.seq, seq, seq + 1):
+            return
+
+        memcpy(values, col, self.n_samples * sizeof(double))
+        slot.column = j + 1
+        __sync_fetch_and_add(&slot.seq, 1)
+
+    cpdef compute_column(self,
+                         X,
+                         Y,
+                         int j,
+                         np.ndarray[double, ndim=1, mode='c'] out):
+        cdef double* out_ptr = <double*>out.data
+
+        self._attach(X, Y)
+
+        if self.n_shared > 0 and self._read_column(j, out_ptr):
+            self.store.memory_hits += 1
+            return
+
+        KernelCache.compute_column(self, X, Y, j, out)
+
+        if self.n_shared > 0:
+            self._write_column(j, out_ptr)
+
+    cpdef compute_column_sv(self,
+                            X,
+                            Y,
+                            int j,
+                            np.ndarray[double, ndim=1, mode='c'] out):
+        cdef double* col = <double*>self.buffer.data
+        cdef int[::1] support_set
+        cdef int k, s
+
+        if self.n_support == 0:
+            return
+
+        self._attach(X, Y)
+
+        if self.n_shared > 0 and self._read_column(j, col):
+            self.store.memory_hits += 1
+            support_set = self.get_support_set()
+            for k in xrange(support_set.shape[0]):
+                s = support_set[k]
+                out[s] = col[s]
+            return
+
+        # Only the support vector entries are computed, which is not worth
+        # sharing.
+        KernelCache.compute_column_sv(self, X, Y, j, out)
+
+    def set_kernel(self, Kernel kernel):
+        KernelCache.set_kernel(self, kernel)
+        # The segment is named after the kernel parameters.
+        self._detach()
+
+    def unlink(self):
+        """Remove the current segment from shm_dir. Processes that have
+        mapped it keep using it."""
+        if self.path is None:
+            return
+
+        try:
+            os.unlink(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        self.path = None
@@ -8,7 +8,10 @@ from nose.tools import assert_raises, assert_true, assert_equal
 from sklearn.datasets.samples_generator import make_classification
 from sklearn.svm import LinearSVC
 
+from lightning import base
 from lightning.dual_cd import DualLinearSVC, DualSVC
+from lightning.kernel_fast import get_kernel, KernelCache, pack_binary
+from lightning.predict_fast import decision_function_alpha
 
 bin_dense, bin_target = make_classification(n_samples=200, n_features=100,
                                             n_informative=5,
@@ -53,6 +56,113 @@ def test_fit_rbf_multi():
     assert_almost_equal(acc, 1.0)
 
 
+def test_additive_kernels():
+    H = np.abs(mult_dense)
+    for kernel, decimal in (("intersection", 6), ("additive_chi2", 2)):
+        clf = DualSVC(kernel=kernel, random_state=0)
+        clf.fit(H, mult_target)
+        if kernel == "additive_chi2":
+            # The chi2 tables are approximate: only used when asked for.
+            assert_true(clf.tables_ is None)
+            clf.build_tables(n_bins=500)
+        assert_true(clf.tables_ is not None)
+        df = clf.decision_function(H)
+        y_pred = clf.predict(H)
+        assert_array_almost_equal(clf.decision_function(sp.csr_matrix(H)),
+                                  df)
+
+        # Same as without lookup tables.
+        clf.tables_ = None
+        assert_array_almost_equal(clf.decision_function(H), df, decimal)
+        assert_array_equal(clf.predict(H), y_pred)
+
+    clf = DualSVC(kernel="rbf", random_state=0).fit(H, mult_target)
+    assert_raises(ValueError, clf.build_tables)
+
+
+def test_decision_function_tiles():
+    clf = DualSVC(kernel="rbf", gamma=0.1, random_state=0)
+    clf.fit(mult_dense, mult_target)
+    K = np.exp(-0.1 * ((mult_dense[:, np.newaxis] -
+                        clf.support_vectors_[np.newaxis]) ** 2).sum(axis=2))
+    expected = np.dot(K, clf.coef_.T) + clf.intercept_
+
+    for X in (mult_dense, mult_sparse):
+        out = np.zeros((X.shape[0], 3), dtype=np.float64)
+        # Tiles that don't divide the numbers of samples and support
+        # vectors.
+        decision_function_alpha(X, clf.support_vectors_, clf.coef_,
+                                clf.intercept_, clf._get_kernel(), out,
+                                block_size=7, row_block_size=13)
+        assert_array_almost_equal(out, expected)
+
+    assert_array_almost_equal(clf.decision_function(mult_dense), expected)
+    assert_array_equal(clf.predict(mult_dense),
+                       clf.classes_[expected.argmax(axis=1)])
+
+
+def test_chunked_prediction():
+    clf = DualLinearSVC(random_state=0).fit(bin_dense, bin_target)
+    clf2 = DualSVC(kernel="rbf", gamma=0.1, random_state=0)
+    clf2.fit(mult_dense, mult_target)
+
+    for clf, X in ((clf, bin_dense), (clf2, mult_dense), (clf2, mult_sparse)):
+        df = clf.decision_function(X)
+        y_pred = clf.predict(X)
+
+        chunks = list(clf.iter_decision_function(X, chunk_size=64))
+        assert_equal(len(chunks), int(np.ceil(X.shape[0] / 64.0)))
+        assert_array_almost_equal(np.vstack(chunks), df)
+
+        chunk_size = base.CHUNK_SIZE
+        base.CHUNK_SIZE = 64
+        try:
+            for n_jobs in (1, 2):
+                clf.n_jobs = n_jobs
+                assert_array_almost_equal(clf.decision_function(X), df)
+                assert_array_equal(clf.predict(X), y_pred)
+        finally:
+            base.CHUNK_SIZE = chunk_size
+
+
+def test_fit_rbf_sparse():
+    for kernel in ("rbf", "poly"):
+        clf = DualSVC(kernel=kernel, gamma=0.1, random_state=0)
+        clf.fit(bin_dense, bin_target)
+        clf2 = DualSVC(kernel=kernel, gamma=0.1, random_state=0)
+        clf2.fit(bin_sparse, bin_target)
+        assert_true(sp.issparse(clf2.support_vectors_))
+        assert_array_almost_equal(clf.decision_function(bin_dense),
+                                  clf2.decision_function(bin_sparse))
+        assert_array_equal(clf.predict(bin_dense), clf2.predict(bin_sparse))
+
+
+def test_fit_rbf_sparse_int64():
+    X = bin_sparse.copy()
+    X.indices = X.indices.astype(np.int64)
+    X.indptr = X.indptr.astype(np.int64)
+    clf = DualSVC(kernel="rbf", gamma=0.1, random_state=0)
+    clf.fit(bin_sparse, bin_target)
+    clf2 = DualSVC(kernel="rbf", gamma=0.1, random_state=0)
+    clf2.fit(X, bin_target)
+    assert_equal(clf2.support_vectors_.indices.dtype, np.int32)
+    assert_array_almost_equal(clf.decision_function(bin_sparse),
+                              clf2.decision_function(X))
+    assert_array_equal(clf.predict(bin_sparse), clf2.predict(X))
+
+
+def test_cache_spill():
+    clf = DualSVC(kernel="rbf", gamma=0.1, C=10, tol=1e-6, random_state=0,
+                  max_iter=5, cache_mb=0.05, spill_mb=1)
+    clf.fit(bin_dense, bin_target)
+    clf2 = DualSVC(kernel="rbf", gamma=0.1, C=10, tol=1e-6, random_state=0,
+                   max_iter=5)
+    clf2.fit(bin_dense, bin_target)
+    assert_array_almost_equal(clf.coef_, clf2.coef_)
+    assert_true(clf.cache_stats_["disk_hits"] > 0)
+    assert_equal(clf2.cache_stats_["disk_hits"], 0)
+
+
 def test_fit_rbf_binary_early_stopping():
     clf = DualSVC(loss="l1", kernel="rbf", gamma=0.5, random_state=0,
                   shrinking=True, selection="loss",
@@ -75,6 +185,19 @@ def test_precomputed_kernel():
     assert_array_almost_equal(y_pred, y_pred2)
 
 
+def test_binary_kernel():
+    B = bin_dense > 0
+    clf = DualSVC(kernel="rbf", gamma=0.1, random_state=0)
+    clf.fit(B.astype(np.float64), bin_target)
+    clf2 = DualSVC(kernel="hamming", gamma=0.1, random_state=0)
+    clf2.fit(pack_binary(B), bin_target)
+
+    assert_array_almost_equal(clf.coef_, clf2.coef_)
+    assert_array_almost_equal(clf.decision_function(B),
+                              clf2.decision_function(pack_binary(B)))
+    assert_array_equal(clf.predict(B), clf2.predict(pack_binary(B)))
+
+
 def test_warm_start():
     clf = DualSVC(warm_start=True, loss="l1", kernel="linear", random_state=0,
                   max_iter=100)
@@ -92,3 +215,128 @@ def test_warm_start():
 
         assert_array_almost_equal(y_pred, y_pred2)
 
+
+
+def test_cache_policy():
+    for policy in ("lru", "lfu", "sv"):
+        clf = DualSVC(kernel="rbf", gamma=0.1, random_state=0,
+                      cache_policy=policy)
+        clf.fit(bin_dense, bin_target)
+        assert_almost_equal(clf.score(bin_dense, bin_target), 1.0)
+
+
+def test_cache_dtype():
+    clf = DualSVC(kernel="rbf", gamma=0.1, random_state=0)
+    clf.fit(bin_dense, bin_target)
+    clf32 = DualSVC(kernel="rbf", gamma=0.1, random_state=0,
+                    cache_dtype="float32")
+    clf32.fit(bin_dense, bin_target)
+    assert_array_almost_equal(clf.coef_, clf32.coef_, decimal=3)
+    assert_almost_equal(clf32.score(bin_dense, bin_target), 1.0)
+
+
+def test_cache_arena():
+    clf = DualSVC(kernel="rbf", gamma=0.1, random_state=0, cache_mb=0.1)
+    clf.fit(bin_dense, bin_target)
+    clf2 = DualSVC(kernel="rbf", gamma=0.1, random_state=0, cache_mb=0.1,
+                   cache_arena=True)
+    clf2.fit(bin_dense, bin_target)
+    assert_array_almost_equal(clf.coef_, clf2.coef_)
+
+
+def test_cache_symmetric():
+    clf = DualSVC(kernel="rbf", gamma=0.1, random_state=0)
+    clf.fit(mult_dense, mult_target)
+    clf2 = DualSVC(kernel="rbf", gamma=0.1, random_state=0,
+                   cache_symmetric=True)
+    clf2.fit(mult_dense, mult_target)
+    assert_array_almost_equal(clf.coef_, clf2.coef_)
+    assert_true(clf2.cache_stats_["evaluations"] <
+                clf.cache_stats_["evaluations"])
+
+
+def test_prefetch():
+    clf = DualSVC(kernel="rbf", gamma=0.1, random_state=0)
+    clf.fit(mult_dense, mult_target)
+    clf2 = DualSVC(kernel="rbf", gamma=0.1, random_state=0, prefetch=3)
+    clf2.fit(mult_dense, mult_target)
+    assert_array_almost_equal(clf.coef_, clf2.coef_)
+    assert_true(clf2.cache_stats_["prefetch_hits"] +
+                clf2.cache_stats_["prefetch_late"] > 0)
+
+    # Each subproblem thread prefetches into its fork of the cache.
+    clf = DualSVC(kernel="rbf", gamma=0.1, random_state=0, ovr_jobs=3)
+    clf.fit(mult_dense, mult_target)
+    clf2 = DualSVC(kernel="rbf", gamma=0.1, random_state=0, ovr_jobs=3,
+                   prefetch=3)
+    clf2.fit(mult_dense, mult_target)
+    assert_array_almost_equal(clf.coef_, clf2.coef_)
+    assert_true(clf2.cache_stats_["prefetch_hits"] +
+                clf2.cache_stats_["prefetch_late"] > 0)
+
+
+def test_cache_aware_selection():
+    clf = DualSVC(kernel="rbf", gamma=0.1, random_state=0, cache_mb=0.05)
+    clf.fit(mult_dense, mult_target)
+    clf2 = DualSVC(kernel="rbf", gamma=0.1, random_state=0, cache_mb=0.05,
+                   selection="cache_aware")
+    clf2.fit(mult_dense, mult_target)
+    assert_equal(clf2.score(mult_dense, mult_target), 1.0)
+    assert_true(clf2.cache_stats_["misses"] < clf.cache_stats_["misses"])
+
+
+def test_ovr_jobs():
+    clf = DualSVC(kernel="rbf", gamma=0.1, random_state=0)
+    clf.fit(mult_dense, mult_target)
+    clf2 = DualSVC(kernel="rbf", gamma=0.1, random_state=0, ovr_jobs=3)
+    clf2.fit(mult_dense, mult_target)
+    assert_array_equal(clf.predict(mult_dense), clf2.predict(mult_dense))
+
+
+def test_gamma_sweep():
+    kernel = get_kernel("rbf", gamma=0.1)
+    kcache = KernelCache(kernel, bin_dense.shape[0], 50, 1, 0,
+                         base_values=True)
+
+    evaluations = []
+    for gamma in (0.1, 0.5):
+        clf = DualSVC(kernel="rbf", gamma=gamma, random_state=0)
+        clf.fit(bin_dense, bin_target, kcache=kcache)
+        clf2 = DualSVC(kernel="rbf", gamma=gamma, random_state=0)
+        clf2.fit(bin_dense, bin_target)
+        assert_array_almost_equal(clf.coef_, clf2.coef_)
+        evaluations.append(kcache.get_stats()["evaluations"])
+
+    # The second fit only used the distances computed by the first one.
+    assert_true(evaluations[0] > 0)
+    assert_equal(evaluations[1], evaluations[0])
+
+
+def test_cache_mb_auto():
+    clf = DualSVC(kernel="rbf", gamma=0.1, random_state=0, cache_mb="auto")
+    clf.fit(mult_dense, mult_target)
+    assert_equal(clf.score(mult_dense, mult_target), 1.0)
+    # The Gram matrix and its bitmaps.
+    gram_mb = 300 * (300 * 8 + 5 * 8) / float(1 << 20)
+    assert_true(0 < clf.cache_mb_ <= gram_mb)
+
+
+def test_memory_limit():
+    # X, Y and coef_ take about 0.24 MB.
+    clf = DualSVC(kernel="rbf", gamma=0.1, random_state=0, memory_limit=0.3)
+    clf.fit(mult_dense, mult_target)
+    used_mb = (300 * 100 + 2 * 300 * 3) * 8 / float(1 << 20)
+    assert_almost_equal(clf.cache_mb_, 0.3 - used_mb)
+
+    clf.set_params(memory_limit=0.1)
+    assert_raises(ValueError, clf.fit, mult_dense, mult_target)
+
+
+def test_compact_sv():
+    clf = DualSVC(kernel="rbf", gamma=0.1, random_state=0,
+                  selection="active")
+    clf.fit(mult_dense, mult_target)
+    clf2 = DualSVC(kernel="rbf", gamma=0.1, random_state=0,
+                   selection="active", compact_sv=True)
+    clf2.fit(mult_dense, mult_target)
+    assert_array_almost_equal(clf.coef_, clf2.coef_)
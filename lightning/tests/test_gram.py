@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import scipy.sparse as sp
+
+from numpy.lib.format import open_memmap
+from numpy.testing import assert_array_almost_equal
+from nose.tools import assert_raises, assert_true, assert_false, \
+                       assert_equal
+
+from sklearn.datasets.samples_generator import make_classification
+from sklearn.metrics.pairwise import pairwise_kernels
+
+from lightning.dual_cd import DualSVC
+from lightning.kernel_fast import KernelCache, PrecomputedKernel
+from lightning.gram import gram_matrix, gram_matrix_path
+
+X, y = make_classification(n_samples=100, n_features=10, n_informative=5,
+                           n_classes=2, random_state=0)
+X_csr = sp.csr_matrix(X)
+
+
+def test_gram_matrix():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        K = pairwise_kernels(X, metric="rbf", gamma=0.1)
+        for n_jobs in (1, 2):
+            G = gram_matrix(X, cache_dir, kernel="rbf", gamma=0.1,
+                            block_size=30, n_jobs=n_jobs)
+            assert_true(isinstance(G, np.memmap))
+            assert_array_almost_equal(K, G)
+            os.remove(G.filename)
+
+        # The second call maps the stored matrix.
+        path = gram_matrix_path(X, cache_dir, kernel="rbf", gamma=0.1)
+        G = gram_matrix(X, cache_dir, kernel="rbf", gamma=0.1)
+        mtime = os.path.getmtime(path)
+        G = gram_matrix(X, cache_dir, kernel="rbf", gamma=0.1)
+        assert_equal(G.filename, path)
+        assert_equal(os.path.getmtime(path), mtime)
+
+        # Other data or kernel parameters get their own file.
+        G = gram_matrix(X_csr, cache_dir, kernel="rbf", gamma=0.1)
+        assert_array_almost_equal(K, G)
+        G = gram_matrix(X, cache_dir, kernel="rbf", gamma=0.2)
+        assert_true(G.filename != path)
+        assert_equal(len(os.listdir(cache_dir)), 3)
+
+        assert_raises(ValueError, gram_matrix, X, cache_dir,
+                      kernel="precomputed")
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_gram_matrix_precomputed():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        G = gram_matrix(X, cache_dir, kernel="rbf", gamma=0.1)
+        assert_false(G.flags.writeable)
+        clf = DualSVC(kernel="precomputed", random_state=0).fit(G, y)
+        clf2 = DualSVC(kernel="rbf", gamma=0.1, random_state=0).fit(X, y)
+        assert_array_almost_equal(clf.decision_function(G),
+                                  clf2.decision_function(X))
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_gram_matrix_columns():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        G = gram_matrix(X, cache_dir, kernel="rbf", gamma=0.1)
+        # Columns are read from the (contiguous) rows: a non-symmetric
+        # matrix shows which one is used.
+        M = np.ascontiguousarray(G + np.arange(100.0)[:, np.newaxis])
+        out = np.zeros(100, dtype=np.float64)
+
+        for capacity in (0, 10):
+            kcache = KernelCache(PrecomputedKernel(), 100, capacity, 1, 0)
+            kcache2 = KernelCache(PrecomputedKernel(), 100, capacity, 1, 0)
+            for j in (0, 17, 99):
+                kcache.compute_column(G, G, j, out)
+                assert_array_almost_equal(G[:, j], out)
+                assert_array_almost_equal(G[j], out)
+                kcache2.compute_column(M, M, j, out)
+                assert_array_almost_equal(M[j], out)
+
+        kcache = KernelCache(PrecomputedKernel(), 100, 10, 1, 0)
+        kcache.add_sv(3)
+        kcache.add_sv(50)
+        out[:] = 0
+        kcache.compute_column_sv(M, M, 17, out)
+        assert_array_almost_equal(M[17, [3, 50]], out[[3, 50]])
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_gram_matrix_large():
+    # A store with more than 2^31 entries, written as a sparse file: only
+    # the pages of its last row hold data.
+    n = 46341
+    X_large = np.random.RandomState(0).rand(n, 2)
+    cache_dir = tempfile.mkdtemp()
+    try:
+        path = gram_matrix_path(X_large, cache_dir)
+        K = open_memmap(path, mode="w+", dtype=np.float64, shape=(n, n))
+        K[n - 1] = np.arange(n, dtype=np.float64)
+        K.flush()
+        K = None
+
+        G = gram_matrix(X_large, cache_dir)
+        kernel = PrecomputedKernel()
+        assert_equal(kernel.compute(G, n - 1, G, n - 1), n - 1)
+
+        kcache = KernelCache(kernel, n, 0, 1, 0)
+        out = np.zeros(n, dtype=np.float64)
+        kcache.compute_column(G, G, n - 1, out)
+        assert_array_almost_equal(out, np.arange(n))
+        G = None
+    finally:
+        shutil.rmtree(cache_dir)
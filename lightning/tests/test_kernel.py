@@ -1,26 +1,44 @@
+import os
+import shutil
+import tempfile
+import time
+
 import numpy as np
 import scipy.sparse as sp
 
 from numpy.testing import assert_array_equal, assert_array_almost_equal, \
                           assert_almost_equal
-from nose.tools import assert_raises, assert_true, assert_equal
+from nose.tools import assert_raises, assert_true, assert_false, \
+                       assert_equal
 
 from sklearn.datasets.samples_generator import make_classification
 from sklearn.metrics.pairwise import pairwise_kernels
 
+from lightning.kernel_fast import Kernel
 from lightning.kernel_fast import RbfKernel
 from lightning.kernel_fast import LinearKernel
 from lightning.kernel_fast import PolynomialKernel
 from lightning.kernel_fast import PrecomputedKernel
+from lightning.kernel_fast import IntersectionKernel
+from lightning.kernel_fast import AdditiveChi2Kernel
+from lightning.kernel_fast import BinaryLinearKernel
+from lightning.kernel_fast import HammingKernel
+from lightning.kernel_fast import JaccardKernel
+from lightning.kernel_fast import pack_binary
 from lightning.kernel_fast import KernelCache
+from lightning import shared_cache_fast
+from lightning.shared_cache_fast import SharedKernelCache
 
 
 X, _ = make_classification(n_samples=20, n_features=10,
                            n_informative=5,
                            n_classes=2, random_state=0)
 X2 = X ** 2
+X_csr = sp.csr_matrix(X)
 
-capacity = 4 * 20 * 8 # 4 columns of 20 doubles
+# 20 doubles and a one-word validity bitmap per column.
+col_size = 20 * 8 + 8
+capacity = 4 * col_size
 
 def _test_equal(K, kernel, X2):
     n_samples = K.shape[0]
@@ -57,6 +75,137 @@ def test_precomputed_kernel():
     _test_equal(K, kernel, K)
 
 
+def test_precomputed_kernel_large():
+    # Row offsets past 2^31 entries. The file is sparse: only the page
+    # holding the last entry is written.
+    n = 46341
+    tmp = tempfile.mkdtemp()
+    try:
+        K = np.memmap(os.path.join(tmp, "K.dat"), dtype=np.float64,
+                      mode="w+", shape=(n, n))
+        K[n - 1, n - 1] = 3.0
+        K[n - 1, 0] = 2.0
+        kernel = PrecomputedKernel()
+        assert_equal(kernel.compute(K, n - 1, K, n - 1), 3.0)
+        assert_equal(kernel.compute(K, n - 1, K, 0), 2.0)
+        K = None
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_intersection_kernel():
+    H = np.abs(X)
+    K = np.minimum(H[:, np.newaxis], H[np.newaxis, :]).sum(axis=2)
+    _test_equal(K, IntersectionKernel(), H)
+
+
+def test_additive_chi2_kernel():
+    H = np.abs(X)
+    S = H[:, np.newaxis] + H[np.newaxis, :]
+    K = (2 * H[:, np.newaxis] * H[np.newaxis, :] / S).sum(axis=2)
+    _test_equal(K, AdditiveChi2Kernel(), H)
+
+
+def test_binary_kernels():
+    # More than 64 features, so that rows span several words.
+    B = np.hstack((X, X ** 2, -X, X, X, X, X)) > 0.5
+    Bf = B.astype(np.float64)
+    P = pack_binary(B)
+    assert_equal(P.shape, (20, 2))
+    assert_array_equal(pack_binary(sp.csr_matrix(Bf)), P)
+
+    _test_equal(np.dot(Bf, Bf.T), BinaryLinearKernel(), P)
+    _test_equal(pairwise_kernels(Bf, metric="rbf", gamma=0.1),
+                HammingKernel(gamma=0.1), P)
+    n_and = np.dot(Bf, Bf.T)
+    n_or = Bf.sum(axis=1)[:, np.newaxis] + Bf.sum(axis=1) - n_and
+    _test_equal(n_and / n_or, JaccardKernel(), P)
+
+    K = np.zeros((20, 20), dtype=np.float64)
+    HammingKernel(gamma=0.1).compute_block(P, None, P, None, K)
+    assert_array_almost_equal(pairwise_kernels(Bf, metric="rbf", gamma=0.1),
+                              K)
+
+    assert_raises(ValueError, JaccardKernel().compute, Bf, 0, Bf, 1)
+    assert_raises(ValueError, LinearKernel().compute, P, 0, P, 1)
+
+
+def test_compute_block():
+    rows = np.array([3, 0, 7], dtype=np.int32)
+    cols = np.array([5, 19], dtype=np.int32)
+
+    for kernel, K in ((LinearKernel(), pairwise_kernels(X, metric="linear")),
+                      (PolynomialKernel(degree=3, coef0=1.0, gamma=0.1),
+                       pairwise_kernels(X, metric="polynomial", degree=3,
+                                        coef0=1.0, gamma=0.1)),
+                      (RbfKernel(gamma=0.1),
+                       pairwise_kernels(X, metric="rbf", gamma=0.1))):
+        out = np.zeros((20, 20), dtype=np.float64)
+        kernel.compute_block(X, None, X, None, out)
+        assert_array_almost_equal(K, out)
+
+        out = np.zeros((3, 2), dtype=np.float64)
+        kernel.compute_block(X, rows, X, cols, out)
+        assert_array_almost_equal(K[rows][:, cols], out)
+
+
+def test_compute_block_precomputed():
+    K = np.dot(X, X.T)
+    kernel = PrecomputedKernel()
+    out = np.zeros((2, 3), dtype=np.float64)
+    kernel.compute_block(K, [1, 4], K, [0, 2, 3], out)
+    assert_array_almost_equal(K[[1, 4]][:, [0, 2, 3]], out)
+
+
+def test_sparse_kernels():
+    for kernel, metric, params in ((LinearKernel(), "linear", {}),
+                                   (PolynomialKernel(degree=3, coef0=1.0,
+                                                     gamma=0.1),
+                                    "polynomial",
+                                    dict(degree=3, coef0=1.0, gamma=0.1)),
+                                   (RbfKernel(gamma=0.1), "rbf",
+                                    dict(gamma=0.1))):
+        K = pairwise_kernels(X, metric=metric, **params)
+
+        for i in (0, 5):
+            assert_almost_equal(K[i, i], kernel.compute_self(X_csr, i))
+            for j in (0, 3, 19):
+                assert_almost_equal(K[i, j], kernel.compute(X_csr, i,
+                                                            X_csr, j))
+
+        out = np.zeros((2, 3), dtype=np.float64)
+        kernel.compute_block(X_csr, [1, 4], X_csr, [0, 2, 3], out)
+        assert_array_almost_equal(K[[1, 4]][:, [0, 2, 3]], out)
+
+        for cap in (0, capacity):
+            kcache = KernelCache(kernel, 20, cap, 0, 0)
+            out = np.zeros(20, dtype=np.float64)
+            kcache.compute_column(X_csr, X_csr, 7, out)
+            assert_array_almost_equal(K[:, 7], out)
+
+            kcache.add_sv(2)
+            kcache.add_sv(11)
+            out *= 0
+            kcache.compute_column_sv(X_csr, X_csr, 8, out)
+            assert_almost_equal(K[2, 8], out[2])
+            assert_almost_equal(K[11, 8], out[11])
+
+            # Complete a partially computed column.
+            kcache.compute_column(X_csr, X_csr, 8, out)
+            assert_array_almost_equal(K[:, 8], out)
+
+            kcache.compute_diag(X_csr, out)
+            assert_array_almost_equal(np.diag(K), out)
+
+    kcache = KernelCache(LinearKernel(), 20, capacity, 0, 0)
+    assert_raises(ValueError, kcache.compute_column, X_csr, X, 0, out)
+    assert_raises(ValueError, PrecomputedKernel().compute, X_csr, 0, X_csr, 0)
+
+
+def test_abstract_kernel():
+    assert_raises(TypeError, Kernel)
+
+
 def test_kernel_cache_compute():
     kernel = RbfKernel(gamma=0.1)
     kcache = KernelCache(kernel, 20, capacity, 0, 0)
@@ -74,6 +223,18 @@ def test_kernel_cache_add_remove():
 
     kcache.remove_sv(1)
     assert_equal(kcache.n_sv(), 2)
+    # The last support vector takes the place of the removed one.
+    assert_array_equal(kcache.get_support_set(), [0, 2])
+
+    kcache.add_sv(7)
+    kcache.add_sv(2)
+    kcache.remove_sv(0)
+    kcache.remove_sv(5)
+    assert_array_equal(kcache.get_support_set(), [7, 2])
+
+    kcache.remove_sv(7)
+    kcache.remove_sv(2)
+    assert_equal(len(kcache.get_support_set()), 0)
 
 
 def test_kernel_cache_column():
@@ -85,35 +246,37 @@ def test_kernel_cache_column():
     # Compute a first column.
     kcache.compute_column(X, X, 12, out)
     assert_array_almost_equal(K[:, 12], out)
-    assert_equal(kcache.get_size(), 160)
+    assert_equal(kcache.get_size(), col_size)
 
     # Check that the works.
     kcache.compute_column(X2, X2, 12, out)
     assert_array_almost_equal(K[:, 12], out)
-    assert_equal(kcache.get_size(), 160)
+    assert_equal(kcache.get_size(), col_size)
 
     # Compute more columns.
     kcache.compute_column(X, X, 13, out)
     assert_array_almost_equal(K[:, 13], out)
-    assert_equal(kcache.get_size(), 320)
+    assert_equal(kcache.get_size(), 2 * col_size)
 
     kcache.compute_column(X, X, 14, out)
     assert_array_almost_equal(K[:, 14], out)
-    assert_equal(kcache.get_size(), 480)
+    assert_equal(kcache.get_size(), 3 * col_size)
 
     kcache.compute_column(X, X, 15, out)
     assert_array_almost_equal(K[:, 15], out)
-    assert_equal(kcache.get_size(), 640)
+    assert_equal(kcache.get_size(), 4 * col_size)
 
-    # Maximum size reached.
+    # Maximum size reached: the least recently used column is evicted.
     kcache.compute_column(X, X, 16, out)
     assert_array_almost_equal(K[:, 16], out)
-    assert_equal(kcache.get_size(), 480)
+    assert_equal(kcache.get_size(), 4 * col_size)
+    assert_false(kcache.is_cached(12))
+    assert_true(kcache.is_cached(13))
 
     # Check that cache works.
     kcache.compute_column(X2, X2, 16, out)
     assert_array_almost_equal(K[:, 16], out)
-    assert_equal(kcache.get_size(), 480)
+    assert_equal(kcache.get_size(), 4 * col_size)
 
 
 def test_kernel_cache_column_sv():
@@ -130,7 +293,7 @@ def test_kernel_cache_column_sv():
     kcache.add_sv(3)
     # That's a limitation of the current implementation:
     # it allocates a full column.
-    size += 20 * 8
+    size += col_size
 
     # Compute values.
     kcache.compute_column_sv(X, X, 7, out)
@@ -172,7 +335,7 @@ def test_kernel_cache_column_sv():
 
     # Compute an entire new column.
     kcache.compute_column(X, X, 8, out)
-    size += 20 * 8
+    size += col_size
     assert_array_almost_equal(K[:, 8], out)
     assert_equal(size, kcache.get_size())
 
@@ -219,6 +382,449 @@ def test_kernel_cache_column_sv():
 
     # Remove existing column.
     kcache.remove_column(8)
-    size -= 20 * 8
+    size -= col_size
     assert_equal(size, kcache.get_size())
 
+
+def test_kernel_cache_zero_values():
+    # Orthogonal samples: zero kernel values must be served from the cache.
+    X = np.zeros((20, 3), dtype=np.float64)
+    X[::2, 0] = 1
+    X[1::2, 1] = 1
+    K = np.dot(X, X.T)
+    kcache = KernelCache(LinearKernel(), 20, capacity, 0, 0)
+    out = np.zeros(20, dtype=np.float64)
+
+    kcache.add_sv(1)
+    kcache.add_sv(2)
+    kcache.compute_column_sv(X, X, 0, out)
+    assert_equal(out[1], 0)
+    assert_equal(out[2], 1)
+
+    # Cached values are returned even if the input changes.
+    X2 = X + 1
+    out *= 0
+    kcache.compute_column_sv(X2, X2, 0, out)
+    assert_equal(out[1], 0)
+    assert_equal(out[2], 1)
+
+    kcache.compute_column(X, X, 0, out)
+    assert_array_equal(K[:, 0], out)
+    kcache.compute_column(X2, X2, 0, out)
+    assert_array_equal(K[:, 0], out)
+
+    # Removing a support vector keeps its cached values.
+    kcache.remove_sv(1)
+    kcache.add_sv(1)
+    out *= 0
+    kcache.compute_column_sv(X2, X2, 0, out)
+    assert_equal(out[1], 0)
+    assert_equal(out[2], 1)
+
+
+def test_kernel_cache_float32():
+    K = pairwise_kernels(X, metric="rbf", gamma=0.1)
+    kernel = RbfKernel(gamma=0.1)
+    # Nearly twice as many float32 columns fit in the same budget.
+    kcache = KernelCache(kernel, 20, capacity, 0, 0, dtype="float32")
+    out = np.zeros(20, dtype=np.float64)
+
+    for j in xrange(7):
+        kcache.compute_column(X, X, j, out)
+        assert_array_almost_equal(K[:, j], out, decimal=6)
+    assert_equal(kcache.get_size(), 7 * (20 * 4 + 8))
+    assert_true(kcache.is_cached(0))
+
+    # Cached values are widened on read.
+    kcache.compute_column(X2, X2, 0, out)
+    assert_array_almost_equal(K[:, 0], out, decimal=6)
+
+    kcache.add_sv(3)
+    kcache.add_sv(9)
+    out *= 0
+    kcache.compute_column_sv(X, X, 10, out)
+    assert_almost_equal(K[3, 10], out[3], decimal=6)
+    assert_almost_equal(K[9, 10], out[9], decimal=6)
+
+    assert_raises(ValueError, KernelCache, kernel, 20, 0, 0, 0, "lru",
+                  "float16")
+
+
+def test_kernel_cache_spill():
+    K = pairwise_kernels(X, metric="rbf", gamma=0.1)
+    kernel = RbfKernel(gamma=0.1)
+    # Two columns in memory, three on disk.
+    kcache = KernelCache(kernel, 20, 2 * col_size, 0, 0,
+                         spill_capacity=3 * col_size)
+    out = np.zeros(20, dtype=np.float64)
+
+    for j in xrange(5):
+        kcache.compute_column(X, X, j, out)
+    stats = kcache.get_stats()
+    assert_equal(stats["misses"], 5)
+    assert_equal(stats["spilled"], 3)
+
+    # Columns 0-2 come back from disk, even with a different input.
+    for j in xrange(3):
+        kcache.compute_column(X2, X2, j, out)
+        assert_array_almost_equal(K[:, j], out)
+    stats = kcache.get_stats()
+    assert_equal(stats["disk_hits"], 3)
+    assert_equal(stats["misses"], 5)
+
+    kcache.compute_column(X2, X2, 2, out)
+    assert_array_almost_equal(K[:, 2], out)
+    assert_equal(kcache.get_stats()["memory_hits"], 1)
+
+    # Partially computed columns are spilled with their valid entries.
+    kcache = KernelCache(kernel, 20, col_size, 0, 0,
+                         spill_capacity=3 * col_size)
+    kcache.add_sv(3)
+    kcache.compute_column_sv(X, X, 0, out)
+    kcache.compute_column(X, X, 1, out)
+    assert_equal(kcache.get_stats()["spilled"], 1)
+    kcache.add_sv(4)
+    out *= 0
+    kcache.compute_column_sv(X2, X2, 0, out)
+    assert_almost_equal(K[3, 0], out[3])
+    assert_false(np.allclose(K[4, 0], out[4]))
+
+
+def test_kernel_cache_n_jobs():
+    K = pairwise_kernels(X, metric="rbf", gamma=0.1)
+    kernel = RbfKernel(gamma=0.1)
+
+    for X_ in (X, X_csr):
+        for cap in (0, capacity):
+            kcache = KernelCache(kernel, 20, cap, 0, 0, n_jobs=-1)
+            out = np.zeros(20, dtype=np.float64)
+
+            for sv in (0, 3, 11, 12):
+                kcache.add_sv(sv)
+            kcache.compute_column_sv(X_, X_, 5, out)
+            assert_array_almost_equal(K[[0, 3, 11, 12], 5],
+                                      out[[0, 3, 11, 12]])
+
+            kcache.compute_column(X_, X_, 5, out)
+            assert_array_almost_equal(K[:, 5], out)
+
+            kcache.compute_diag(X_, out)
+            assert_array_almost_equal(np.diag(K), out)
+
+
+def test_kernel_cache_compact():
+    K = pairwise_kernels(X, metric="rbf", gamma=0.1)
+    kernel = RbfKernel(gamma=0.1)
+    kcache = KernelCache(kernel, 20, capacity, 0, 0, compact_sv=True)
+    out = np.zeros(20, dtype=np.float64)
+
+    for i in (3, 8, 12):
+        kcache.add_sv(i)
+    kcache.compute_column_sv(X, X, 0, out)
+    kcache.compute_column_sv(X, X, 1, out)
+    # 16 entries and a one-word bitmap per column.
+    assert_equal(kcache.get_size(), 2 * (16 * 8 + 8))
+
+    # Entries follow the support vectors they belong to.
+    kcache.remove_sv(3)
+    kcache.add_sv(5)
+    out *= 0
+    kcache.compute_column_sv(X2, X2, 0, out)
+    assert_almost_equal(K[8, 0], out[8])
+    assert_almost_equal(K[12, 0], out[12])
+    assert_false(np.allclose(K[5, 0], out[5]))
+    assert_equal(out[3], 0)
+
+    kcache.compute_column_sv(X, X, 1, out)
+    assert_array_almost_equal(K[[8, 12, 5], 1], out[[8, 12, 5]])
+
+    # Full columns are not cached.
+    kcache.compute_column(X, X, 2, out)
+    assert_array_almost_equal(K[:, 2], out)
+    assert_false(kcache.is_cached(2))
+
+    assert_raises(ValueError, KernelCache, kernel, 20, capacity, 0, 0,
+                  spill_capacity=capacity, compact_sv=True)
+
+
+def test_kernel_cache_arena():
+    K = pairwise_kernels(X, metric="rbf", gamma=0.1)
+    kernel = RbfKernel(gamma=0.1)
+    out = np.zeros(20, dtype=np.float64)
+
+    for dtype in ("float64", "float32"):
+        kcache = KernelCache(kernel, 20, capacity, 0, 0, dtype=dtype,
+                             arena=True, huge_pages=True)
+        kcache.add_sv(3)
+        for j in xrange(10):
+            kcache.compute_column_sv(X, X, j, out)
+            kcache.compute_column(X, X, j, out)
+            assert_array_almost_equal(K[:, j], out)
+        assert_true(kcache.get_size() <= capacity)
+
+        # Freed blocks are reused, with an empty bitmap.
+        kcache.remove_column(9)
+        kcache.compute_column_sv(X2, X2, 0, out)
+        assert_false(np.allclose(K[3, 0], out[3]))
+        assert_true(kcache.is_cached(0))
+
+    # Columns come back from the disk tier into arena blocks.
+    kcache = KernelCache(kernel, 20, 2 * col_size, 0, 0, arena=True,
+                         spill_capacity=3 * col_size)
+    for j in xrange(5):
+        kcache.compute_column(X, X, j, out)
+    for j in xrange(3):
+        kcache.compute_column(X2, X2, j, out)
+        assert_array_almost_equal(K[:, j], out)
+    assert_equal(kcache.get_stats()["disk_hits"], 3)
+
+    assert_raises(ValueError, KernelCache, kernel, 20, capacity, 0, 0,
+                  compact_sv=True, arena=True)
+
+
+def test_kernel_cache_symmetric():
+    K = pairwise_kernels(X, metric="rbf", gamma=0.1)
+    kernel = RbfKernel(gamma=0.1)
+    kcache = KernelCache(kernel, 20, capacity, 0, 0, symmetric=True)
+    out = np.zeros(20, dtype=np.float64)
+
+    kcache.compute_column(X, X, 0, out)
+    assert_equal(kcache.get_stats()["evaluations"], 20)
+
+    # K[0, 1] is taken from column 0.
+    kcache.compute_column(X, X, 1, out)
+    assert_array_almost_equal(K[:, 1], out)
+    assert_equal(kcache.get_stats()["evaluations"], 39)
+
+    # K[3, 2] is propagated to column 3.
+    kcache.add_sv(2)
+    kcache.compute_column_sv(X, X, 3, out)
+    assert_almost_equal(K[2, 3], out[2])
+    kcache.compute_column(X, X, 2, out)
+    assert_array_almost_equal(K[:, 2], out)
+    assert_equal(kcache.get_stats()["evaluations"], 39 + 1 + 17)
+    kcache.compute_column(X, X, 3, out)
+    assert_array_almost_equal(K[:, 3], out)
+    assert_equal(kcache.get_stats()["evaluations"], 57 + 17)
+
+    # A column coming back is prefilled from columns 1, 2 and 3.
+    kcache.remove_column(0)
+    kcache.compute_column(X, X, 0, out)
+    assert_array_almost_equal(K[:, 0], out)
+    assert_equal(kcache.get_stats()["evaluations"], 74 + 17)
+
+    assert_raises(ValueError, KernelCache, kernel, 20, capacity, 0, 0,
+                  compact_sv=True, symmetric=True)
+
+
+def test_kernel_cache_fork():
+    K = pairwise_kernels(X, metric="rbf", gamma=0.1)
+    kernel = RbfKernel(gamma=0.1)
+    kcache = KernelCache(kernel, 20, capacity, 0, 0)
+    fork = kcache.fork()
+    out = np.zeros(20, dtype=np.float64)
+
+    # Columns are shared.
+    kcache.compute_column(X, X, 3, out)
+    fork.compute_column(X, X, 3, out)
+    assert_array_almost_equal(K[:, 3], out)
+    stats = fork.get_stats()
+    assert_equal(stats["misses"], 1)
+    assert_equal(stats["memory_hits"], 1)
+    assert_equal(stats["evaluations"], 20)
+
+    # Support sets are not.
+    fork.add_sv(5)
+    assert_equal(fork.n_sv(), 1)
+    assert_equal(kcache.n_sv(), 0)
+    fork.remove_column(3)
+    assert_false(kcache.is_cached(3))
+
+    kcache = KernelCache(kernel, 20, capacity, 0, 0, compact_sv=True)
+    assert_raises(ValueError, kcache.fork)
+
+
+def test_kernel_cache_base_values():
+    out = np.zeros(20, dtype=np.float64)
+
+    for X_ in (X, X_csr):
+        kcache = KernelCache(RbfKernel(gamma=0.1), 20, capacity, 0, 0,
+                             base_values=True)
+        kcache.add_sv(2)
+        kcache.add_sv(7)
+        for gamma in (0.1, 1.0):
+            K = pairwise_kernels(X, metric="rbf", gamma=gamma)
+            kcache.set_kernel(RbfKernel(gamma=gamma))
+            kcache.compute_column(X_, X_, 3, out)
+            assert_array_almost_equal(K[:, 3], out)
+            out[:] = 0
+            kcache.compute_column_sv(X_, X_, 4, out)
+            assert_array_almost_equal(K[[2, 7], 4], out[[2, 7]])
+        # Columns were only computed for the first gamma.
+        assert_equal(kcache.get_stats()["evaluations"], 22)
+
+    kcache = KernelCache(PolynomialKernel(degree=2, coef0=1, gamma=0.1),
+                         20, capacity, 0, 0, base_values=True)
+    for gamma in (0.1, 0.5):
+        K = pairwise_kernels(X, metric="poly", degree=2, coef0=1,
+                             gamma=gamma)
+        kcache.set_kernel(PolynomialKernel(degree=2, coef0=1, gamma=gamma))
+        kcache.compute_column(X, X, 3, out)
+        assert_array_almost_equal(K[:, 3], out)
+    assert_equal(kcache.get_stats()["evaluations"], 20)
+
+    # Kernel values are only kept for the same kernel.
+    kcache = KernelCache(RbfKernel(gamma=0.1), 20, capacity, 0, 0)
+    kcache.compute_column(X, X, 3, out)
+    kcache.set_kernel(RbfKernel(gamma=0.1))
+    assert_true(kcache.is_cached(3))
+    kcache.set_kernel(RbfKernel(gamma=1.0))
+    assert_false(kcache.is_cached(3))
+
+
+def _wait_evaluations(kcache, n_evals, timeout=10):
+    deadline = time.time() + timeout
+    while kcache.get_stats()["evaluations"] < n_evals:
+        if time.time() > deadline:
+            kcache.stop_prefetch()
+            raise AssertionError("%d kernel evaluations after %g seconds, "
+                                 "expected %d." %
+                                 (kcache.get_stats()["evaluations"], timeout,
+                                  n_evals))
+        time.sleep(0.01)
+
+
+def test_kernel_cache_prefetch():
+    K = pairwise_kernels(X, metric="rbf", gamma=0.1)
+    kernel = RbfKernel(gamma=0.1)
+    kcache = KernelCache(kernel, 20, capacity, 0, 0)
+    out = np.zeros(20, dtype=np.float64)
+    indices = np.array([4, 9, 1], dtype=np.int32)
+
+    kcache.start_prefetch(X, X, 2)
+    kcache.prefetch(indices, 0, 3)
+    _wait_evaluations(kcache, 40)
+    kcache.compute_column(X, X, 4, out)
+    assert_array_almost_equal(K[:, 4], out)
+
+    # Column 9 is dropped and column 1 is queued.
+    kcache.prefetch(indices, 2, 3)
+    _wait_evaluations(kcache, 60)
+    kcache.compute_column(X, X, 1, out)
+    assert_array_almost_equal(K[:, 1], out)
+    kcache.stop_prefetch()
+
+    stats = kcache.get_stats()
+    assert_equal(stats["prefetch_hits"], 2)
+    assert_equal(stats["prefetch_wasted"], 1)
+    assert_equal(stats["evaluations"], 60)
+
+
+def test_kernel_cache_prefetch_timeout():
+    # Columns slow enough to be caught while the worker computes them.
+    H = np.random.RandomState(0).rand(1000, 4000)
+    kernel = AdditiveChi2Kernel()
+    kcache = KernelCache(kernel, 1000, 100, 1, 0)
+    out = np.zeros(1000, dtype=np.float64)
+    indices = np.arange(5, dtype=np.int32)
+
+    # Without waiting for the worker, columns are computed in place.
+    kcache.start_prefetch(H, H, 1, timeout=0)
+    for k in xrange(5):
+        kcache.prefetch(indices, k, 5)
+        time.sleep(0.002)
+        kcache.compute_column(H, H, k, out)
+        assert_almost_equal(out[k], H[k].sum())
+    kcache.stop_prefetch()
+
+    stats = kcache.get_stats()
+    assert_true(stats["prefetch_timeouts"] > 0)
+    assert_true(stats["prefetch_timeouts"] <= stats["prefetch_late"])
+
+
+def test_shared_kernel_cache():
+    K = pairwise_kernels(X, metric="rbf", gamma=0.1)
+    out = np.zeros(20, dtype=np.float64)
+    shm_dir = tempfile.mkdtemp()
+    timeout = shared_cache_fast.ATTACH_TIMEOUT
+
+    try:
+        kcache = SharedKernelCache(RbfKernel(gamma=0.1), 20, capacity, 0, 0,
+                                   shm_dir=shm_dir)
+        kcache.compute_column(X, X, 4, out)
+        assert_array_almost_equal(K[:, 4], out)
+        assert_equal(kcache.get_stats()["misses"], 1)
+        name, = os.listdir(shm_dir)
+        kcache.unlink()
+
+        # A segment whose creator died before sizing it is replaced.
+        open(os.path.join(shm_dir, name), "w").close()
+        shared_cache_fast.ATTACH_TIMEOUT = 0.01
+        kcache = SharedKernelCache(RbfKernel(gamma=0.1), 20, capacity, 0, 0,
+                                   shm_dir=shm_dir)
+        kcache.compute_column(X, X, 4, out)
+        assert_array_almost_equal(K[:, 4], out)
+        assert_equal(os.listdir(shm_dir), [])
+    finally:
+        shared_cache_fast.ATTACH_TIMEOUT = timeout
+        shutil.rmtree(shm_dir)
+
+
+def test_kernel_cache_no_capacity():
+    K = pairwise_kernels(X, metric="rbf", gamma=0.1)
+    kernel = RbfKernel(gamma=0.1)
+    kcache = KernelCache(kernel, 20, 0, 0, 0)
+    out = np.zeros(20, dtype=np.float64)
+
+    kcache.compute_column(X, X, 4, out)
+    assert_array_almost_equal(K[:, 4], out)
+    assert_equal(kcache.get_size(), 0)
+
+
+def test_kernel_cache_fill_columns():
+    X_large, _ = make_classification(n_samples=50, n_features=10,
+                                     random_state=0)
+    K = pairwise_kernels(X_large, metric="rbf", gamma=0.1)
+    kcache = KernelCache(RbfKernel(gamma=0.1), 50, 100 * (50 * 8 + 8), 0, 0)
+    indices = np.arange(50, dtype=np.int32)
+
+    # The temporary block holds at most 32 columns.
+    kcache.fill_columns(X_large, X_large, indices, 0, 50)
+    assert_equal(kcache.get_stats()["evaluations"], 32 * 50)
+
+    kcache.fill_columns(X_large, X_large, indices, 0, 50)
+    assert_equal(kcache.get_stats()["evaluations"], 50 * 50)
+
+    out = np.zeros(50, dtype=np.float64)
+    kcache.compute_column(X_large, X_large, 45, out)
+    assert_array_almost_equal(K[:, 45], out)
+    assert_equal(kcache.get_stats()["evaluations"], 50 * 50)
+
+
+def test_kernel_cache_policies():
+    kernel = RbfKernel(gamma=0.1)
+    out = np.zeros(20, dtype=np.float64)
+
+    # Column 0 is used often but column 1 was used last.
+    kcache = KernelCache(kernel, 20, 2 * col_size, 0, 0, policy="lfu")
+    for j in (0, 0, 0, 1, 2):
+        kcache.compute_column(X, X, j, out)
+    assert_true(kcache.is_cached(0))
+    assert_false(kcache.is_cached(1))
+
+    kcache = KernelCache(kernel, 20, 2 * col_size, 0, 0, policy="lru")
+    for j in (0, 0, 0, 1, 2):
+        kcache.compute_column(X, X, j, out)
+    assert_false(kcache.is_cached(0))
+    assert_true(kcache.is_cached(1))
+
+    # Columns of support vectors are kept.
+    kcache = KernelCache(kernel, 20, 2 * col_size, 0, 0, policy="sv")
+    kcache.add_sv(0)
+    for j in (0, 1, 2):
+        kcache.compute_column(X, X, j, out)
+    assert_true(kcache.is_cached(0))
+    assert_false(kcache.is_cached(1))
+    assert_true(kcache.is_cached(2))
+
+    assert_raises(ValueError, KernelCache, kernel, 20, 0, 0, 0, "fifo")
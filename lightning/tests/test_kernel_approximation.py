@@ -0,0 +1,109 @@
+import numpy as np
+import scipy.sparse as sp
+
+from numpy.testing import assert_array_equal, assert_array_almost_equal, \
+                          assert_almost_equal
+from nose.tools import assert_raises, assert_true, assert_equal
+
+from sklearn.datasets.samples_generator import make_classification
+from sklearn.metrics.pairwise import pairwise_kernels
+
+from lightning.kernel_approximation import Nystroem
+from lightning.kernel_approximation import RandomFourierFeatures
+from lightning.kernel_approximation import TensorSketch
+from lightning.primal_cd import PrimalLinearSVC, PrimalSVC
+
+X, y = make_classification(n_samples=100, n_features=10, n_informative=5,
+                           n_classes=2, random_state=0)
+X_csr = sp.csr_matrix(X)
+
+
+def test_nystroem_exact():
+    # With all points as landmarks, the kernel is reproduced exactly.
+    K = pairwise_kernels(X, metric="rbf", gamma=0.1)
+    for selection in ("uniform", "kmeans++", "leverage"):
+        nys = Nystroem(gamma=0.1, n_components=100, selection=selection,
+                       random_state=0)
+        Z = nys.fit_transform(X)
+        assert_equal(Z.shape, (100, 100))
+        assert_array_equal(nys.component_indices_, np.arange(100))
+        assert_array_almost_equal(K, np.dot(Z, Z.T))
+
+
+def test_nystroem_selection():
+    K = pairwise_kernels(X, metric="rbf", gamma=0.1)
+    for selection in ("uniform", "kmeans++", "leverage"):
+        nys = Nystroem(gamma=0.1, n_components=30, selection=selection,
+                       random_state=0)
+        Z = nys.fit_transform(X)
+        assert_equal(Z.shape, (100, 30))
+        assert_equal(len(np.unique(nys.component_indices_)), 30)
+        assert_array_almost_equal(nys.components_,
+                                  X[nys.component_indices_])
+        # Landmark rows are reproduced exactly.
+        ind = nys.component_indices_
+        assert_array_almost_equal(K[ind][:, ind],
+                                  np.dot(Z[ind], Z[ind].T))
+        err = np.abs(K - np.dot(Z, Z.T)).mean()
+        assert_true(err < 0.05)
+
+    assert_raises(ValueError, Nystroem(selection="foo").fit, X)
+    assert_raises(ValueError, Nystroem(kernel="precomputed").fit, X)
+
+
+def test_nystroem_sparse():
+    nys = Nystroem(gamma=0.1, n_components=30, selection="kmeans++",
+                   random_state=0)
+    Z = nys.fit_transform(X)
+    Z2 = nys.fit_transform(X_csr)
+    assert_true(sp.issparse(nys.components_))
+    assert_array_almost_equal(Z, Z2)
+
+
+def test_nystroem_linear_svc():
+    nys = Nystroem(gamma=0.1, n_components=50, random_state=0)
+    Z = nys.fit_transform(X)
+    clf = PrimalLinearSVC(C=1.0, random_state=0)
+    clf.fit(Z, y)
+    assert_true(clf.score(Z, y) >= 0.9)
+
+
+def test_primal_svc_nystroem():
+    nys = Nystroem(gamma=0.1, n_components=50, selection="kmeans++",
+                   random_state=0)
+    clf = PrimalSVC(random_state=0, penalty="l2", kernel="rbf",
+                    gamma=0.1, C=0.5, components=nys)
+    clf.fit(X, y)
+    assert_equal(clf.components_.shape, (50, 10))
+    assert_true(clf.n_support_vectors() <= 50)
+    assert_true(clf.score(X, y) >= 0.9)
+
+
+def test_random_fourier_features():
+    K = pairwise_kernels(X, metric="rbf", gamma=0.1)
+    rff = RandomFourierFeatures(gamma=0.1, n_components=5000, random_state=0)
+    Z = rff.fit_transform(X)
+    assert_equal(Z.shape, (100, 5000))
+    assert_true(np.abs(K - np.dot(Z, Z.T)).mean() < 0.02)
+    assert_array_almost_equal(Z, rff.transform(X_csr))
+
+
+def test_tensor_sketch():
+    K = pairwise_kernels(X, metric="polynomial", degree=2, coef0=1,
+                         gamma=0.1)
+    ts = TensorSketch(degree=2, coef0=1, gamma=0.1, n_components=5000,
+                      random_state=0)
+    Z = ts.fit_transform(X)
+    assert_equal(Z.shape, (100, 5000))
+    err = np.abs(K - np.dot(Z, Z.T)).mean() / np.abs(K).mean()
+    assert_true(err < 0.1)
+    assert_array_almost_equal(Z, ts.transform(X_csr))
+
+
+def test_iter_transform():
+    for fmap in (RandomFourierFeatures(n_components=20, random_state=0),
+                 TensorSketch(n_components=20, random_state=0)):
+        Z = fmap.fit_transform(X)
+        chunks = list(fmap.iter_transform(X_csr, chunk_size=30))
+        assert_equal([c.shape[0] for c in chunks], [30, 30, 30, 10])
+        assert_array_almost_equal(Z, np.vstack(chunks))
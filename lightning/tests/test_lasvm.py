@@ -40,6 +40,36 @@ def test_fit_rbf_binary():
         assert_almost_equal(acc, 1.0)
 
 
+def test_fit_rbf_sparse():
+    clf = LaSVM(kernel="rbf", gamma=0.1, random_state=0)
+    clf.fit(mult_dense, mult_target)
+    clf2 = LaSVM(kernel="rbf", gamma=0.1, random_state=0)
+    clf2.fit(mult_sparse, mult_target)
+    assert_array_almost_equal(clf.decision_function(mult_dense),
+                              clf2.decision_function(mult_sparse), decimal=2)
+    assert_array_equal(clf.predict(mult_dense), clf2.predict(mult_sparse))
+
+
+def test_compact_sv():
+    clf = LaSVM(kernel="rbf", gamma=0.1, random_state=0)
+    clf.fit(mult_dense, mult_target)
+    clf2 = LaSVM(kernel="rbf", gamma=0.1, random_state=0, compact_sv=True)
+    clf2.fit(mult_dense, mult_target)
+    assert_array_almost_equal(clf.coef_, clf2.coef_, decimal=2)
+    assert_array_equal(clf.predict(mult_dense), clf2.predict(mult_dense))
+
+
+def test_cache_symmetric():
+    clf = LaSVM(kernel="rbf", gamma=0.1, random_state=0)
+    clf.fit(mult_dense, mult_target)
+    clf2 = LaSVM(kernel="rbf", gamma=0.1, random_state=0,
+                 cache_symmetric=True)
+    clf2.fit(mult_dense, mult_target)
+    assert_array_equal(clf.predict(mult_dense), clf2.predict(mult_dense))
+    assert_true(clf2.cache_stats_["evaluations"] <
+                clf.cache_stats_["evaluations"])
+
+
 def test_fit_rbf_multi():
     clf = LaSVM(kernel="rbf", gamma=0.1, random_state=0)
     clf.fit(mult_dense, mult_target)
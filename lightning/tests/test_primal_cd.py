@@ -1,3 +1,7 @@
+import os
+import shutil
+import tempfile
+
 import numpy as np
 import scipy.sparse as sp
 
@@ -6,6 +10,7 @@ from numpy.testing import assert_array_equal, assert_array_almost_equal, \
 from nose.tools import assert_raises, assert_true, assert_equal, \
                        assert_not_equal
 
+from sklearn.base import clone
 from sklearn.datasets.samples_generator import make_classification
 from sklearn.metrics.pairwise import pairwise_kernels
 
@@ -13,6 +18,7 @@ from lightning.primal_cd import PrimalLinearSVC, PrimalSVC, PrimalL2SVC
 from lightning.primal_cd import C_lower_bound, C_upper_bound
 
 from lightning.kernel_fast import get_kernel, KernelCache
+from lightning.shared_cache_fast import SharedKernelCache
 
 from primal_kernel import PrimalKernelSVC
 
@@ -71,6 +77,18 @@ def test_fit_rbf_binary_l1r_selection():
         assert_true(n_nz <= 86)
 
 
+def test_fit_rbf_binary_l1r_cache_aware():
+    clf = PrimalSVC(C=0.5, kernel="rbf", gamma=0.1, random_state=0,
+                    penalty="l1", cache_mb=0.05)
+    clf.fit(bin_dense, bin_target)
+    clf2 = PrimalSVC(C=0.5, kernel="rbf", gamma=0.1, random_state=0,
+                     penalty="l1", cache_mb=0.05, selection="cache_aware")
+    clf2.fit(bin_dense, bin_target)
+    assert_almost_equal(clf.score(bin_dense, bin_target),
+                        clf2.score(bin_dense, bin_target))
+    assert_true(clf2.cache_stats_["misses"] < clf.cache_stats_["misses"])
+
+
 def test_fit_rbf_multi():
     clf = PrimalSVC(penalty="l1", kernel="rbf", gamma=0.1, random_state=0)
     clf.fit(mult_dense, mult_target)
@@ -175,6 +193,18 @@ def test_fit_rbf_binary_l2r():
     assert_equal(n_nz, 200) # dense solution...
 
 
+def test_fit_rbf_sparse():
+    for penalty in ("l1", "l2"):
+        clf = PrimalSVC(C=0.5, kernel="rbf", gamma=0.1, random_state=0,
+                        penalty=penalty)
+        clf.fit(bin_dense, bin_target)
+        clf2 = PrimalSVC(C=0.5, kernel="rbf", gamma=0.1, random_state=0,
+                         penalty=penalty)
+        clf2.fit(bin_sparse, bin_target)
+        assert_array_almost_equal(clf.decision_function(bin_dense),
+                                  clf2.decision_function(bin_sparse))
+
+
 def test_warm_start_l2r():
     clf = PrimalLinearSVC(warm_start=True, random_state=0, penalty="l2")
 
@@ -350,6 +380,33 @@ def test_shared_kcache():
     assert_true(n_nz < n_nz2)
 
 
+def test_shared_memory_kcache():
+    shm_dir = tempfile.mkdtemp()
+    kernel = get_kernel("rbf", gamma=0.1)
+    n_samples = bin_dense.shape[0]
+
+    try:
+        # Stands for the caches of two worker processes.
+        kcache = SharedKernelCache(kernel, n_samples, 10, 1, 0,
+                                   shm_dir=shm_dir)
+        kcache2 = SharedKernelCache(kernel, n_samples, 10, 1, 0,
+                                    shm_dir=shm_dir)
+
+        clf = PrimalSVC(kernel="rbf", gamma=0.1, random_state=0,
+                        penalty="l1")
+        clf.fit(bin_dense, bin_target, kcache=kcache)
+        clf2 = clone(clf).fit(bin_dense.copy(), bin_target, kcache=kcache2)
+
+        assert_array_almost_equal(clf.coef_, clf2.coef_)
+        assert_equal(kcache2.get_stats()["misses"], 0)
+        assert_equal(kcache2.get_stats()["evaluations"], 0)
+
+        kcache.unlink()
+        assert_equal(os.listdir(shm_dir), [])
+    finally:
+        shutil.rmtree(shm_dir)
+
+
 def test_fit_rbf_binary_l2r_kernelized_selection():
     clf = PrimalSVC(C=1.0, random_state=0, penalty="l2", loss="squared_hinge",
                     max_iter=1, kernel="rbf", kernel_regularizer=True,
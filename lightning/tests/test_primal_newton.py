@@ -1,5 +1,6 @@
 
 import numpy as np
+import scipy.sparse as sp
 
 from numpy.testing import assert_array_equal, assert_array_almost_equal, \
                           assert_almost_equal
@@ -13,6 +14,7 @@ from lightning.primal_newton import PrimalNewton
 bin_dense, bin_target = make_classification(n_samples=200, n_features=100,
                                             n_informative=5,
                                             n_classes=2, random_state=0)
+bin_sparse = sp.csr_matrix(bin_dense)
 
 def test_primal_newton():
     clf = PrimalNewton(kernel="rbf", gamma=0.1, random_state=0, verbose=0)
@@ -26,3 +28,18 @@ def test_primal_newton_incremental():
     clf.fit(bin_dense, bin_target)
     assert_almost_equal(clf.score(bin_dense, bin_target), 1.0)
     assert_equal(clf.n_support_vectors(), 70)
+
+
+def test_primal_newton_unknown_kernel():
+    clf = PrimalNewton(kernel="sigmoid")
+    assert_raises(ValueError, clf.fit, bin_dense, bin_target)
+
+
+def test_primal_newton_sparse():
+    clf = PrimalNewton(kernel="rbf", gamma=0.1, random_state=0)
+    clf.fit(bin_dense, bin_target)
+    clf2 = PrimalNewton(kernel="rbf", gamma=0.1, random_state=0)
+    clf2.fit(bin_sparse, bin_target)
+    assert_true(sp.issparse(clf2.support_vectors_))
+    assert_array_almost_equal(clf.decision_function(bin_dense),
+                              clf2.decision_function(bin_sparse))
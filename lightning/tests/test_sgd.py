@@ -63,6 +63,15 @@ def test_binary_kernel_sgd():
         assert_equal(clf.score(bin_dense, bin_target), 1.0)
 
 
+def test_binary_kernel_sgd_sparse():
+    clf = KernelSGDClassifier(kernel="rbf", gamma=0.1, random_state=0)
+    clf.fit(bin_dense, bin_target)
+    clf2 = KernelSGDClassifier(kernel="rbf", gamma=0.1, random_state=0)
+    clf2.fit(sp.csr_matrix(bin_dense), bin_target)
+    assert_array_almost_equal(clf.decision_function(bin_dense),
+                              clf2.decision_function(sp.csr_matrix(bin_dense)))
+
+
 def test_multiclass_kernel_sgd():
     for fit_intercept in (True, False):
         clf = KernelSGDClassifier(kernel="rbf", gamma=0.1,